@@ -0,0 +1,75 @@
+"""Moves closed loans out of the transactions table, meant to run nightly.
+
+    python archive.py run
+    python archive.py run --older-than-days 730 --batch 5000
+    python archive.py status
+
+`transactions` keeps the open loans and the ones returned in the last
+LIBMGMT_ARCHIVE_AFTER_DAYS days (365 by default), so the loan screens,
+checkouts, returns and the fines engine work on a table sized by current
+circulation rather than by the age of the library. Older loans move to
+transactions_archive, a batch per transaction; history, reports and
+recommendation rebuilds read both tables.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from storage import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, StorageError, create_repository
+
+
+def run(repo, older_than_days=ARCHIVE_AFTER_DAYS, batch=ARCHIVE_BATCH, as_of=None, log=None):
+    """Archive the loans returned more than `older_than_days` ago. Returns the loans moved."""
+    if older_than_days < 0:
+        raise StorageError("The archive age cannot be negative")
+    cutoff = (as_of or datetime.now()).replace(microsecond=0) - timedelta(days=older_than_days)
+    start = time.perf_counter()
+    moved = 0
+    while True:
+        count = repo.archive_loans(cutoff, batch)
+        moved += count
+        if log and count:
+            rate = moved / max(time.perf_counter() - start, 1e-9)
+            log(f"archive: {moved} loans moved ({rate:,.0f} loans/s)")
+        if count < batch:
+            return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive closed loans")
+    parser.add_argument('action', choices=('run', 'status'))
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive loans returned more than this many days ago")
+    parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH, help="loans moved per transaction")
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            if args.action == 'run':
+                count = run(repo, args.older_than_days, args.batch,
+                            log=lambda msg: print(msg, file=sys.stderr))
+                print(f"archived {count} loans returned over {args.older_than_days} days ago")
+            else:
+                status = repo.archive_status()
+                print(f"transactions: {status['loans']} loans, {status['open_loans']} open,"
+                      f" oldest return {status['oldest_return'] or '-'}")
+                print(f"archive: {status['archived']} loans")
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""Benchmark every screen's query path against a synthetic library.
+
+    python benchmark.py --size 10k
+    python benchmark.py --size 100k --repeat 50 --output bench-100k.json
+    python benchmark.py --size 100k --baseline bench-100k.json
+
+A reproducible library of 10k, 100k or 1M books (with proportional
+students, loans and reviews) is generated from `--seed` into a fresh
+SQLite file, or into an empty MySQL database with --backend mysql.
+Generation is checkpointed per table, so an interrupted run resumes and
+a finished one is reused. Each operation behind the GUI screens is then
+timed `--repeat` times and the results are written as JSON. With
+--baseline, operations whose median got slower than --threshold times
+the baseline are reported and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from bulk_io import BATCH_SIZE, batches
+from catalog_cache import CatalogCache
+from executor import LatencyMetrics
+from storage import LOAN_DAYS, TABLE_COLUMNS, StorageError, create_repository
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+STUDENTS_PER_BOOK = 0.1
+LOANS_PER_BOOK = 2
+REVIEWS_PER_BOOK = 0.5
+OPEN_LOAN_SHARE = 0.05
+BASE_DATE = datetime(2025, 1, 1)  # fixed, so every run generates the same rows
+
+WORDS = (
+    "algebra algorithms analysis applied art biology business calculus chemistry "
+    "civil classical cloud compiler computing control data database design digital "
+    "discrete distributed economics electronics engineering english finance fluid "
+    "geometry graph history introduction language learning linear logic machine "
+    "management marketing mathematics mechanics medicine modern network networks "
+    "numerical operating organic physics principles probability programming python "
+    "quantum security signals software statistics structures systems theory thermodynamics"
+).split()
+CATEGORIES = (
+    "Computer Science", "Data & AI", "Programming", "Mathematics", "Physics",
+    "Chemistry", "Biology", "Economics", "Management", "Engineering", "Electronics",
+    "History", "Literature", "Languages", "Medicine", "Law", "Philosophy", "Arts",
+    "General", "Reference",
+)
+
+
+def _counts(books):
+    return {
+        'books': books,
+        'students': max(1, int(books * STUDENTS_PER_BOOK)),
+        'transactions': books * LOANS_PER_BOOK,
+        'reviews': int(books * REVIEWS_PER_BOOK),
+    }
+
+
+def _open_books(books, seed):
+    """Books out on loan: each has exactly one unreturned transaction."""
+    rng = random.Random(f"{seed}:open")
+    return rng.sample(range(1, books + 1), int(books * OPEN_LOAN_SHARE))
+
+
+def _title(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+
+
+def _rows(table, books, seed):
+    """Yield the rows of `table`, always the same ones for the same seed."""
+    counts = _counts(books)
+    rng = random.Random(f"{seed}:{table}")
+    if table == 'books':
+        issued = set(_open_books(books, seed))
+        for book_id in range(1, books + 1):
+            yield (book_id, _title(rng), rng.choice(CATEGORIES),
+                   'issued' if book_id in issued else 'available',
+                   BASE_DATE - timedelta(days=rng.randint(0, 3650)))
+    elif table == 'students':
+        for student_id in range(1, counts['students'] + 1):
+            yield (student_id, f"Student {student_id}", f"student{student_id}@example.edu",
+                   BASE_DATE - timedelta(days=rng.randint(0, 1500)))
+    elif table == 'transactions':
+        open_loans = _open_books(books, seed)
+        returned = counts['transactions'] - len(open_loans)
+        for transaction_id in range(1, counts['transactions'] + 1):
+            student_id = rng.randint(1, counts['students'])
+            if transaction_id <= returned:
+                book_id = rng.randint(1, books)
+                issued = BASE_DATE - timedelta(days=rng.randint(LOAN_DAYS + 1, 730),
+                                               seconds=rng.randint(0, 86399))
+                due = issued + timedelta(days=LOAN_DAYS)
+                returned_at = issued + timedelta(days=rng.randint(0, LOAN_DAYS + 10))
+                penalty = max(0, (returned_at - due).days) * 1.0
+            else:
+                book_id = open_loans[transaction_id - returned - 1]
+                issued = BASE_DATE - timedelta(days=rng.randint(0, 14), seconds=rng.randint(0, 86399))
+                due = issued + timedelta(days=LOAN_DAYS)
+                returned_at, penalty = None, 0.0
+            yield (transaction_id, book_id, student_id, issued, due, returned_at, penalty)
+    elif table == 'reviews':
+        for review_id in range(1, counts['reviews'] + 1):
+            # Skewed towards low ids, so a few books collect many reviews
+            book_id = 1 + int(books * rng.random() ** 3)
+            rating = rng.randint(1, 5)
+            yield (review_id, book_id, rng.randint(1, counts['students']),
+                   f"{rating} stars: " + " ".join(rng.choice(WORDS) for _ in range(12)),
+                   rating, BASE_DATE - timedelta(days=rng.randint(0, 1000), seconds=rng.randint(0, 86399)))
+
+
+def generate(repo, books, seed=1, batch_size=BATCH_SIZE, log=None):
+    """Fill an empty database with the synthetic library, resuming if interrupted."""
+    counts = _counts(books)
+    sources = {table: f"benchmark:{seed}:{books}:{table}" for table in counts}
+    if repo.import_checkpoint(sources['books']) == 0 and repo.catalog_version() != 0:
+        raise StorageError("The database already has books; benchmark into a fresh one")
+    # Parents first, for the foreign keys
+    for table in ('books', 'students', 'transactions', 'reviews'):
+        columns = TABLE_COLUMNS[table]
+        done = repo.import_checkpoint(sources[table])
+        if done >= counts[table]:
+            continue
+        start = time.perf_counter()
+        for batch in batches(islice(_rows(table, books, seed), done, None), batch_size):
+            done += len(batch)
+            # The checkpoint stays behind to mark the table as generated
+            repo.bulk_insert(table, columns, batch, checkpoint=(sources[table], done))
+            if log:
+                rate = done / max(time.perf_counter() - start, 1e-9)
+                log(f"{table}: {done}/{counts[table]} rows ({rate:,.0f} rows/s)")
+
+
+class Bench:
+    """Times named operations and remembers how many rows each returned."""
+
+    def __init__(self):
+        self.metrics = LatencyMetrics()
+        self.rows = {}
+
+    def time(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+        finally:
+            self.metrics.record(name, time.perf_counter() - start, failed)
+        if isinstance(result, list):
+            size = len(result)
+        elif isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], list):
+            size = len(result[1])  # (total, rows)
+        else:
+            size = 0 if result is None else 1
+        self.rows[name] = size
+        return result
+
+    def report(self):
+        snapshot = self.metrics.snapshot()
+        for name, stats in snapshot.items():
+            stats['rows'] = self.rows.get(name)
+        return snapshot
+
+
+def run_benchmark(repo, books, seed=1, repeat=20):
+    """Time each screen's repository and cache calls. Returns Bench.report()."""
+    rng = random.Random(f"{seed}:bench")
+    counts = _counts(books)
+    bench = Bench()
+
+    # show_available_books, borrow list, browse_categories, search_books
+    catalog = CatalogCache(repo)
+    bench.time("catalog.load", catalog.load)
+    titles = catalog.all_titles()
+    categories = catalog.categories()
+    for _ in range(repeat):
+        bench.time("available.page", catalog.available_title_page, limit=100)
+        bench.time("available.page_deep", catalog.available_title_page,
+                   after=rng.choice(titles), limit=100)
+        bench.time("available.sql", repo.available_books)
+        bench.time("categories.list", catalog.categories)
+        category = rng.choice(categories)
+        bench.time("categories.books", catalog.books_in_category, category)
+        bench.time("categories.books_sql", repo.books_in_category, category)
+        word = rng.choice(WORDS)
+        term = f"{rng.choice(WORDS)} {word[:rng.randint(3, len(word))]}"
+        bench.time("search.sql", repo.search, term)
+        bench.time("search.cache", catalog.search, term)
+        typo = word[:2] + word[3:] if len(word) > 4 else word
+        bench.time("search.cache_typo", catalog.search, typo)
+
+    # show_transaction_history, show_my_books
+    for _ in range(repeat):
+        student_id = rng.randint(1, counts['students'])
+        page = bench.time("history.page", repo.history_page, student_id)
+        if page:
+            last = page[-1]
+            bench.time("history.next_page", repo.history_page, student_id,
+                       after=(last['issued_date'], last['transaction_id']))
+        bench.time("my_books.fetch", repo.open_loans, student_id)
+
+    # book_reviews: the most reviewed title, then random ones
+    popular = catalog.get(1).title
+    for i in range(repeat):
+        title = popular if i % 2 == 0 else rng.choice(titles)
+        bench.time("reviews.summary", repo.review_summary, title)
+        page = bench.time("reviews.page", repo.review_page, title)
+        if page:
+            last = page[-1]
+            bench.time("reviews.next_page", repo.review_page, title,
+                       after=(last['created_at'], last['review_id']))
+
+    # borrow and return: every book taken is given back
+    student_id = rng.randint(1, counts['students'])
+    for _ in range(repeat):
+        page = catalog.available_title_page(after=rng.choice(titles), limit=1)
+        book_id = _free_copy(catalog, page[0]['title']) if page else None
+        if book_id is None:
+            continue
+        if bench.time("borrow.checkout", repo.checkout, student_id, book_id):
+            catalog.set_status(book_id, 'issued')
+            bench.time("return.checkin", repo.checkin, student_id, book_id)
+            catalog.set_status(book_id, 'available')
+        title = page[0]['title']
+        if bench.time("borrow.by_title", repo.borrow, student_id, title) is not None:
+            bench.time("return.by_title", repo.return_book, student_id, title)
+    page = catalog.available_title_page(after=rng.choice(titles), limit=25)
+    cart = [book_id for book_id in (_free_copy(catalog, row['title']) for row in page)
+            if book_id is not None]
+    bench.time("cart.checkout", repo.checkout_many, student_id, cart)
+    bench.time("cart.return", repo.checkin_many, cart, student_id)
+
+    # holds: take every copy of a title, queue for it, and have the
+    # first copy returned go to the queue
+    holder = student_id % counts['students'] + 1
+    other = holder % counts['students'] + 1
+    for _ in range(repeat):
+        page = catalog.available_title_page(after=rng.choice(titles), limit=1)
+        if not page:
+            continue
+        title = page[0]['title']
+        taken = [book_id for book_id in catalog.ids_for_title(title)
+                 if repo.checkout(student_id, book_id)]
+        if not taken:
+            continue
+        if bench.time("holds.place", repo.place_hold, holder, title):
+            repo.place_hold(other, title)
+            bench.time("holds.list", repo.holds, holder)
+            hold = next(row for row in repo.holds(other) if row['title'] == title)
+            bench.time("holds.cancel", repo.cancel_hold, other, hold['hold_id'])
+            bench.time("return.serve_hold", repo.checkin, student_id, taken[0])
+            repo.checkin(holder, taken[0])
+        else:
+            repo.checkin(student_id, taken[0])
+        repo.checkin_many(taken[1:], student_id)
+        catalog.refresh(force=True)
+    return bench.report()
+
+
+def _free_copy(catalog, title):
+    """book_id of a copy of `title` the cache believes is available, or None."""
+    for book_id in catalog.ids_for_title(title):
+        book = catalog.get(book_id)
+        if book is not None and book.status == 'available':
+            return book_id
+    return None
+
+
+def _version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Lines describing operations whose median regressed past `threshold`."""
+    regressions = []
+    for name, stats in results['operations'].items():
+        before = baseline.get('operations', {}).get(name)
+        if not before or not before['p50_ms']:
+            continue
+        ratio = stats['p50_ms'] / before['p50_ms']
+        if ratio > threshold:
+            regressions.append(f"{name}: p50 {before['p50_ms']:.3f} ms -> "
+                               f"{stats['p50_ms']:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library query paths")
+    parser.add_argument('--size', default='10k',
+                        help="number of books: 10k, 100k, 1m or a plain number")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20, help="timed calls per operation")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), default='sqlite')
+    parser.add_argument('--sqlite-path', help="database file (default bench-<size>-<seed>.sqlite)")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="earlier JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown of the median that counts as a regression")
+    args = parser.parse_args(argv)
+
+    books = SIZES.get(args.size.lower()) or int(args.size)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    options = {}
+    if args.backend == 'sqlite':
+        options['path'] = args.sqlite_path or f"bench-{args.size.lower()}-{args.seed}.sqlite"
+    log = lambda msg: print(msg, file=sys.stderr)
+    try:
+        repo = create_repository(args.backend, **options)
+        try:
+            start = time.perf_counter()
+            generate(repo, books, args.seed, log=log)
+            generate_s = time.perf_counter() - start
+            log(f"timing {args.repeat} calls per operation")
+            operations = run_benchmark(repo, books, args.seed, args.repeat)
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    results = {
+        'version': _version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'backend': args.backend,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'counts': _counts(books),
+        'generate_s': round(generate_s, 3),
+        'operations': operations,
+    }
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Bulk import and export of the library tables.
+
+    python bulk_io.py import books books.csv
+    python bulk_io.py import transactions loans.jsonl --resume
+    python bulk_io.py export students students.jsonl
+
+Files are CSV (with a header row) or JSON lines, picked by extension.
+Imports stream the file and insert it in batches, committing each batch
+together with a checkpoint, so an interrupted import restarts where it
+stopped with --resume. Exports stream the table through an unbuffered
+cursor and never hold more than one chunk in memory.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+from storage import STREAM_CHUNK, TABLE_COLUMNS, StorageError, check_columns, create_repository
+
+BATCH_SIZE = 5000
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def detect_format(path):
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise StorageError(f"Cannot tell the format of {path}; use .csv or .jsonl")
+    return fmt
+
+
+def read_records(path, fmt):
+    """Yield each record of the file as a dict."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for record in csv.DictReader(f):
+                # Empty CSV fields are NULL
+                yield {k: (v if v != '' else None) for k, v in record.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def import_file(repo, table, path, fmt=None, batch_size=BATCH_SIZE, resume=False, log=None):
+    """Load `path` into `table`. Returns the number of rows inserted."""
+    fmt = fmt or detect_format(path)
+    source = f"{table}:{os.path.abspath(path)}"
+    records = read_records(path, fmt)
+
+    first = next(records, None)
+    if first is None:
+        return 0
+    columns = tuple(first)
+    check_columns(table, columns)
+
+    def rows():
+        yield tuple(first.get(c) for c in columns)
+        for record in records:
+            yield tuple(record.get(c) for c in columns)
+
+    done = repo.import_checkpoint(source) if resume else 0
+    pending = islice(rows(), done, None)
+    start = time.perf_counter()
+    inserted = 0
+    for batch in batches(pending, batch_size):
+        done += len(batch)
+        repo.bulk_insert(table, columns, batch, checkpoint=(source, done))
+        inserted += len(batch)
+        if log:
+            rate = inserted / max(time.perf_counter() - start, 1e-9)
+            log(f"{table}: {done} rows committed ({rate:,.0f} rows/s)")
+    repo.clear_import_checkpoint(source)
+    return inserted
+
+
+def load_data(repo, table, path):
+    """Server-side LOAD DATA of a CSV file whose header names the columns."""
+    with open(path, newline='', encoding='utf-8') as f:
+        columns = next(csv.reader(f))
+    return repo.load_data_file(table, columns, os.path.abspath(path))
+
+
+def export_table(repo, table, path, fmt=None, chunk_size=STREAM_CHUNK):
+    """Write every row of `table` to `path`. Returns the number of rows."""
+    fmt = fmt or detect_format(path)
+    columns = TABLE_COLUMNS[table]
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(columns)
+        for row in repo.stream_table(table, chunk_size):
+            values = [_plain(row[c]) for c in columns]
+            if fmt == 'csv':
+                writer.writerow(['' if v is None else v for v in values])
+            else:
+                f.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of library tables")
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('table', choices=sorted(TABLE_COLUMNS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'jsonl'))
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted import from its checkpoint")
+    parser.add_argument('--load-data', action='store_true',
+                        help="import a CSV with MySQL LOAD DATA LOCAL INFILE")
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    if args.load_data and backend == 'mysql':
+        options['allow_local_infile'] = True
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            if args.action == 'export':
+                count = export_table(repo, args.table, args.path, args.format)
+            elif args.load_data:
+                count = load_data(repo, args.table, args.path)
+            else:
+                count = import_file(repo, args.table, args.path, args.format,
+                                    args.batch_size, args.resume,
+                                    log=lambda msg: print(msg, file=sys.stderr))
+        finally:
+            repo.close()
+    except (StorageError, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.action}ed {count} rows ({args.table})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""In-process cache of the book catalog.
+
+The catalog is loaded once and indexed by book_id, title and status,
+with per-title copy counters and categories kept alongside. Writes made
+by this desk are applied in place; changes made by other desks are
+picked up from the catalog_changes log, which the database fills from
+triggers on `books`. Checking for them costs one MAX(change_id) lookup, and only
+the changed rows are fetched.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from search_index import SUGGESTIONS, TitleIndex, TrigramIndex
+
+CHECK_INTERVAL = 2.0  # seconds between catalog version checks
+RELOAD_GAP = 10000  # after a bulk load, reloading beats replaying changes
+
+
+class Book:
+    __slots__ = ('book_id', 'title', 'category', 'status')
+
+    def __init__(self, book_id, title, category, status):
+        self.book_id = book_id
+        self.title = title
+        self.category = category
+        self.status = status
+
+
+class Holding:
+    """Copy counters of one title.
+
+    `category` is the category of the oldest copy (lowest book_id), the
+    rule the titles table follows too.
+    """
+
+    __slots__ = ('copies', 'available', 'category', 'first')
+
+    def __init__(self):
+        self.copies = 0
+        self.available = 0
+        self.category = None
+        self.first = None  # book_id of the oldest copy
+
+
+class CatalogCache:
+    """Read-through catalog views on top of a LibraryRepository.
+
+    Safe to use from the executor's worker threads. Views are built on
+    first use after a change and then served from memory.
+    """
+
+    def __init__(self, repo, check_interval=CHECK_INTERVAL):
+        self.repo = repo
+        self.check_interval = check_interval
+        self.version = None
+        self._lock = threading.RLock()
+        # Held across the database round trips so that concurrent
+        # readers wait for one refresh instead of each starting their own.
+        self._refresh_lock = threading.RLock()
+        self._checked_at = 0.0
+        self._by_id = {}
+        self._by_title = {}
+        self._by_status = {}
+        self._holdings = {}  # title -> Holding
+        self._views = {}
+        self._search_index = None  # built on first search
+        self._title_index = None  # built on first suggest
+
+    # -- loading and invalidation --------------------------------------
+
+    def load(self):
+        with self._refresh_lock:
+            version, rows = self.repo.catalog_books()
+            self._replace(version, rows)
+
+    def _replace(self, version, rows):
+        with self._lock:
+            self._by_id.clear()
+            self._by_title.clear()
+            self._by_status.clear()
+            self._holdings.clear()
+            self._search_index = None
+            self._title_index = None
+            for row in rows:
+                self._put(row['book_id'], row['title'], row['category'], row['status'])
+            self.version = version
+            self._checked_at = time.monotonic()
+            self._views.clear()
+
+    def refresh(self, force=False):
+        """Apply changes made since the cached version.
+
+        Without `force`, the version is checked at most once every
+        `check_interval` seconds.
+        """
+        with self._refresh_lock:
+            if self.version is None:
+                self.load()
+                return
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            latest = self.repo.catalog_version()
+            if latest == self.version:
+                return
+            if latest - self.version > RELOAD_GAP:
+                self.load()
+                return
+            version, rows = self.repo.catalog_changes(self.version)
+            self._apply(version, rows)
+
+    def _apply(self, version, rows):
+        with self._lock:
+            for row in rows:
+                book = self._by_id.get(row['book_id'])
+                if (book is not None and book.title == row['title']
+                        and book.category == row['category']):
+                    self._set_status(book, row['status'])
+                    continue
+                self._remove(row['book_id'])
+                if row['title'] is not None:
+                    self._put(row['book_id'], row['title'], row['category'], row['status'])
+            self.version = max(self.version, version)
+            self._views.clear()
+
+    def set_status(self, book_id, status):
+        """Record a status change this desk has just committed."""
+        with self._lock:
+            book = self._by_id.get(book_id)
+            if book is not None:
+                self._set_status(book, status)
+
+    def _set_status(self, book, status):
+        if book.status == status:
+            return
+        self._by_status.get(book.status, set()).discard(book.book_id)
+        self._by_status.setdefault(status, set()).add(book.book_id)
+        self._holdings[book.title].available += (status == 'available') - (book.status == 'available')
+        book.status = status
+        self._views.clear()
+
+    def _put(self, book_id, title, category, status):
+        self._by_id[book_id] = Book(book_id, title, category, status)
+        self._by_title.setdefault(title, set()).add(book_id)
+        self._by_status.setdefault(status, set()).add(book_id)
+        holding = self._holdings.get(title)
+        if holding is None:
+            holding = self._holdings[title] = Holding()
+        if holding.first is None or book_id < holding.first:
+            holding.first = book_id
+            holding.category = category
+        holding.copies += 1
+        holding.available += status == 'available'
+        if self._search_index is not None:
+            self._search_index.add(book_id, title, category)
+        if self._title_index is not None:
+            self._title_index.add(book_id, title)
+
+    def _remove(self, book_id):
+        book = self._by_id.pop(book_id, None)
+        if book is None:
+            return
+        if self._search_index is not None:
+            self._search_index.remove(book_id)
+        if self._title_index is not None:
+            self._title_index.remove(book_id)
+        for index, key in ((self._by_title, book.title),
+                           (self._by_status, book.status)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(book_id)
+                if not ids:
+                    del index[key]
+        holding = self._holdings[book.title]
+        holding.copies -= 1
+        holding.available -= book.status == 'available'
+        if not holding.copies:
+            del self._holdings[book.title]
+        elif holding.first == book_id:
+            holding.first = min(self._by_title[book.title])
+            holding.category = self._by_id[holding.first].category
+
+    def _view(self, key, build):
+        self.refresh()
+        with self._lock:
+            view = self._views.get(key)
+            if view is None:
+                view = self._views[key] = build()
+            return view
+
+    # -- views matching the LibraryRepository read methods --------------
+
+    def get(self, book_id):
+        self.refresh()
+        return self._by_id.get(book_id)
+
+    def ids_for_title(self, title):
+        self.refresh()
+        with self._lock:
+            return sorted(self._by_title.get(title, ()))
+
+    def _holding_row(self, title, holding):
+        return {'title': title, 'category': holding.category,
+                'available': holding.available, 'copies': holding.copies}
+
+    def available_books(self):
+        def build():
+            return [self._holding_row(title, holding)
+                    for title, holding in sorted(self._holdings.items()) if holding.available]
+        return self._view('available', build)
+
+    def available_title_page(self, after=None, before=None, limit=100):
+        """Keyset page, by title, of the titles with a copy free."""
+        titles = self.all_titles()
+        rows = []
+        with self._lock:
+            if before is not None:
+                for i in range(bisect_left(titles, before) - 1, -1, -1):
+                    holding = self._holdings.get(titles[i])
+                    if holding is not None and holding.available:
+                        rows.append(self._holding_row(titles[i], holding))
+                        if len(rows) == limit:
+                            break
+                rows.reverse()
+                return rows
+            start = bisect_right(titles, after) if after is not None else 0
+            for i in range(start, len(titles)):
+                title = titles[i]
+                holding = self._holdings.get(title)
+                if holding is not None and holding.available:
+                    rows.append(self._holding_row(title, holding))
+                    if len(rows) == limit:
+                        break
+        return rows
+
+    def available_titles(self):
+        """(book_id, title) of every available book, by book_id."""
+        def build():
+            ids = sorted(self._by_status.get('available', ()))
+            return [(i, self._by_id[i].title) for i in ids]
+        return self._view('available_titles', build)
+
+    def all_titles(self):
+        return self._view('titles', lambda: sorted(self._by_title))
+
+    def categories(self):
+        # NULL sorts first, as in MySQL's ORDER BY
+        return self._view('categories', lambda: sorted(
+            {holding.category for holding in self._holdings.values()},
+            key=lambda c: (c is not None, c or '')))
+
+    def books_in_category(self, category):
+        def build():
+            return [{'title': title, 'available': holding.available, 'copies': holding.copies}
+                    for title, holding in sorted(self._holdings.items())
+                    if holding.category == category]
+        return self._view(('category', category), build)
+
+    def _titles(self):
+        if self._title_index is None or self._title_index.stale:
+            self._title_index = TitleIndex(self._by_title)
+        return self._title_index
+
+    def suggest(self, text, limit=SUGGESTIONS):
+        """(title, book_ids) of titles starting with `text`, or one typo from it."""
+        self.refresh()
+        with self._lock:
+            return self._titles().suggest(text, limit)
+
+    def resolve(self, title):
+        """Book ids of `title`, ignoring case, accents and extra spaces."""
+        self.refresh()
+        with self._lock:
+            return self._titles().resolve(title)
+
+    def search(self, term, limit=50, offset=0):
+        """Return (total, rows) for one page of ranked, typo-tolerant matches."""
+        self.refresh()
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = TrigramIndex()
+                for book in self._by_id.values():
+                    self._search_index.add(book.book_id, book.title, book.category)
+            total, ids = self._search_index.search(term, limit, offset)
+            books = [self._by_id[i] for i in ids]
+            return total, [{'title': b.title, 'category': b.category, 'status': b.status}
+                           for b in books]
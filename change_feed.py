@@ -0,0 +1,59 @@
+"""Change feed for open screens.
+
+The database appends a row to catalog_events, from triggers, whenever
+a book changes, a loan is issued or returned, or a review is added.
+ChangeFeed polls it from the last event seen and hands each batch to
+its listeners, which patch the rows they show instead of reloading.
+
+Events carry the current state of the book and loan they name, so a
+listener makes its rows match that state and applying the same event
+twice is harmless. A desk that falls more than one batch behind is
+told to reload instead.
+"""
+import threading
+
+from storage import EVENT_BATCH
+
+POLL_MS = 2000  # between polls, once the previous one has finished
+
+
+class ChangeFeed:
+    """Cursor over catalog_events with a list of listeners.
+
+    `poll()` does the database round trip and may run on a worker
+    thread; `dispatch()` calls the listeners and belongs on the Tk
+    thread.
+    """
+
+    def __init__(self, repo, batch=EVENT_BATCH):
+        self.repo = repo
+        self.batch = batch
+        self.version = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """Call `listener(events)` with each batch; None means reload everything."""
+        self._listeners.append(listener)
+
+    def poll(self):
+        """Events since the last poll, or None if the listeners must reload."""
+        with self._lock:
+            if self.version is None:
+                # Screens load their rows after this, so older events
+                # are already in what they show
+                self.version = self.repo.events_version()
+                return []
+            # One event past the batch tells a full batch from an overflow
+            version, events = self.repo.catalog_events(self.version, self.batch + 1)
+            if len(events) <= self.batch:
+                self.version = version
+                return events
+            self.version = self.repo.events_version()
+            return None
+
+    def dispatch(self, events):
+        if events == []:
+            return
+        for listener in list(self._listeners):
+            listener(events)
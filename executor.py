@@ -0,0 +1,191 @@
+"""Background query execution for the Tk front end.
+
+Database calls run on a small thread pool. Finished results are queued
+and handed back to callbacks on the Tk main thread by a `root.after`
+poll, so no widget is ever touched from a worker thread.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import INSTRUMENTS, PROFILER, running
+
+POLL_MS = 20
+MAX_WORKERS = 4
+
+
+class LatencyStats:
+    """Latency samples for one named operation."""
+
+    def __init__(self, window=500):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds, failed=False):
+        self.count += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, pct):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class LatencyMetrics:
+    """Thread-safe LatencyStats keyed by operation name."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = LatencyStats()
+            stats.record(seconds, failed)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+
+class Request:
+    """Handle for one submitted call; `cancel()` drops its callback."""
+
+    def __init__(self, name, key):
+        self.name = name
+        self.key = key
+        self.cancelled = False
+        self.future = None
+        self.callbacks = (None, None)
+
+    def cancel(self):
+        self.cancelled = True
+        return self.future is not None and self.future.cancel()
+
+
+class QueryExecutor:
+    """Runs blocking calls off the Tk thread and posts results back.
+
+    `submit` may be given a `key`: submitting again with the same key
+    cancels the earlier request, so a newer search replaces an older
+    one. `on_busy(count)` is called on the Tk thread whenever the number
+    of requests in flight changes.
+    """
+
+    def __init__(self, root, max_workers=MAX_WORKERS, poll_ms=POLL_MS, on_busy=None):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy = on_busy
+        self.metrics = LatencyMetrics()
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="libmgmt-db")
+        self._results = queue.SimpleQueue()
+        self._latest = {}
+        self._in_flight = 0
+        self._closed = False
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, name, fn, *args, on_done=None, on_error=None, key=None):
+        """Run `fn(*args)` on a worker; call `on_done(result)` on the Tk thread."""
+        request = Request(name, key)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                self._cancel(previous)
+            self._latest[key] = request
+        request.callbacks = (on_done, on_error)
+        request.future = self._pool.submit(self._run, request, fn, args)
+        self._set_in_flight(self._in_flight + 1)
+        return request
+
+    def cancel(self, key):
+        request = self._latest.pop(key, None)
+        if request is not None:
+            self._cancel(request)
+
+    def _cancel(self, request):
+        # A request that never started produces no result to drain.
+        if request.cancel():
+            self._set_in_flight(self._in_flight - 1)
+
+    def _run(self, request, fn, args):
+        if request.cancelled:
+            self._results.put((request, None, None))
+            return
+        start = time.perf_counter()
+        try:
+            # Queries made by `fn` are recorded under the request's name
+            with running(request.name), PROFILER.profile():
+                result = fn(*args)
+        except Exception as e:
+            seconds = time.perf_counter() - start
+            self.metrics.record(request.name, seconds, failed=True)
+            INSTRUMENTS.action(request.name, seconds, failed=True)
+            self._results.put((request, None, e))
+        else:
+            seconds = time.perf_counter() - start
+            self.metrics.record(request.name, seconds)
+            INSTRUMENTS.action(request.name, seconds)
+            self._results.put((request, result, None))
+
+    def _drain(self):
+        if self._closed:
+            return
+        # Reschedule first so a failing callback cannot stop the poll.
+        self.root.after(self.poll_ms, self._drain)
+        while True:
+            try:
+                request, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._set_in_flight(self._in_flight - 1)
+            if request.key is not None and self._latest.get(request.key) is request:
+                del self._latest[request.key]
+            if request.cancelled:
+                continue
+            on_done, on_error = request.callbacks
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+                else:
+                    raise error
+            elif on_done is not None:
+                # Time spent drawing the result blocks the Tk thread
+                start = time.perf_counter()
+                with PROFILER.profile():
+                    on_done(result)
+                INSTRUMENTS.action(request.name + ".render", time.perf_counter() - start)
+
+    def _set_in_flight(self, count):
+        self._in_flight = count
+        if self.on_busy is not None:
+            self.on_busy(count)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def shutdown(self):
+        self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
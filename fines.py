@@ -0,0 +1,136 @@
+"""Overdue and fines engine, meant to run nightly.
+
+    python fines.py run
+    LIBMGMT_FINE_GRACE_DAYS=2 LIBMGMT_FINE_CAP=100 python fines.py run
+    python fines.py report --limit 50
+
+`run` reads open loans a page at a time, computes days overdue and
+accrued fines for a whole page at once with NumPy, and writes them to
+the loan_fines ledger. Only loans that changed since the last run (new
+loans and returns, from the loan_changes log) and ledger loans still
+accruing are reprocessed; a change of fine policy recomputes everything.
+"My Borrowed Books" and the overdue report read the ledger by index.
+
+The policy comes from the LIBMGMT_FINE_* variables, which every desk
+also reads to charge penalties on return, so set them the same way
+everywhere.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from storage import STREAM_CHUNK, FinePolicy, StorageError, create_repository
+
+
+def compute_fines(due, as_of, policy):
+    """Vectorized fines for loans due at `due` (datetime64 array).
+
+    Returns (days_overdue, fines, accruing) arrays; a loan stops
+    accruing once its fine reaches the cap.
+    """
+    # FinePolicy.days_late, for a whole array
+    days = (np.datetime64(as_of, 's') - due) // np.timedelta64(1, 'D')
+    days_overdue = np.maximum(days, 0)
+    fines = np.maximum(days_overdue - policy.grace_days, 0) * policy.rate
+    if policy.max_fine is None:
+        accruing = np.ones(len(due), dtype=bool)
+    else:
+        fines = np.minimum(fines, policy.max_fine)
+        accruing = fines < policy.max_fine
+    return days_overdue, np.round(fines, 2), accruing
+
+
+def run(repo, policy=None, full=False, as_of=None, chunk_size=STREAM_CHUNK, log=None):
+    """Bring the fines ledger up to date. Returns the number of loans processed."""
+    if np is None:
+        raise StorageError("The fines engine needs numpy")
+    policy = policy or FinePolicy()
+    as_of = (as_of or datetime.now()).replace(microsecond=0)
+    state = repo.fines_state()
+    full = full or state is None or state['policy'] != policy.key()
+    # Changes made while the run streams are picked up by the next run
+    version = repo.loan_version()
+    if full:
+        repo.clear_fines()
+        since = overdue_before = None
+    else:
+        since, overdue_before = state['last_change'], as_of
+
+    start = time.perf_counter()
+    processed = 0
+    after = None
+    while True:
+        # Each page is read to the end, giving its connection back,
+        # before the ledger is written on another one
+        chunk = list(repo.fine_candidates(since, overdue_before, chunk_size,
+                                          after=after, limit=chunk_size))
+        if not chunk:
+            break
+        after = chunk[-1]['transaction_id']
+        closed = [row['transaction_id'] for row in chunk if row['return_date'] is not None]
+        open_loans = [row for row in chunk
+                      if row['return_date'] is None and row['due_date'] is not None]
+        rows = []
+        if open_loans:
+            due = np.array([row['due_date'] for row in open_loans], dtype='datetime64[s]')
+            days_overdue, fines, accruing = compute_fines(due, as_of, policy)
+            rows = [(row['transaction_id'], row['student_id'], row['book_id'], row['due_date'],
+                     int(days), float(fine), int(accrues), as_of)
+                    for row, days, fine, accrues in zip(open_loans, days_overdue, fines, accruing)]
+        repo.write_fines(rows, closed)
+        processed += len(chunk)
+        if log:
+            rate = processed / max(time.perf_counter() - start, 1e-9)
+            log(f"fines: {processed} loans processed ({rate:,.0f} loans/s)")
+        if len(chunk) < chunk_size:
+            break
+    repo.finish_fines_run(version, policy.key(), as_of, processed)
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Overdue and fines engine")
+    parser.add_argument('action', choices=('run', 'report'))
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--full', action='store_true', help="recompute every open loan")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK)
+    parser.add_argument('--limit', type=int, default=100, help="rows in the overdue report")
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            if args.action == 'run':
+                policy = FinePolicy()
+                count = run(repo, policy, args.full, chunk_size=args.chunk_size,
+                            log=lambda msg: print(msg, file=sys.stderr))
+                print(f"processed {count} loans ({policy.key()})")
+            else:
+                rows = repo.overdue_loans(args.limit)
+                for row in rows:
+                    print(f"{row['days_overdue']:>5} days  Rs. {float(row['fine']):>8.2f}  "
+                          f"{row['name'] or '-'}: {row['title']}")
+                print(f"{len(rows)} overdue loans, Rs. {sum(float(r['fine']) for r in rows):.2f}"
+                      f" in fines")
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Query and action instrumentation.
+
+Every SQL statement run through a repository session is timed (execute
+plus fetches) and counted under the operation it ran for: the executor
+request or service route name, such as "history.fetch", and a statement
+label such as "select transactions". UI actions and service routes are
+timed as well. Statements slower than the threshold are written to a
+JSON-lines slow-query log with their parameters redacted and the query
+plan attached.
+
+Metrics are exported in Prometheus text format, to a file refreshed in
+the background (for node_exporter's textfile collector) or on a local
+HTTP endpoint. A cProfile profiler can be switched on and off while the
+program runs.
+
+Configured from the environment by `configure()`:
+
+    LIBMGMT_SLOW_QUERY_MS    slow-query threshold (default 250)
+    LIBMGMT_SLOW_QUERY_LOG   slow-query log file (default libmgmt-slow.log, "" to disable)
+    LIBMGMT_METRICS_FILE     Prometheus text file to refresh
+    LIBMGMT_METRICS_PORT     serve Prometheus text on 127.0.0.1:<port>/metrics
+    LIBMGMT_PROFILE          profile output file; SIGUSR1 toggles profiling
+"""
+import contextvars
+import json
+import os
+import re
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+SLOW_QUERY_MS = 250.0
+SLOW_QUERY_LOG = "libmgmt-slow.log"
+METRICS_INTERVAL = 15.0  # seconds between metrics file refreshes
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_SLOW = 100
+
+# Name of the operation the current thread is working for
+operation = contextvars.ContextVar('operation', default="other")
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)", re.IGNORECASE)
+
+
+def statement_label(sql):
+    """Short label for a statement: its verb and first table."""
+    words = sql.split(None, 1)
+    verb = words[0].lower() if words else ""
+    match = _TABLE.search(sql)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+def redact(params):
+    """Parameter placeholders that keep the types but not the values."""
+    return [None if p is None else f"<{type(p).__name__}>" for p in params or ()]
+
+
+@contextmanager
+def running(name):
+    """Attribute the queries run inside the block to operation `name`."""
+    token = operation.set(name)
+    try:
+        yield
+    finally:
+        operation.reset(token)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with error and row counters."""
+
+    __slots__ = ('buckets', 'count', 'sum', 'errors', 'rows')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.rows = 0
+
+    def observe(self, seconds, failed=False, rows=0):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.errors += failed
+        self.rows += rows
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+class Instruments:
+    """Thread-safe registry of query and action metrics, plus the slow-query log."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=None):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.recent_slow = deque(maxlen=RECENT_SLOW)
+        self._queries = {}
+        self._actions = {}
+        self._captures = []
+        self._lock = threading.Lock()
+
+    def _observe(self, table, key, seconds, failed, rows):
+        with self._lock:
+            histogram = table.get(key)
+            if histogram is None:
+                histogram = table[key] = Histogram()
+            histogram.observe(seconds, failed, rows)
+
+    def query(self, label, seconds, rows=0, failed=False):
+        """Record one statement. Returns True if it was slow."""
+        self._observe(self._queries, (operation.get(), label), seconds, failed, rows)
+        return seconds * 1000 >= self.slow_ms or bool(self._captures)
+
+    def action(self, name, seconds, failed=False):
+        self._observe(self._actions, name, seconds, failed, 0)
+
+    def log_slow(self, sql, params, seconds, plan=None, op=None):
+        entry = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'operation': op or operation.get(),
+            'statement': statement_label(sql),
+            'ms': round(seconds * 1000, 3),
+            'sql': " ".join(sql.split()),
+            'params': redact(params),
+            'plan': plan,
+        }
+        for captured in self._captures:
+            captured.append(entry)
+        if seconds * 1000 < self.slow_ms:
+            return  # only here for a capture
+        self.recent_slow.append(entry)
+        if self.slow_log:
+            line = json.dumps(entry, default=str) + "\n"
+            try:
+                with self._lock, open(self.slow_log, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError:
+                pass  # never fail a query over its log entry
+
+    @contextmanager
+    def capture(self):
+        """Collect a slow-log entry, plan included, for every statement
+        run while the block is open, on any thread."""
+        captured = []
+        with self._lock:
+            self._captures.append(captured)
+        try:
+            yield captured
+        finally:
+            with self._lock:
+                self._captures.remove(captured)
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            queries = [((('operation', op), ('statement', label)), h)
+                       for (op, label), h in sorted(self._queries.items())]
+            actions = [((('operation', name),), h) for name, h in sorted(self._actions.items())]
+            lines = []
+            for metric, series, help_text in (
+                    ("libmgmt_query_duration_seconds", queries,
+                     "Time spent executing and fetching SQL statements."),
+                    ("libmgmt_action_duration_seconds", actions,
+                     "Time spent in UI actions and service routes.")):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, h in series:
+                    for bound, count in zip(BUCKETS, h.buckets):
+                        lines.append(f'{metric}_bucket{{{_labels(labels + (("le", bound),))}}} {count}')
+                    lines.append(f'{metric}_bucket{{{_labels(labels + (("le", "+Inf"),))}}} {h.count}')
+                    lines.append(f"{metric}_sum{{{_labels(labels)}}} {h.sum:.6f}")
+                    lines.append(f"{metric}_count{{{_labels(labels)}}} {h.count}")
+            for metric, series, field, help_text in (
+                    ("libmgmt_query_rows_total", queries, 'rows', "Rows returned by SQL statements."),
+                    ("libmgmt_query_errors_total", queries, 'errors', "SQL statements that failed."),
+                    ("libmgmt_action_errors_total", actions, 'errors', "UI actions and routes that failed.")):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for labels, h in series:
+                    lines.append(f"{metric}{{{_labels(labels)}}} {getattr(h, field)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Write then rename, so a collector never reads half a file
+        temp = f"{path}.tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(temp, path)
+
+
+class Profiler:
+    """cProfile that can be switched on and off at runtime.
+
+    cProfile only sees the thread that enabled it, so each unit of work
+    wrapped in `profile()` gets its own profile; `stop()` merges them.
+    """
+
+    def __init__(self, path="libmgmt.prof"):
+        self.path = path
+        self.enabled = False
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._profiles = []
+            self.enabled = True
+
+    def stop(self):
+        """Stop profiling and write the merged stats. Returns the file, or None."""
+        with self._lock:
+            self.enabled = False
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            return None
+        import pstats
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        return self.path
+
+    def toggle(self):
+        """Start or stop profiling. Returns the stats file when stopping."""
+        if self.enabled:
+            return self.stop()
+        self.start()
+        return None
+
+    @contextmanager
+    def profile(self):
+        if not self.enabled:
+            yield
+            return
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if self.enabled:
+                    self._profiles.append(profile)
+
+
+INSTRUMENTS = Instruments()
+PROFILER = Profiler()
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve GET /metrics on a daemon thread. Returns the server."""
+    # Imported here: http.server is slow to load and few desks need it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = INSTRUMENTS.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="libmgmt-metrics", daemon=True).start()
+    return server
+
+
+def write_metrics_periodically(path, interval=METRICS_INTERVAL):
+    """Refresh the Prometheus file at `path` every `interval` seconds."""
+    def loop():
+        while True:
+            try:
+                INSTRUMENTS.write_prometheus(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+    threading.Thread(target=loop, name="libmgmt-metrics-file", daemon=True).start()
+
+
+def configure(environ=os.environ):
+    """Apply the LIBMGMT_* instrumentation settings. Call from the main thread."""
+    INSTRUMENTS.slow_ms = float(environ.get("LIBMGMT_SLOW_QUERY_MS", SLOW_QUERY_MS))
+    INSTRUMENTS.slow_log = environ.get("LIBMGMT_SLOW_QUERY_LOG", SLOW_QUERY_LOG) or None
+    if environ.get("LIBMGMT_METRICS_FILE"):
+        write_metrics_periodically(environ["LIBMGMT_METRICS_FILE"])
+    if environ.get("LIBMGMT_METRICS_PORT"):
+        serve_metrics(int(environ["LIBMGMT_METRICS_PORT"]))
+    if environ.get("LIBMGMT_PROFILE"):
+        PROFILER.path = environ["LIBMGMT_PROFILE"]
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.toggle())
@@ -1,8 +1,36 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime, timedelta
-import mysql.connector
-from mysql.connector import Error
+from bisect import bisect_left
+from datetime import datetime
+from catalog_cache import CatalogCache
+from change_feed import POLL_MS, ChangeFeed
+from executor import QueryExecutor
+from instrumentation import PROFILER, configure
+from paged_grid import PagedGrid
+from recommend import Recommender
+from search_index import TitleIndex
+from storage import (REVIEW_PAGE_SIZE, SEARCH_PAGE_SIZE, FinePolicy, StorageError,
+                     create_repository)
+from typeahead import Typeahead
+
+SEARCH_DEBOUNCE_MS = 250
+
+# Executor key of the load each screen redoes when it is shown again;
+# it is cancelled when the user leaves the screen. Screens kept current
+# by the feed are not listed: their loads must finish while hidden.
+RELOAD_KEYS = {
+    'search_books': "search.results",
+    'browse_categories': "categories.books",
+}
+
+def open_loan(event):
+    """True if a loan or return event names a loan that is still open.
+
+    The loan's dates come back None once its row has been archived or
+    deleted, and such a loan was closed long ago.
+    """
+    return (event['title'] is not None and event['due_date'] is not None
+            and event['return_date'] is None)
 
 class LibraryGUI:
     def __init__(self, root):
@@ -11,6 +39,11 @@ class LibraryGUI:
         self.root.geometry("800x600")
         self.root.configure(bg="#f0f0f0")
 
+        # Status bar showing queries in flight
+        self.status_var = tk.StringVar(value="Ready")
+        tk.Label(self.root, textvariable=self.status_var, anchor=tk.W,
+                 font=("Helvetica", 10), bg="#e0e0e0").pack(side=tk.BOTTOM, fill=tk.X)
+
         # Create main container with scrollbar
         self.main_container = tk.Frame(self.root)
         self.main_container.pack(fill=tk.BOTH, expand=True)
@@ -32,23 +65,108 @@ class LibraryGUI:
         self.scrollbar.pack(side="right", fill="y")
         self.canvas.pack(side="left", fill="both", expand=True)
 
-        # Database connection
-        try:
-            self.conn = mysql.connector.connect(
-                host="localhost",
-                user="root",  # Replace with your MySQL username
-                password="dheeraj036", # Replace with your MySQL password
-                database="library_management"
-            )
-            self.cursor = self.conn.cursor(dictionary=True)
-        except Error as e:
-            messagebox.showerror("Database Error", f"Could not connect to database: {str(e)}")
-            root.destroy()
-            return
+        # Database work runs off the Tk thread
+        self.executor = QueryExecutor(self.root, on_busy=self.update_status)
+
+        # Ctrl+Shift+P starts and stops the profiler
+        self.root.bind_all("<Control-P>", self.toggle_profiler)
+
+        # Screens are built on first visit and kept: name -> (frame, refresh)
+        self.screens = {}
+        self.current_screen = None
 
         self.student = None
         self.setup_login_screen()
 
+        # Connect in the background so the window is usable at once
+        # (see storage.DB_CONFIG for credentials)
+        self.repo = None
+        self.catalog = None
+        self.feed = None
+        # Top-K tables written by `recommend.py update`
+        self.recommender = Recommender()
+        self.executor.submit("connect", create_repository,
+                             on_done=self.connected, on_error=self.connect_failed)
+
+    def connected(self, repo):
+        self.repo = repo
+        # Catalog reads are served from memory after the first load
+        self.catalog = CatalogCache(repo)
+        self.login_button.config(text="Login", state=tk.NORMAL)
+        # Load the catalog while the user is still logging in; screens
+        # load it themselves if this fails
+        self.executor.submit("catalog.load", self.catalog.refresh, on_error=lambda e: None)
+        # Open screens follow the catalog_events feed
+        self.feed = ChangeFeed(repo)
+        self.poll_feed()
+
+    def poll_feed(self):
+        # The next poll is scheduled when this one is done, so polls
+        # never overlap and no batch is dropped
+        self.executor.submit("events.poll", self.feed.poll,
+                             on_done=self.feed_polled, on_error=self.feed_failed)
+
+    def feed_polled(self, events):
+        self.root.after(POLL_MS, self.poll_feed)
+        self.feed.dispatch(events)
+
+    def feed_failed(self, error):
+        # A missed poll is caught up by the next one
+        self.root.after(POLL_MS, self.poll_feed)
+        if not isinstance(error, StorageError):
+            raise error
+
+    def connect_failed(self, error):
+        messagebox.showerror("Database Error", f"Could not connect to database: {str(error)}")
+        self.root.destroy()
+
+    def update_status(self, in_flight):
+        self.status_var.set(f"Working... ({in_flight} pending)" if in_flight else "Ready")
+
+    def toggle_profiler(self, event=None):
+        path = PROFILER.toggle()
+        if PROFILER.enabled:
+            self.status_var.set("Profiling... (Ctrl+Shift+P to stop)")
+        else:
+            self.status_var.set(f"Profile written to {path}" if path else "Profiling stopped")
+
+    def show_db_error(self, error):
+        if not isinstance(error, StorageError):
+            raise error
+        messagebox.showerror("Database Error", str(error))
+
+    def run_query(self, name, fn, *args, on_done=None, on_error=None, widget=None, key=None):
+        """Run a repository call in the background.
+
+        `on_done` runs on the Tk thread, and is skipped if `widget` has
+        been destroyed by then (the user moved to another screen).
+        `on_error` runs before the error is shown.
+        """
+        def done(result):
+            if on_done and (widget is None or widget.winfo_exists()):
+                on_done(result)
+
+        def failed(error):
+            if on_error:
+                on_error(error)
+            self.show_db_error(error)
+
+        return self.executor.submit(name, fn, *args, on_done=done, on_error=failed, key=key)
+
+    def show_recommendations(self, label, title, key):
+        """Fill `label` with the titles readers of `title` also borrowed."""
+        def fill(titles):
+            label.config(text="Readers who borrowed this also borrowed: " + ", ".join(titles)
+                         if titles else "")
+
+        self.run_query("recommend", self.recommender.similar_titles, self.catalog, title,
+                       on_done=fill, widget=label, key=key)
+
+    def paged_runner(self, name, key=None):
+        """`run` callback for PagedGrid and Typeahead: loads go through the executor."""
+        return lambda fn, on_done, on_error=None: self.run_query(
+            name, fn, on_done=on_done, on_error=on_error, key=key)
+
     def setup_login_screen(self):
         self.login_frame = tk.Frame(self.scrollable_frame, bg="#f0f0f0")
         self.login_frame.pack(pady=20)
@@ -67,34 +185,24 @@ class LibraryGUI:
         self.email_entry = tk.Entry(self.login_frame, font=("Helvetica", 12))
         self.email_entry.pack(pady=10)
 
-        tk.Button(self.login_frame, text="Login", command=self.login,
-                 font=("Helvetica", 12), bg="#4CAF50", fg="white").pack(pady=10)
+        # Enabled once the database connection is up
+        self.login_button = tk.Button(self.login_frame, text="Connecting...", command=self.login,
+                                      font=("Helvetica", 12), bg="#4CAF50", fg="white",
+                                      state=tk.DISABLED)
+        self.login_button.pack(pady=10)
 
     def login(self):
         name = self.name_entry.get().strip()
         email = self.email_entry.get().strip()
         
         if name and email:
-            try:
-                # Check if student exists or create new
-                self.cursor.execute("SELECT student_id, name FROM students WHERE email = %s", (email,))
-                student = self.cursor.fetchone()
-                
-                if not student:
-                    self.cursor.execute(
-                        "INSERT INTO students (name, email) VALUES (%s, %s)",
-                        (name, email)
-                    )
-                    self.conn.commit()
-                    student_id = self.cursor.lastrowid
-                else:
-                    student_id = student['student_id']
-                
-                self.student = {'id': student_id, 'name': name, 'email': email}
+            def logged_in(student):
+                self.student = student
                 self.login_frame.destroy()
                 self.setup_main_screen()
-            except Error as e:
-                messagebox.showerror("Database Error", str(e))
+
+            self.run_query("login", self.repo.login, name, email,
+                           on_done=logged_in, widget=self.login_frame, key="login")
         else:
             messagebox.showerror("Error", "Name and email cannot be empty")
 
@@ -103,245 +211,451 @@ class LibraryGUI:
         button_frame = tk.Frame(self.scrollable_frame, bg="#f0f0f0")
         button_frame.pack(pady=20)
 
-        buttons = [
+        screens = [
             ("View Available Books", self.show_available_books),
             ("Borrow a Book", self.borrow_book),
             ("Return a Book", self.return_book),
+            ("Scan Cart", self.scan_cart),
             ("Transaction History", self.show_transaction_history),
             ("Search Books", self.search_books),
             ("Browse Categories", self.browse_categories),
             ("My Borrowed Books", self.show_my_books),
             ("Book Reviews", self.book_reviews),
-            ("Exit", self.root.quit)
         ]
 
-        for text, command in buttons:
-            tk.Button(button_frame, text=text, command=command,
+        for text, build in screens:
+            tk.Button(button_frame, text=text, command=lambda build=build: self.show_screen(build),
                      font=("Helvetica", 12), width=20, bg="#2196F3", fg="white").pack(pady=5)
+        tk.Button(button_frame, text="Exit", command=self.root.quit,
+                 font=("Helvetica", 12), width=20, bg="#2196F3", fg="white").pack(pady=5)
 
         self.display_frame = tk.Frame(self.scrollable_frame, bg="white")
         self.display_frame.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
 
-    def clear_display(self):
-        for widget in self.display_frame.winfo_children():
-            widget.destroy()
-
-    def show_available_books(self):
-        self.clear_display()
-        tree = ttk.Treeview(self.display_frame, columns=("Book", "Category"), show="headings")
-        tree.heading("Book", text="Book Title")
-        tree.heading("Category", text="Category")
-        tree.pack(pady=10, fill=tk.BOTH, expand=True)
-
-        try:
-            self.cursor.execute(
-                "SELECT title, category FROM books WHERE status = 'available'"
-            )
-            books = self.cursor.fetchall()
-            for book in books:
-                tree.insert("", tk.END, values=(book['title'], book['category']))
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
+    def show_screen(self, build):
+        """Show the screen drawn by `build(parent)`, building it on first visit.
+
+        `build` returns a function that reloads the screen's data (or
+        None). Screens are hidden rather than destroyed when the user
+        moves on, and only that function runs when they come back.
+        """
+        if self.current_screen is not None:
+            # The screen being left reloads when it comes back, so its
+            # pending load is no longer wanted
+            if self.current_screen in RELOAD_KEYS:
+                self.executor.cancel(RELOAD_KEYS[self.current_screen])
+            self.screens[self.current_screen][0].pack_forget()
+        screen = self.screens.get(build.__name__)
+        if screen is None:
+            frame = tk.Frame(self.display_frame, bg="white")
+            frame.pack(fill=tk.BOTH, expand=True)
+            self.screens[build.__name__] = (frame, build(frame))
+        else:
+            frame, refresh = screen
+            frame.pack(fill=tk.BOTH, expand=True)
+            if refresh is not None:
+                refresh()
+        self.current_screen = build.__name__
+
+    def show_available_books(self, parent):
+        # One row per title, from the cache's copy counters
+        grid = PagedGrid(
+            parent,
+            columns=[("Book", "Book Title"), ("Category", "Category"), ("Copies", "Available")],
+            fetch=self.catalog.available_title_page,
+            key_of=lambda title: title['title'],
+            format_row=lambda title: (title['title'], title['category'],
+                                      f"{title['available']} of {title['copies']}"),
+            run=self.paged_runner("available.list"),
+        )
+        grid.pack(pady=10, fill=tk.BOTH, expand=True)
+        return grid.reload
 
-    def borrow_book(self):
-        self.clear_display()
-        frame = tk.Frame(self.display_frame, bg="white")
+    def borrow_book(self, parent):
+        frame = tk.Frame(parent, bg="white")
         frame.pack(pady=20)
 
         tk.Label(frame, text="Available Books:", font=("Helvetica", 12, "bold"), bg="white").pack()
         books_list = tk.Listbox(frame, font=("Helvetica", 11), width=40, height=8)
         books_list.pack(pady=10)
         
-        try:
-            self.cursor.execute(
-                "SELECT title FROM books WHERE status = 'available'"
-            )
-            books = self.cursor.fetchall()
-            for book in books:
-                books_list.insert(tk.END, book['title'])
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
+        shown = {'books': None}
+        ids = []  # book_id of each row, in order
+
+        def fill(books):
+            # The cache hands back the same list until the catalog changes
+            if books is shown['books']:
+                return
+            shown['books'] = books
+            books_list.delete(0, tk.END)
+            ids[:] = [book_id for book_id, _ in books]
+            for _, title in books:
+                books_list.insert(tk.END, title)
+
+        def show(book_id, title, available):
+            index = bisect_left(ids, book_id)
+            if index < len(ids) and ids[index] == book_id:
+                if available and books_list.get(index) == title:
+                    return
+                del ids[index]
+                books_list.delete(index)
+            if available:
+                ids.insert(index, book_id)
+                books_list.insert(index, title)
+
+        def on_events(events):
+            if events is None:
+                shown['books'] = None
+                refresh()
+                return
+            for event in events:
+                if event['kind'] == 'book':
+                    show(event['book_id'], event['title'], event['status'] == 'available')
+
+        def refresh():
+            self.run_query("borrow.list", self.catalog.available_titles,
+                           on_done=fill, widget=books_list, key="borrow.list")
+
+        refresh()
+        self.feed.subscribe(on_events)
 
         tk.Label(frame, text="Enter book name:", font=("Helvetica", 12), bg="white").pack()
         book_entry = tk.Entry(frame, font=("Helvetica", 12))
         book_entry.pack(pady=10)
 
+        also_label = tk.Label(frame, text="", font=("Helvetica", 10), bg="white",
+                              wraplength=500, justify=tk.LEFT)
+        typeahead = Typeahead(
+            book_entry, self.catalog.suggest, self.paged_runner("borrow.suggest", "borrow.suggest"),
+            on_select=lambda title, book_ids: self.show_recommendations(
+                also_label, title, "borrow.recommend"))
+
+        def select(event):
+            selection = books_list.curselection()
+            if selection:
+                title = books_list.get(selection[0])
+                typeahead.set(title, [ids[selection[0]]])
+                self.show_recommendations(also_label, title, "borrow.recommend")
+
+        books_list.bind('<<ListboxSelect>>', select)
+
         def submit():
             book_name = book_entry.get().strip()
-            try:
-                # Start transaction
-                self.cursor.execute("START TRANSACTION")
-                
-                # Get book details
-                self.cursor.execute(
-                    "SELECT book_id FROM books WHERE title = %s AND status = 'available'",
-                    (book_name,)
-                )
-                book = self.cursor.fetchone()
-                
-                if book:
-                    due_date = datetime.now() + timedelta(days=7)
-                    
-                    # Update book status
-                    self.cursor.execute(
-                        "UPDATE books SET status = 'issued' WHERE book_id = %s",
-                        (book['book_id'],)
-                    )
-                    
-                    # Create transaction record
-                    self.cursor.execute(
-                        """INSERT INTO transactions 
-                           (book_id, student_id, due_date) 
-                           VALUES (%s, %s, %s)""",
-                        (book['book_id'], self.student['id'], due_date)
-                    )
-                    
-                    self.conn.commit()
-                    messagebox.showinfo("Success", f"Book '{book_name}' borrowed successfully!")
-                    
-                    # Update display
-                    books_list.delete(0, tk.END)
-                    self.cursor.execute(
-                        "SELECT title FROM books WHERE status = 'available'"
-                    )
-                    available_books = self.cursor.fetchall()
-                    for book in available_books:
-                        books_list.insert(tk.END, book['title'])
-                else:
-                    messagebox.showerror("Error", "Book not available")
-                    self.conn.rollback()
+            chosen = typeahead.book_ids()
+
+            def done(result):
+                book_id, title, suggestions = result
+                if book_id is not None:
+                    self.catalog.set_status(book_id, 'issued')
+                    show(book_id, title, False)
+                    self.show_recommendations(also_label, title, "borrow.recommend")
+                    messagebox.showinfo("Success", f"Book '{title}' borrowed successfully!")
+                elif suggestions:
+                    messagebox.showerror("Error", f"No book called '{book_name}'. Did you mean: "
+                                         + ", ".join(title for title, _ in suggestions) + "?")
+                elif title is None:
+                    messagebox.showerror("Error", f"No book called '{book_name}'")
+                elif messagebox.askyesno("Not available",
+                                         f"Every copy of '{title}' is out. Place a hold? "
+                                         "The next copy returned will be issued to you."):
+                    self.run_query("borrow.hold", self.repo.place_hold, self.student['id'], title,
+                                   on_done=lambda position: held(title, position))
                 
                 book_entry.delete(0, tk.END)
-            except Error as e:
-                self.conn.rollback()
-                messagebox.showerror("Database Error", str(e))
+
+            def held(title, position):
+                if position is None:
+                    messagebox.showerror("Error", f"No book called '{title}'")
+                elif position == 0:
+                    messagebox.showinfo("Available", f"A copy of '{title}' has just come back."
+                                        " Borrow it now.")
+                else:
+                    messagebox.showinfo("Hold placed",
+                                        f"You are number {position} in the queue for '{title}'.")
+
+            def checkout():
+                # A typed title is resolved in the cache, so a typo never
+                # reaches the database
+                book_ids = chosen if chosen is not None else self.catalog.resolve(book_name)
+                if not book_ids:
+                    return None, None, self.catalog.suggest(book_name, 3)
+                # A copy picked from the list comes first, then the
+                # title's other copies
+                first = self.catalog.get(book_ids[0])
+                if first is not None:
+                    book_ids = list(dict.fromkeys(book_ids + self.catalog.ids_for_title(first.title)))
+                # Try the copies the cache believes are free; each attempt
+                # is a single conditional update, so a stale cache only
+                # costs a retry on the next copy.
+                title = None
+                for book_id in book_ids:
+                    book = self.catalog.get(book_id)
+                    if book is None:
+                        continue
+                    title = book.title
+                    if book.status == 'available' and self.repo.checkout(self.student['id'], book_id):
+                        return book_id, title, None
+                return None, title, None
+
+            self.run_query("borrow.submit", checkout, on_done=done, widget=book_entry)
 
         tk.Button(frame, text="Borrow", command=submit,
                  font=("Helvetica", 12), bg="#4CAF50", fg="white").pack()
+        also_label.pack(pady=10)
+        # Kept current by the feed while hidden
+        return None
 
-    def return_book(self):
-        self.clear_display()
-        frame = tk.Frame(self.display_frame, bg="white")
+    def return_book(self, parent):
+        frame = tk.Frame(parent, bg="white")
         frame.pack(pady=20)
 
         tk.Label(frame, text="Your Borrowed Books:", font=("Helvetica", 12, "bold"), bg="white").pack()
         books_list = tk.Listbox(frame, font=("Helvetica", 11), width=40, height=8)
         books_list.pack(pady=10)
 
-        try:
-            self.cursor.execute("""
-                SELECT b.title 
-                FROM books b
-                JOIN transactions t ON b.book_id = t.book_id
-                WHERE t.student_id = %s AND t.return_date IS NULL
-                """, (self.student['id'],))
-            books = self.cursor.fetchall()
+        held = []  # book_id of each row, in order
+        loans = {'index': None}  # TitleIndex over the rows, built when needed
+
+        def fill(books):
+            books_list.delete(0, tk.END)
+            held.clear()
             for book in books:
-                books_list.insert(tk.END, book['title'])
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
+                add(book['book_id'], book['title'])
+
+        def add(book_id, title):
+            if book_id not in held:
+                held.append(book_id)
+                books_list.insert(tk.END, title)
+                loans['index'] = None
+
+        def drop(book_id):
+            if book_id not in held:
+                return
+            index = held.index(book_id)
+            del held[index]
+            books_list.delete(index)
+            loans['index'] = None
+
+        def loan_index():
+            if loans['index'] is None:
+                titles = {}
+                for i, book_id in enumerate(held):
+                    titles.setdefault(books_list.get(i), set()).add(book_id)
+                loans['index'] = TitleIndex(titles)
+            return loans['index']
+
+        def on_events(events):
+            if events is None:
+                refresh()
+                return
+            for event in events:
+                if event['kind'] in ('loan', 'return') and event['student_id'] == self.student['id']:
+                    if open_loan(event):
+                        add(event['book_id'], event['title'])
+                    else:
+                        drop(event['book_id'])
+
+        def refresh():
+            self.run_query("return.list", self.repo.open_loans, self.student['id'],
+                           on_done=fill, widget=books_list, key="return.list")
+
+        refresh()
+        self.feed.subscribe(on_events)
 
         tk.Label(frame, text="Enter book name:", font=("Helvetica", 12), bg="white").pack()
         book_entry = tk.Entry(frame, font=("Helvetica", 12))
         book_entry.pack(pady=10)
+        # A student's own loans are few; suggest from them on the Tk thread
+        typeahead = Typeahead(book_entry, lambda text, limit: loan_index().suggest(text, limit),
+                              lambda fn, on_done: on_done(fn()))
+
+        def select(event):
+            selection = books_list.curselection()
+            if selection:
+                typeahead.set(books_list.get(selection[0]), [held[selection[0]]])
+
+        books_list.bind('<<ListboxSelect>>', select)
 
         def submit():
             book_name = book_entry.get().strip()
-            try:
-                self.cursor.execute("START TRANSACTION")
-                
-                # Get transaction details
-                self.cursor.execute("""
-                    SELECT t.transaction_id, t.due_date, b.book_id
-                    FROM transactions t
-                    JOIN books b ON t.book_id = b.book_id
-                    WHERE b.title = %s AND t.student_id = %s AND t.return_date IS NULL
-                    """, (book_name, self.student['id']))
-                transaction = self.cursor.fetchone()
+            book_ids = typeahead.book_ids()
+            if book_ids is None:
+                book_ids = loan_index().resolve(book_name)
+            if not book_ids:
+                messagebox.showerror("Error", "You haven't borrowed this book")
+                return
                 
-                if transaction:
-                    return_date = datetime.now()
-                    days_late = max(0, (return_date - transaction['due_date']).days)
-                    penalty = days_late * 1.0  # Rs. 1 per day
-                    
-                    # Update transaction
-                    self.cursor.execute("""
-                        UPDATE transactions 
-                        SET return_date = %s, penalty_amount = %s
-                        WHERE transaction_id = %s
-                        """, (return_date, penalty, transaction['transaction_id']))
-                    
-                    # Update book status
-                    self.cursor.execute("""
-                        UPDATE books 
-                        SET status = 'available'
-                        WHERE book_id = %s
-                        """, (transaction['book_id'],))
-                    
-                    self.conn.commit()
-                    
-                    msg = f"Book '{book_name}' returned successfully!"
+            def done(returned):
+                if returned is not None:
+                    book_id, penalty = returned
+                    title = books_list.get(held.index(book_id)) if book_id in held else book_name
+                    drop(book_id)
+                    msg = f"Book '{title}' returned successfully!"
                     if penalty > 0:
                         msg += f"\nLate return penalty: Rs. {penalty}"
                     messagebox.showinfo("Success", msg)
-                    
-                    # Update display
-                    books_list.delete(0, tk.END)
-                    self.cursor.execute("""
-                        SELECT b.title 
-                        FROM books b
-                        JOIN transactions t ON b.book_id = t.book_id
-                        WHERE t.student_id = %s AND t.return_date IS NULL
-                        """, (self.student['id'],))
-                    borrowed_books = self.cursor.fetchall()
-                    for book in borrowed_books:
-                        books_list.insert(tk.END, book['title'])
                 else:
                     messagebox.showerror("Error", "You haven't borrowed this book")
-                    self.conn.rollback()
                 
                 book_entry.delete(0, tk.END)
-            except Error as e:
-                self.conn.rollback()
-                messagebox.showerror("Database Error", str(e))
+
+            def checkin():
+                for book_id in book_ids:
+                    penalty = self.repo.checkin(self.student['id'], book_id)
+                    if penalty is not None:
+                        # The copy may have gone straight to a student
+                        # waiting for it; read back its status
+                        self.catalog.refresh(force=True)
+                        return book_id, penalty
+                return None
+
+            self.run_query("return.submit", checkin, on_done=done, widget=book_entry)
 
         tk.Button(frame, text="Return", command=submit,
                  font=("Helvetica", 12), bg="#4CAF50", fg="white").pack()
-
-    def show_transaction_history(self):
-        self.clear_display()
-        tree = ttk.Treeview(self.display_frame, columns=("Book", "Issue Date", "Due Date", "Return Date", "Penalty"), show="headings")
+        return None
+
+    def scan_cart(self, parent):
+        """Batch checkout/return: scanned book IDs are applied together."""
+        frame = tk.Frame(parent, bg="white")
+        frame.pack(pady=20, fill=tk.BOTH, expand=True)
+
+        mode = tk.StringVar(value="checkout")
+        mode_frame = tk.Frame(frame, bg="white")
+        mode_frame.pack()
+        tk.Radiobutton(mode_frame, text=f"Check out to {self.student['name']}", variable=mode,
+                       value="checkout", bg="white").pack(side=tk.LEFT)
+        tk.Radiobutton(mode_frame, text="Return (any student)", variable=mode,
+                       value="return", bg="white").pack(side=tk.LEFT)
+
+        tk.Label(frame, text="Scan book ID:", font=("Helvetica", 12), bg="white").pack()
+        scan_entry = tk.Entry(frame, font=("Helvetica", 12))
+        scan_entry.pack(pady=10)
+        scan_entry.focus_set()
+
+        tree = ttk.Treeview(frame, columns=("ID", "Book", "Result"), show="headings", height=12)
+        tree.heading("ID", text="Book ID")
         tree.heading("Book", text="Book Title")
-        tree.heading("Issue Date", text="Issue Date")
-        tree.heading("Due Date", text="Due Date")
-        tree.heading("Return Date", text="Return Date")
-        tree.heading("Penalty", text="Penalty (Rs.)")
+        tree.heading("Result", text="Result")
+        tree.column("ID", width=80)
         tree.pack(pady=10, fill=tk.BOTH, expand=True)
 
-        try:
-            self.cursor.execute("""
-                SELECT b.title, t.issued_date, t.due_date, t.return_date, t.penalty_amount
-                FROM transactions t
-                JOIN books b ON t.book_id = b.book_id
-                WHERE t.student_id = %s
-                ORDER BY t.issued_date DESC
-                """, (self.student['id'],))
-            transactions = self.cursor.fetchall()
-            for t in transactions:
-                return_date = t['return_date'].strftime('%Y-%m-%d') if t['return_date'] else "Not Returned"
-                tree.insert("", tk.END, values=(
-                    t['title'],
-                    t['issued_date'].strftime('%Y-%m-%d'),
-                    t['due_date'].strftime('%Y-%m-%d'),
-                    return_date,
-                    t['penalty_amount']
-                ))
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
-
-    def search_books(self):
-        self.clear_display()
-        frame = tk.Frame(self.display_frame, bg="white")
+        summary = tk.Label(frame, text="Cart is empty", font=("Helvetica", 11), bg="white")
+        summary.pack()
+        cart = {}  # book_id -> tree item, for scans not yet processed
+
+        def set_result(item, result):
+            # The row is gone if the cart was cleared meanwhile
+            if tree.exists(item):
+                tree.set(item, "Result", result)
+
+        def show_title(item):
+            def fill(book):
+                if tree.exists(item):
+                    tree.set(item, "Book", book.title if book else "Unknown book")
+                    if tree.set(item, "Result") == "Looking up...":
+                        set_result(item, "Queued")
+            return fill
+
+        def scan(event=None):
+            code = scan_entry.get().strip()
+            scan_entry.delete(0, tk.END)
+            if not code:
+                return
+            if not code.isdigit():
+                tree.insert("", 0, values=(code, "", "Not a book ID"))
+                return
+            book_id = int(code)
+            if book_id in cart:
+                return  # scanned twice
+            item = cart[book_id] = tree.insert("", 0, values=(book_id, "", "Looking up..."))
+            summary.config(text=f"{len(cart)} books in cart")
+            self.run_query("cart.lookup", self.catalog.get, book_id,
+                           on_done=show_title(item), widget=tree)
+
+        def process():
+            if not cart:
+                return
+            batch = dict(cart)
+            cart.clear()
+            for item in batch.values():
+                set_result(item, "Processing...")
+
+            if mode.get() == "checkout":
+                def done(results):
+                    issued = 0
+                    for book_id, ok in results:
+                        if ok:
+                            issued += 1
+                            self.catalog.set_status(book_id, 'issued')
+                        set_result(batch[book_id], "Issued" if ok else "Not available")
+                    summary.config(text=f"Issued {issued} of {len(results)} books")
+
+                self.run_query("cart.checkout", self.repo.checkout_many,
+                               self.student['id'], list(batch), on_done=done, widget=tree)
+            else:
+                def done(results):
+                    returned, total = 0, 0.0
+                    for book_id, penalty in results:
+                        if penalty is None:
+                            set_result(batch[book_id], "Not on loan")
+                            continue
+                        returned += 1
+                        total += penalty
+                        set_result(batch[book_id],
+                                   f"Returned, penalty Rs. {penalty}" if penalty > 0 else "Returned")
+                    summary.config(text=f"Returned {returned} of {len(results)} books"
+                                        f" - penalties Rs. {total}")
+
+                def checkin():
+                    results = self.repo.checkin_many(list(batch))
+                    # Copies with holds on them were issued again
+                    self.catalog.refresh(force=True)
+                    return results
+
+                self.run_query("cart.return", checkin, on_done=done, widget=tree)
+
+        def clear():
+            cart.clear()
+            tree.delete(*tree.get_children())
+            summary.config(text="Cart is empty")
+
+        scan_entry.bind('<Return>', scan)
+
+        buttons = tk.Frame(frame, bg="white")
+        buttons.pack(pady=5)
+        tk.Button(buttons, text="Process Cart", command=process,
+                 font=("Helvetica", 12), bg="#4CAF50", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Clear", command=clear,
+                 font=("Helvetica", 12)).pack(side=tk.LEFT, padx=5)
+        # The cart survives a trip to another screen
+        return scan_entry.focus_set
+
+    def show_transaction_history(self, parent):
+        def format_row(t):
+            return_date = t['return_date'].strftime('%Y-%m-%d') if t['return_date'] else "Not Returned"
+            return (
+                t['title'],
+                t['issued_date'].strftime('%Y-%m-%d'),
+                t['due_date'].strftime('%Y-%m-%d'),
+                return_date,
+                t['penalty_amount']
+            )
+
+        grid = PagedGrid(
+            parent,
+            columns=[("Book", "Book Title"), ("Issue Date", "Issue Date"), ("Due Date", "Due Date"),
+                     ("Return Date", "Return Date"), ("Penalty", "Penalty (Rs.)")],
+            fetch=lambda **page: self.repo.history_page(self.student['id'], **page),
+            key_of=lambda t: (t['issued_date'], t['transaction_id']),
+            format_row=format_row,
+            run=self.paged_runner("history.fetch"),
+        )
+        grid.pack(pady=10, fill=tk.BOTH, expand=True)
+        return grid.reload
+
+    def search_books(self, parent):
+        frame = tk.Frame(parent, bg="white")
         frame.pack(pady=20)
 
         tk.Label(frame, text="Search Books", font=("Helvetica", 12, "bold"), bg="white").pack()
@@ -354,99 +668,181 @@ class LibraryGUI:
         tree.heading("Status", text="Status")
         tree.pack(pady=10, fill=tk.BOTH, expand=True)
 
-        def search():
+        pager = tk.Frame(frame, bg="white")
+        pager.pack(pady=5)
+        page_label = tk.Label(pager, text="", font=("Helvetica", 10), bg="white")
+        state = {'term': "", 'page': 0, 'pending': None}
+
+        def fill(result):
+            total, books = result
             for item in tree.get_children():
                 tree.delete(item)
-            search_term = f"%{search_entry.get().strip()}%"
-            try:
-                self.cursor.execute("""
-                    SELECT title, category, status
-                    FROM books
-                    WHERE title LIKE %s OR category LIKE %s
-                    """, (search_term, search_term))
-                books = self.cursor.fetchall()
-                for book in books:
-                    tree.insert("", tk.END, values=(book['title'], book['category'], book['status']))
-            except Error as e:
-                messagebox.showerror("Database Error", str(e))
-
-        tk.Button(frame, text="Search", command=search,
+            for book in books:
+                tree.insert("", tk.END, values=(book['title'], book['category'], book['status']))
+            pages = max(1, -(-total // SEARCH_PAGE_SIZE))
+            page_label.config(text=f"{total} matches - page {state['page'] + 1} of {pages}")
+            prev_button.config(state=tk.NORMAL if state['page'] > 0 else tk.DISABLED)
+            next_button.config(state=tk.NORMAL if state['page'] + 1 < pages else tk.DISABLED)
+
+        def search():
+            state['pending'] = None
+            # A newer search replaces one still running
+            self.run_query("search", self.catalog.search, state['term'],
+                           SEARCH_PAGE_SIZE, state['page'] * SEARCH_PAGE_SIZE,
+                           on_done=fill, widget=tree, key="search.results")
+
+        def schedule(delay):
+            if state['pending'] is not None:
+                search_entry.after_cancel(state['pending'])
+            state['pending'] = search_entry.after(delay, search)
+
+        def on_type(event):
+            # Search as you type, once typing pauses
+            term = search_entry.get().strip()
+            if term != state['term']:
+                state['term'], state['page'] = term, 0
+                schedule(SEARCH_DEBOUNCE_MS)
+
+        def search_now(event=None):
+            state['term'], state['page'] = search_entry.get().strip(), 0
+            schedule(0)
+
+        def turn(step):
+            state['page'] += step
+            search()
+
+        prev_button = tk.Button(pager, text="< Prev", command=lambda: turn(-1),
+                                font=("Helvetica", 10), state=tk.DISABLED)
+        next_button = tk.Button(pager, text="Next >", command=lambda: turn(1),
+                                font=("Helvetica", 10), state=tk.DISABLED)
+        prev_button.pack(side=tk.LEFT)
+        page_label.pack(side=tk.LEFT, padx=10)
+        next_button.pack(side=tk.LEFT)
+
+        search_entry.bind('<KeyRelease>', on_type)
+        search_entry.bind('<Return>', search_now)
+
+        tk.Button(frame, text="Search", command=search_now,
                  font=("Helvetica", 12), bg="#2196F3", fg="white").pack()
 
-    def browse_categories(self):
-        self.clear_display()
-        frame = tk.Frame(self.display_frame, bg="white")
+        def refresh():
+            # Statuses may have changed while the screen was hidden
+            if state['term']:
+                search()
+
+        return refresh
+
+    def browse_categories(self, parent):
+        frame = tk.Frame(parent, bg="white")
         frame.pack(pady=20)
 
         tk.Label(frame, text="Categories", font=("Helvetica", 12, "bold"), bg="white").pack()
         categories_list = tk.Listbox(frame, font=("Helvetica", 11), width=40, height=5)
         categories_list.pack(pady=10)
 
-        tree = ttk.Treeview(frame, columns=("Book", "Status"), show="headings")
+        tree = ttk.Treeview(frame, columns=("Book", "Copies"), show="headings")
         tree.heading("Book", text="Book Title")
-        tree.heading("Status", text="Status")
+        tree.heading("Copies", text="Available")
         tree.pack(pady=10, fill=tk.BOTH, expand=True)
 
-        try:
-            self.cursor.execute("SELECT DISTINCT category FROM books ORDER BY category")
-            categories = self.cursor.fetchall()
+        state = {'category': None}
+
+        def fill_categories(categories):
+            categories_list.delete(0, tk.END)
             for category in categories:
-                categories_list.insert(tk.END, category['category'])
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
+                categories_list.insert(tk.END, category)
 
-        def show_books(event):
+        def fill_books(books):
             for item in tree.get_children():
                 tree.delete(item)
+            for book in books:
+                tree.insert("", tk.END, values=(book['title'],
+                                                f"{book['available']} of {book['copies']}"))
+
+        def load_books():
+            self.run_query("categories.books", self.catalog.books_in_category, state['category'],
+                           on_done=fill_books, widget=tree, key="categories.books")
+
+        def show_books(event):
             selection = categories_list.curselection()
             if selection:
-                category = categories_list.get(selection[0])
-                try:
-                    self.cursor.execute("""
-                        SELECT title, status
-                        FROM books
-                        WHERE category = %s
-                        """, (category,))
-                    books = self.cursor.fetchall()
-                    for book in books:
-                        tree.insert("", tk.END, values=(book['title'], book['status']))
-                except Error as e:
-                    messagebox.showerror("Database Error", str(e))
+                state['category'] = categories_list.get(selection[0])
+                load_books()
 
         categories_list.bind('<<ListboxSelect>>', show_books)
 
-    def show_my_books(self):
-        self.clear_display()
-        tree = ttk.Treeview(self.display_frame, columns=("Book", "Issue Date", "Due Date", "Days Left"), show="headings")
+        def refresh():
+            self.run_query("categories.list", self.catalog.categories,
+                           on_done=fill_categories, widget=categories_list)
+            if state['category'] is not None:
+                load_books()
+
+        refresh()
+        return refresh
+
+    def show_my_books(self, parent):
+        tree = ttk.Treeview(parent, columns=("Book", "Issue Date", "Due Date", "Days Left", "Fine"), show="headings")
         tree.heading("Book", text="Book Title")
         tree.heading("Issue Date", text="Issue Date")
         tree.heading("Due Date", text="Due Date")
         tree.heading("Days Left", text="Days Left")
+        tree.heading("Fine", text="Fine (Rs.)")
         tree.pack(pady=10, fill=tk.BOTH, expand=True)
-
-        try:
-            self.cursor.execute("""
-                SELECT b.title, t.issued_date, t.due_date
-                FROM transactions t
-                JOIN books b ON t.book_id = b.book_id
-                WHERE t.student_id = %s AND t.return_date IS NULL
-                ORDER BY t.due_date
-                """, (self.student['id'],))
-            books = self.cursor.fetchall()
+        total_label = tk.Label(parent, text="", font=("Helvetica", 11), bg="white")
+        total_label.pack()
+
+        fines = {}  # book_id -> fine, for the rows shown
+
+        def add(book):
+            days_late = FinePolicy.days_late(book['due_date'], datetime.now())
+            # One open loan per copy, so the book_id names the row
+            tree.insert("", tk.END, iid=str(book['book_id']), values=(
+                book['title'],
+                book['issued_date'].strftime('%Y-%m-%d'),
+                book['due_date'].strftime('%Y-%m-%d'),
+                f"{days_late} days overdue" if days_late > 0 else f"{-days_late} days",
+                book['fine']
+            ))
+            fines[book['book_id']] = float(book['fine'])
+
+        def show_total():
+            # Fines come from the nightly ledger
+            total = sum(fines.values())
+            total_label.config(text=f"Outstanding fines: Rs. {total:.2f}" if total else "")
+
+        def fill(books):
+            tree.delete(*tree.get_children())
+            fines.clear()
             for book in books:
-                days_left = (book['due_date'] - datetime.now()).days
-                tree.insert("", tk.END, values=(
-                    book['title'],
-                    book['issued_date'].strftime('%Y-%m-%d'),
-                    book['due_date'].strftime('%Y-%m-%d'),
-                    f"{days_left} days"
-                ))
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
-
-    def book_reviews(self):
-        self.clear_display()
-        frame = tk.Frame(self.display_frame, bg="white")
+                add(book)
+            show_total()
+
+        def on_events(events):
+            if events is None:
+                refresh()
+                return
+            for event in events:
+                if event['kind'] not in ('loan', 'return') or event['student_id'] != self.student['id']:
+                    continue
+                iid = str(event['book_id'])
+                if open_loan(event):
+                    if not tree.exists(iid):
+                        add(dict(event, fine=0))
+                elif tree.exists(iid):
+                    tree.delete(iid)
+                    fines.pop(event['book_id'], None)
+            show_total()
+
+        def refresh():
+            self.run_query("my_books.fetch", self.repo.open_loans, self.student['id'],
+                           on_done=fill, widget=tree, key="my_books.list")
+
+        refresh()
+        self.feed.subscribe(on_events)
+        return None
+
+    def book_reviews(self, parent):
+        frame = tk.Frame(parent, bg="white")
         frame.pack(pady=20)
 
         # Book selection
@@ -454,55 +850,100 @@ class LibraryGUI:
         books_list = ttk.Combobox(frame, font=("Helvetica", 11), width=40)
         books_list.pack(pady=10)
 
-        # Reviews display
-        reviews_frame = tk.Frame(frame, bg="white")
-        reviews_frame.pack(pady=10, fill=tk.BOTH, expand=True)
+        # Rating summary, then the reviews drawn page by page into one Text
+        summary_label = tk.Label(frame, text="", font=("Helvetica", 11), bg="white")
+        summary_label.pack(pady=5)
+        also_label = tk.Label(frame, text="", font=("Helvetica", 10), bg="white",
+                              wraplength=500, justify=tk.LEFT)
+        also_label.pack(pady=5)
+
+        feed_frame = tk.Frame(frame, bg="white")
+        feed_frame.pack(pady=10, fill=tk.BOTH, expand=True)
+        feed = tk.Text(feed_frame, height=12, width=60, wrap=tk.WORD, font=("Helvetica", 11),
+                       relief=tk.FLAT, state=tk.DISABLED)
+        feed_scroll = ttk.Scrollbar(feed_frame, orient="vertical", command=feed.yview)
+        feed_scroll.pack(side="right", fill="y")
+        feed.pack(side="left", fill=tk.BOTH, expand=True)
+        feed.tag_configure("rating", font=("Helvetica", 10))
+        feed.tag_configure("byline", font=("Helvetica", 10, "italic"))
+        feed.tag_configure("text", spacing1=3, spacing3=12)
+        state = {'title': None, 'last': None, 'loading': False, 'at_end': True, 'generation': 0,
+                 'titles': None}
+
+        def fill_titles(titles):
+            # Unchanged unless the catalog changed; skip redrawing it
+            if titles is not state['titles']:
+                state['titles'] = titles
+                books_list['values'] = titles
+
+        def load_titles():
+            self.run_query("reviews.titles", self.catalog.all_titles,
+                           on_done=fill_titles, widget=books_list)
+
+        load_titles()
+
+        def show_summary(summary):
+            if not summary['count']:
+                summary_label.config(text="No reviews yet")
+                return
+            average = f"{summary['average']:.1f}" if summary['average'] is not None else "-"
+            bars = "   ".join(f"{stars}★ {count}" for stars, count
+                               in reversed(list(enumerate(summary['histogram'], 1))))
+            summary_label.config(text=f"Average {average} from {summary['count']} reviews\n{bars}")
+
+        def add_page(reviews):
+            state['loading'] = False
+            state['at_end'] = len(reviews) < REVIEW_PAGE_SIZE
+            if not reviews:
+                return
+            state['last'] = (reviews[-1]['created_at'], reviews[-1]['review_id'])
+            feed.config(state=tk.NORMAL)
+            for review in reviews:
+                feed.insert(tk.END, f"Rating: {'★' * (review['rating'] or 0)}\n", "rating")
+                feed.insert(tk.END, f"By {review['name']} on {review['created_at'].strftime('%Y-%m-%d')}\n", "byline")
+                feed.insert(tk.END, f"{review['review_text']}\n", "text")
+            feed.config(state=tk.DISABLED)
+
+        def load_more():
+            if state['loading'] or state['at_end']:
+                return
+            state['loading'] = True
+            generation = state['generation']
+
+            def done(reviews):
+                if generation == state['generation']:
+                    add_page(reviews)
 
-        try:
-            self.cursor.execute("SELECT title FROM books ORDER BY title")
-            books = self.cursor.fetchall()
-            books_list['values'] = [book['title'] for book in books]
-        except Error as e:
-            messagebox.showerror("Database Error", str(e))
+            self.run_query("reviews.page", self.repo.review_page, state['title'], state['last'],
+                           on_done=done, widget=feed, key="reviews.page")
 
-        def show_reviews(event=None):
-            for widget in reviews_frame.winfo_children():
-                widget.destroy()
+        def on_scroll(first, last):
+            feed_scroll.set(first, last)
+            # Fetch the next page as the user nears the end of the feed
+            if float(last) >= 0.9:
+                load_more()
 
+        feed.configure(yscrollcommand=on_scroll)
+
+        def show_reviews(event=None):
             book_title = books_list.get()
             if not book_title:
                 return
 
-            try:
-                self.cursor.execute("""
-                    SELECT r.review_text, r.rating, s.name, r.created_at
-                    FROM reviews r
-                    JOIN books b ON r.book_id = b.book_id
-                    JOIN students s ON r.student_id = s.student_id
-                    WHERE b.title = %s
-                    ORDER BY r.created_at DESC
-                    """, (book_title,))
-                reviews = self.cursor.fetchall()
-
-                if reviews:
-                    for review in reviews:
-                        review_frame = tk.Frame(reviews_frame, bg="white", relief=tk.RIDGE, bd=1)
-                        review_frame.pack(pady=5, padx=5, fill=tk.X)
-                        
-                        tk.Label(review_frame, text=f"Rating: {'★' * review['rating']}", 
-                                bg="white", font=("Helvetica", 10)).pack(anchor=tk.W)
-                        tk.Label(review_frame, text=f"By {review['name']} on {review['created_at'].strftime('%Y-%m-%d')}", 
-                                bg="white", font=("Helvetica", 10, "italic")).pack(anchor=tk.W)
-                        tk.Label(review_frame, text=review['review_text'], 
-                                bg="white", font=("Helvetica", 11), wraplength=400).pack(anchor=tk.W, pady=5)
-                else:
-                    tk.Label(reviews_frame, text="No reviews yet", 
-                            bg="white", font=("Helvetica", 11)).pack()
-
-            except Error as e:
-                messagebox.showerror("Database Error", str(e))
+            state.update(title=book_title, last=None, loading=False, at_end=False)
+            state['generation'] += 1
+            feed.config(state=tk.NORMAL)
+            feed.delete("1.0", tk.END)
+            feed.config(state=tk.DISABLED)
+            self.run_query("reviews.summary", self.repo.review_summary, book_title,
+                           on_done=show_summary, widget=summary_label, key="reviews.summary")
+            self.show_recommendations(also_label, book_title, "reviews.recommend")
+            load_more()
 
         books_list.bind('<<ComboboxSelected>>', show_reviews)
+        typeahead = Typeahead(books_list, self.catalog.suggest,
+                              self.paged_runner("reviews.suggest", "reviews.suggest"),
+                              on_select=lambda title, book_ids: show_reviews())
 
         # Add review section
         add_review_frame = tk.Frame(frame, bg="white")
@@ -533,36 +974,55 @@ class LibraryGUI:
                 messagebox.showerror("Error", "Please write a review")
                 return
 
-            try:
-                # Get book_id
-                self.cursor.execute("SELECT book_id FROM books WHERE title = %s", (book_title,))
-                book = self.cursor.fetchone()
-                
-                if book:
-                    # Add review
-                    self.cursor.execute("""
-                        INSERT INTO reviews (book_id, student_id, review_text, rating)
-                        VALUES (%s, %s, %s, %s)
-                        """, (book['book_id'], self.student['id'], review, rating_var.get()))
-                    self.conn.commit()
-                    
+            chosen = typeahead.book_ids()
+            rating = rating_var.get()
+
+            def done(added):
+                if added:
                     messagebox.showinfo("Success", "Review submitted successfully!")
                     review_text.delete("1.0", tk.END)
                     show_reviews()
                 else:
                     messagebox.showerror("Error", "Book not found")
-            except Error as e:
-                messagebox.showerror("Database Error", str(e))
+
+            def add():
+                book_ids = chosen if chosen is not None else self.catalog.resolve(book_title)
+                if not book_ids:
+                    return False
+                return self.repo.add_review(self.student['id'], book_title, review, rating,
+                                            book_id=book_ids[0])
+
+            self.run_query("reviews.submit", add, on_done=done, widget=review_text)
 
         tk.Button(add_review_frame, text="Submit Review", command=submit_review,
                  font=("Helvetica", 12), bg="#4CAF50", fg="white").pack(pady=5)
 
+        def on_events(events):
+            if state['title'] is None or books_list.get() != state['title']:
+                return
+            # A new review of the book on show, from another student
+            # (this student's own reviews reload the feed on submit)
+            if events is None or any(
+                    event['kind'] == 'review' and event['title'] == state['title']
+                    and event['student_id'] != self.student['id'] for event in events):
+                show_reviews()
+
+        self.feed.subscribe(on_events)
+
+        def refresh():
+            # The titles are cached; new reviews arrive through the feed
+            load_titles()
+
+        return refresh
+
     def __del__(self):
-        if hasattr(self, 'conn') and self.conn.is_connected():
-            self.cursor.close()
-            self.conn.close()
+        if hasattr(self, 'executor'):
+            self.executor.shutdown()
+        if getattr(self, 'repo', None) is not None:
+            self.repo.close()
 
 if __name__ == "__main__":
+    configure()
     root = tk.Tk()
     app = LibraryGUI(root)
     root.mainloop()
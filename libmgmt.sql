@@ -30,7 +30,9 @@ CREATE TABLE `books` (
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`book_id`),
   KEY `idx_title` (`title`),
-  KEY `idx_status` (`status`)
+  KEY `idx_status` (`status`),
+  KEY `idx_category` (`category`,`title`,`status`),
+  FULLTEXT KEY `ft_title_category` (`title`,`category`)
 ) ENGINE=InnoDB AUTO_INCREMENT=12 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -44,6 +46,152 @@ INSERT INTO `books` VALUES (1,'Compiler Design','Computer Science','available','
 /*!40000 ALTER TABLE `books` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `catalog_changes`
+--
+
+DROP TABLE IF EXISTS `catalog_changes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `catalog_changes` (
+  `change_id` bigint NOT NULL AUTO_INCREMENT,
+  `book_id` int NOT NULL,
+  PRIMARY KEY (`change_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `catalog_events`
+--
+
+DROP TABLE IF EXISTS `catalog_events`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `catalog_events` (
+  `event_id` bigint NOT NULL AUTO_INCREMENT,
+  `kind` varchar(10) NOT NULL,
+  `book_id` int NOT NULL,
+  `student_id` int DEFAULT NULL,
+  `transaction_id` int DEFAULT NULL,
+  PRIMARY KEY (`event_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Triggers for table `books`: every change bumps the catalog version,
+-- is posted to the catalog event feed and updates its title's copy counters
+--
+
+DELIMITER ;;
+CREATE TRIGGER `trg_books_insert` AFTER INSERT ON `books` FOR EACH ROW INSERT INTO `catalog_changes` (`book_id`) VALUES (NEW.`book_id`) ;;
+CREATE TRIGGER `trg_books_update` AFTER UPDATE ON `books` FOR EACH ROW INSERT INTO `catalog_changes` (`book_id`) VALUES (NEW.`book_id`) ;;
+CREATE TRIGGER `trg_books_delete` AFTER DELETE ON `books` FOR EACH ROW INSERT INTO `catalog_changes` (`book_id`) VALUES (OLD.`book_id`) ;;
+CREATE TRIGGER `trg_events_books_insert` AFTER INSERT ON `books` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`) VALUES ('book', NEW.`book_id`) ;;
+CREATE TRIGGER `trg_events_books_update` AFTER UPDATE ON `books` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`) VALUES ('book', NEW.`book_id`) ;;
+CREATE TRIGGER `trg_events_books_delete` AFTER DELETE ON `books` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`) VALUES ('book', OLD.`book_id`) ;;
+CREATE TRIGGER `trg_titles_insert` AFTER INSERT ON `books` FOR EACH ROW INSERT INTO `titles` (`title`, `category`, `total_copies`, `available_copies`) VALUES (NEW.`title`, NEW.`category`, 1, NEW.`status` <=> 'available') ON DUPLICATE KEY UPDATE `total_copies` = `total_copies` + 1, `available_copies` = `available_copies` + VALUES(`available_copies`), `category` = (SELECT `category` FROM `books` WHERE `title` = NEW.`title` ORDER BY `book_id` LIMIT 1) ;;
+CREATE TRIGGER `trg_titles_update` AFTER UPDATE ON `books` FOR EACH ROW BEGIN
+    IF OLD.`title` <=> NEW.`title` THEN
+        UPDATE `titles` SET `available_copies` = `available_copies` + (NEW.`status` <=> 'available') - (OLD.`status` <=> 'available') WHERE `title` = NEW.`title` AND NOT (OLD.`status` <=> NEW.`status`);
+        UPDATE `titles` SET `category` = (SELECT `category` FROM `books` WHERE `title` = NEW.`title` ORDER BY `book_id` LIMIT 1) WHERE `title` = NEW.`title` AND NOT (OLD.`category` <=> NEW.`category`);
+    ELSE
+        UPDATE `titles` SET `total_copies` = `total_copies` - 1, `available_copies` = `available_copies` - (OLD.`status` <=> 'available'), `category` = (SELECT `category` FROM `books` WHERE `title` = OLD.`title` ORDER BY `book_id` LIMIT 1) WHERE `title` = OLD.`title`;
+        INSERT INTO `titles` (`title`, `category`, `total_copies`, `available_copies`) VALUES (NEW.`title`, NEW.`category`, 1, NEW.`status` <=> 'available') ON DUPLICATE KEY UPDATE `total_copies` = `total_copies` + 1, `available_copies` = `available_copies` + VALUES(`available_copies`), `category` = (SELECT `category` FROM `books` WHERE `title` = NEW.`title` ORDER BY `book_id` LIMIT 1);
+    END IF;
+END ;;
+CREATE TRIGGER `trg_titles_delete` AFTER DELETE ON `books` FOR EACH ROW UPDATE `titles` SET `total_copies` = `total_copies` - 1, `available_copies` = `available_copies` - (OLD.`status` <=> 'available'), `category` = (SELECT `category` FROM `books` WHERE `title` = OLD.`title` ORDER BY `book_id` LIMIT 1) WHERE `title` = OLD.`title` ;;
+DELIMITER ;
+
+--
+-- Table structure for table `fine_runs`
+--
+
+DROP TABLE IF EXISTS `fine_runs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `fine_runs` (
+  `run_id` int NOT NULL AUTO_INCREMENT,
+  `last_change` bigint NOT NULL,
+  `policy` varchar(100) NOT NULL,
+  `as_of` timestamp NOT NULL,
+  `loans` int NOT NULL,
+  PRIMARY KEY (`run_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `holds`
+--
+
+DROP TABLE IF EXISTS `holds`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `holds` (
+  `hold_id` int NOT NULL AUTO_INCREMENT,
+  `title_id` int NOT NULL,
+  `student_id` int NOT NULL,
+  `created_at` timestamp NOT NULL,
+  `served_at` timestamp NULL DEFAULT NULL,
+  `book_id` int DEFAULT NULL,
+  PRIMARY KEY (`hold_id`),
+  KEY `idx_holds_queue` (`title_id`,`served_at`,`hold_id`),
+  KEY `idx_holds_student` (`student_id`,`served_at`),
+  CONSTRAINT `holds_ibfk_1` FOREIGN KEY (`title_id`) REFERENCES `titles` (`title_id`),
+  CONSTRAINT `holds_ibfk_2` FOREIGN KEY (`student_id`) REFERENCES `students` (`student_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `import_checkpoints`
+--
+
+DROP TABLE IF EXISTS `import_checkpoints`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `import_checkpoints` (
+  `source` varchar(255) NOT NULL,
+  `rows_done` bigint NOT NULL,
+  PRIMARY KEY (`source`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `loan_changes`
+--
+
+DROP TABLE IF EXISTS `loan_changes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `loan_changes` (
+  `change_id` bigint NOT NULL AUTO_INCREMENT,
+  `transaction_id` int NOT NULL,
+  PRIMARY KEY (`change_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `loan_fines`
+--
+
+DROP TABLE IF EXISTS `loan_fines`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `loan_fines` (
+  `transaction_id` int NOT NULL,
+  `student_id` int DEFAULT NULL,
+  `book_id` int DEFAULT NULL,
+  `due_date` timestamp NOT NULL,
+  `days_overdue` int NOT NULL,
+  `fine` decimal(10,2) NOT NULL,
+  `accruing` tinyint NOT NULL,
+  `as_of` timestamp NOT NULL,
+  PRIMARY KEY (`transaction_id`),
+  KEY `idx_fines_student` (`student_id`),
+  KEY `idx_fines_overdue` (`days_overdue`),
+  KEY `idx_fines_accruing` (`accruing`,`due_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `reviews`
 --
@@ -59,8 +207,8 @@ CREATE TABLE `reviews` (
   `rating` int DEFAULT NULL,
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`review_id`),
-  KEY `book_id` (`book_id`),
   KEY `student_id` (`student_id`),
+  KEY `idx_reviews_book_created` (`book_id`,`created_at`,`review_id`),
   CONSTRAINT `reviews_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`),
   CONSTRAINT `reviews_ibfk_2` FOREIGN KEY (`student_id`) REFERENCES `students` (`student_id`),
   CONSTRAINT `reviews_chk_1` CHECK ((`rating` between 1 and 5))
@@ -77,6 +225,71 @@ INSERT INTO `reviews` VALUES (1,7,3,'good book',4,'2024-11-14 12:27:39');
 /*!40000 ALTER TABLE `reviews` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Triggers for table `reviews`: keep the per-book rating aggregates current
+-- and post new reviews to the catalog event feed
+--
+
+DELIMITER ;;
+CREATE TRIGGER `trg_reviews_stats` AFTER INSERT ON `reviews` FOR EACH ROW INSERT INTO `review_stats` (`book_id`, `review_count`, `rating_sum`, `rating_1`, `rating_2`, `rating_3`, `rating_4`, `rating_5`) SELECT NEW.`book_id`, 1, COALESCE(NEW.`rating`, 0), NEW.`rating` <=> 1, NEW.`rating` <=> 2, NEW.`rating` <=> 3, NEW.`rating` <=> 4, NEW.`rating` <=> 5 FROM DUAL WHERE NEW.`book_id` IS NOT NULL ON DUPLICATE KEY UPDATE `review_count` = `review_count` + 1, `rating_sum` = `rating_sum` + VALUES(`rating_sum`), `rating_1` = `rating_1` + VALUES(`rating_1`), `rating_2` = `rating_2` + VALUES(`rating_2`), `rating_3` = `rating_3` + VALUES(`rating_3`), `rating_4` = `rating_4` + VALUES(`rating_4`), `rating_5` = `rating_5` + VALUES(`rating_5`) ;;
+CREATE TRIGGER `trg_events_review` AFTER INSERT ON `reviews` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`, `student_id`) SELECT 'review', NEW.`book_id`, NEW.`student_id` FROM DUAL WHERE NEW.`book_id` IS NOT NULL ;;
+DELIMITER ;
+
+--
+-- Table structure for table `review_stats`
+--
+
+DROP TABLE IF EXISTS `review_stats`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `review_stats` (
+  `book_id` int NOT NULL,
+  `review_count` int NOT NULL DEFAULT '0',
+  `rating_sum` int NOT NULL DEFAULT '0',
+  `rating_1` int NOT NULL DEFAULT '0',
+  `rating_2` int NOT NULL DEFAULT '0',
+  `rating_3` int NOT NULL DEFAULT '0',
+  `rating_4` int NOT NULL DEFAULT '0',
+  `rating_5` int NOT NULL DEFAULT '0',
+  PRIMARY KEY (`book_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `review_stats`
+--
+
+LOCK TABLES `review_stats` WRITE;
+/*!40000 ALTER TABLE `review_stats` DISABLE KEYS */;
+INSERT INTO `review_stats` VALUES (7,1,4,0,0,0,1,0);
+/*!40000 ALTER TABLE `review_stats` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `schema_version`
+--
+
+DROP TABLE IF EXISTS `schema_version`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `schema_version` (
+  `version` int NOT NULL,
+  `description` varchar(200) NOT NULL,
+  `applied_at` timestamp NOT NULL,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `schema_version`
+--
+
+LOCK TABLES `schema_version` WRITE;
+/*!40000 ALTER TABLE `schema_version` DISABLE KEYS */;
+INSERT INTO `schema_version` VALUES (1,'unique student email','2024-11-14 18:26:30'),(2,'covering index for open loans','2024-11-14 18:26:30'),(3,'covering index for categories','2024-11-14 18:26:30'),(4,'reviews by book and date','2024-11-14 18:26:30'),(5,'catalog event feed','2024-11-14 18:26:30'),(6,'title holdings and holds queue','2024-11-14 18:26:30'),(7,'archive for closed loans','2024-11-14 18:26:30'),(8,'catalog change counter','2024-11-14 18:26:30'),(9,'full-text search and history by date','2024-11-14 18:26:30'),(10,'import checkpoints','2024-11-14 18:26:30'),(11,'fines ledger','2024-11-14 18:26:30'),(12,'review aggregates','2024-11-14 18:26:30'),(13,'title categories follow their books','2024-11-14 18:26:30'),(14,'title category from its oldest copy','2024-11-14 18:26:30');
+/*!40000 ALTER TABLE `schema_version` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `students`
 --
@@ -89,7 +302,8 @@ CREATE TABLE `students` (
   `name` varchar(100) NOT NULL,
   `email` varchar(100) DEFAULT NULL,
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
-  PRIMARY KEY (`student_id`)
+  PRIMARY KEY (`student_id`),
+  UNIQUE KEY `uq_students_email` (`email`)
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -103,6 +317,36 @@ INSERT INTO `students` VALUES (1,'Suraj','suraj.srivastav23@gmail.com','2024-11-
 /*!40000 ALTER TABLE `students` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `titles`
+--
+
+DROP TABLE IF EXISTS `titles`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `titles` (
+  `title_id` int NOT NULL AUTO_INCREMENT,
+  `title` varchar(200) NOT NULL,
+  `category` varchar(50) DEFAULT NULL,
+  `total_copies` int NOT NULL DEFAULT '0',
+  `available_copies` int NOT NULL DEFAULT '0',
+  PRIMARY KEY (`title_id`),
+  UNIQUE KEY `uq_titles_title` (`title`),
+  KEY `idx_titles_available` (`available_copies`,`title`),
+  KEY `idx_titles_category` (`category`,`title`)
+) ENGINE=InnoDB AUTO_INCREMENT=12 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `titles`
+--
+
+LOCK TABLES `titles` WRITE;
+/*!40000 ALTER TABLE `titles` DISABLE KEYS */;
+INSERT INTO `titles` VALUES (1,'Compiler Design','Computer Science',1,1),(2,'DBMS Notes','Computer Science',1,1),(3,'Data Science','Data & AI',1,1),(4,'Machine Learning','Data & AI',1,1),(5,'COA','General',1,1),(6,'CSS','General',1,0),(7,'COI','General',1,1),(8,'UHV','General',1,1),(9,'Python','Programming',1,1),(10,'Operating System','Computer Science',1,1),(11,'Automata','Programming',1,1);
+/*!40000 ALTER TABLE `titles` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `transactions`
 --
@@ -121,6 +365,9 @@ CREATE TABLE `transactions` (
   PRIMARY KEY (`transaction_id`),
   KEY `student_id` (`student_id`),
   KEY `idx_book_student` (`book_id`,`student_id`),
+  KEY `idx_student_issued` (`student_id`,`issued_date`,`transaction_id`),
+  KEY `idx_open_loans` (`student_id`,`return_date`,`due_date`,`book_id`,`issued_date`),
+  KEY `idx_transactions_returned` (`return_date`),
   CONSTRAINT `transactions_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`),
   CONSTRAINT `transactions_ibfk_2` FOREIGN KEY (`student_id`) REFERENCES `students` (`student_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -135,6 +382,51 @@ LOCK TABLES `transactions` WRITE;
 INSERT INTO `transactions` VALUES (1,6,2,'2024-11-14 12:17:31','2024-11-21 12:17:32',NULL,0.00);
 /*!40000 ALTER TABLE `transactions` ENABLE KEYS */;
 UNLOCK TABLES;
+
+--
+-- Triggers for table `transactions`: every change is logged for the fines engine;
+-- new loans and returns are posted to the catalog event feed
+--
+
+DELIMITER ;;
+CREATE TRIGGER `trg_transactions_insert` AFTER INSERT ON `transactions` FOR EACH ROW INSERT INTO `loan_changes` (`transaction_id`) VALUES (NEW.`transaction_id`) ;;
+CREATE TRIGGER `trg_transactions_update` AFTER UPDATE ON `transactions` FOR EACH ROW INSERT INTO `loan_changes` (`transaction_id`) VALUES (NEW.`transaction_id`) ;;
+CREATE TRIGGER `trg_events_loan` AFTER INSERT ON `transactions` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`, `student_id`, `transaction_id`) SELECT 'loan', NEW.`book_id`, NEW.`student_id`, NEW.`transaction_id` FROM DUAL WHERE NEW.`book_id` IS NOT NULL ;;
+CREATE TRIGGER `trg_events_return` AFTER UPDATE ON `transactions` FOR EACH ROW INSERT INTO `catalog_events` (`kind`, `book_id`, `student_id`, `transaction_id`) SELECT 'return', NEW.`book_id`, NEW.`student_id`, NEW.`transaction_id` FROM DUAL WHERE OLD.`return_date` IS NULL AND NEW.`return_date` IS NOT NULL AND NEW.`book_id` IS NOT NULL ;;
+DELIMITER ;
+
+--
+-- Table structure for table `transactions_archive`: closed loans moved
+-- out of `transactions` by archive.py
+--
+
+DROP TABLE IF EXISTS `transactions_archive`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `transactions_archive` (
+  `transaction_id` int NOT NULL,
+  `book_id` int DEFAULT NULL,
+  `student_id` int DEFAULT NULL,
+  `issued_date` timestamp NULL DEFAULT NULL,
+  `due_date` timestamp NULL DEFAULT NULL,
+  `return_date` timestamp NULL DEFAULT NULL,
+  `penalty_amount` decimal(10,2) DEFAULT '0.00',
+  PRIMARY KEY (`transaction_id`),
+  KEY `idx_archive_student_issued` (`student_id`,`issued_date`,`transaction_id`),
+  KEY `idx_archive_book` (`book_id`),
+  CONSTRAINT `transactions_archive_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`),
+  CONSTRAINT `transactions_archive_ibfk_2` FOREIGN KEY (`student_id`) REFERENCES `students` (`student_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `transactions_archive`
+--
+
+LOCK TABLES `transactions_archive` WRITE;
+/*!40000 ALTER TABLE `transactions_archive` DISABLE KEYS */;
+/*!40000 ALTER TABLE `transactions_archive` ENABLE KEYS */;
+UNLOCK TABLES;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
@@ -0,0 +1,163 @@
+"""Schema migrations and query plan checks.
+
+    python migrations.py status
+    python migrations.py migrate
+    python migrations.py verify --verbose
+
+Migrations live in storage.MIGRATIONS and are recorded in the
+schema_version table. Repositories apply them when they are created
+unless LIBMGMT_AUTO_MIGRATE=0; `migrate` applies them by hand.
+
+`verify` runs every query the screens and the service issue against the
+database, with each statement explained the way the slow-query log does
+it, and fails if any of them reads a whole table. Write paths are run
+with ids that match nothing, so verifying changes no data.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from instrumentation import INSTRUMENTS, running
+from storage import MIGRATIONS, StorageError, create_repository
+
+NO_ID = 0  # no row has id 0
+NO_TITLE = "\x00no such title"
+
+
+def _first(rows):
+    rows = iter(rows)
+    try:
+        return next(rows, None)
+    finally:
+        if hasattr(rows, 'close'):
+            rows.close()  # give the streaming connection back
+
+
+def _calls(repo):
+    """(operation, fn, args, full_scan_expected) for every query the app issues."""
+    student = _first(repo.stream_table('students'))
+    book = _first(repo.stream_table('books')) or {'title': NO_TITLE, 'category': ""}
+    student_id = student['student_id'] if student else NO_ID
+    title = book['title']
+    history = repo.history_page(student_id)
+    reviews = repo.review_page(title)
+    version = repo.catalog_version()
+    calls = [
+        ("available.fetch", repo.available_books, (), False),
+        ("titles.fetch", repo.all_titles, (), False),
+        ("search.fetch", repo.search, (title.split()[0] if title.split() else "a",), False),
+        ("categories.fetch", repo.categories, (), False),
+        ("categories.books", repo.books_in_category, (book['category'],), False),
+        ("my_books.fetch", repo.open_loans, (student_id,), False),
+        ("history.fetch", repo.transaction_history, (student_id,), False),
+        ("history.page", repo.history_page, (student_id,), False),
+        ("history.next_page", repo.history_page, (student_id,) + (
+            ((history[-1]['issued_date'], history[-1]['transaction_id']),) if history else ()),
+         False),
+        ("reviews.fetch", repo.reviews_for, (title,), False),
+        ("reviews.summary", repo.review_summary, (title,), False),
+        ("reviews.page", repo.review_page, (title,), False),
+        ("reviews.next_page", repo.review_page, (title,) + (
+            ((reviews[-1]['created_at'], reviews[-1]['review_id']),) if reviews else ()),
+         False),
+        ("reviews.submit", repo.add_review, (student_id, NO_TITLE, "", 5), False),
+        ("borrow.submit", repo.borrow, (student_id, NO_TITLE), False),
+        ("borrow.checkout", repo.checkout, (student_id, NO_ID), False),
+        ("return.submit", repo.return_book, (student_id, NO_TITLE), False),
+        ("return.checkin", repo.checkin, (student_id, NO_ID), False),
+        ("holds.place", repo.place_hold, (student_id, NO_TITLE), False),
+        ("holds.cancel", repo.cancel_hold, (student_id, NO_ID), False),
+        ("holds.list", repo.holds, (student_id,), False),
+        ("cart.checkout", repo.checkout_many, (student_id, [NO_ID]), False),
+        ("cart.return", repo.checkin_many, ([NO_ID], student_id), False),
+        ("catalog.version", repo.catalog_version, (), False),
+        ("catalog.changes", repo.catalog_changes, (version,), False),
+        ("events.version", repo.events_version, (), False),
+        ("events.poll", repo.catalog_events, (repo.events_version(),), False),
+        ("fines.state", repo.fines_state, (), False),
+        ("fines.version", repo.loan_version, (), False),
+        ("fines.changed", lambda: list(repo.fine_candidates(version, datetime.now())), (), False),
+        ("fines.report", repo.overdue_loans, (), False),
+        # Nothing was returned before the epoch, so this archives nothing
+        ("archive.batch", repo.archive_loans, (datetime(1970, 1, 1),), False),
+        # Whole-table reads by design
+        ("catalog.load", repo.catalog_books, (), True),
+        ("fines.full", lambda: list(repo.fine_candidates()), (), True),
+    ]
+    if student:
+        # An existing student's login only reads
+        calls.insert(0, ("login", repo.login, (student['name'], student['email']), False))
+    return calls
+
+
+def verify(repo, log=print, verbose=False):
+    """Explain every app query. Returns the number of unexpected full scans."""
+    failures = 0
+    for name, fn, args, scan_expected in _calls(repo):
+        with INSTRUMENTS.capture() as entries, running(name):
+            fn(*args)
+        for entry in entries:
+            plan = entry['plan']
+            if plan is None:
+                if verbose:
+                    log(f"skip  {name}: {entry['statement']} (not explained)")
+                continue
+            if isinstance(plan, str):
+                scans, status = [plan], "FAIL"
+            else:
+                scans = repo.full_scans(plan)
+                status = "scan" if scans and scan_expected else "FAIL" if scans else "ok"
+            failures += status == "FAIL"
+            if status != "ok" or verbose:
+                detail = f" full scan of {', '.join(scans)}" if scans else ""
+                log(f"{status:<5} {name}: {entry['statement']}{detail}")
+                if status == "FAIL" or verbose:
+                    log(f"        {entry['sql']}")
+                    for row in plan if isinstance(plan, list) else ():
+                        log(f"        | {' | '.join(str(value) for value in row)}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Schema migrations and query plan checks")
+    parser.add_argument('action', choices=('status', 'migrate', 'verify'))
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--verbose', '-v', action='store_true', help="show every plan")
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {'migrate': False}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            if args.action == 'status':
+                current = repo.schema_version()
+                for version, description, _ in MIGRATIONS:
+                    state = "applied" if version <= current else "pending"
+                    print(f"{version:>4}  {state:<8} {description}")
+            elif args.action == 'migrate':
+                applied = repo.migrate(log=print)
+                print(f"schema at version {repo.schema_version()}"
+                      f" ({len(applied)} migrations applied)")
+            else:
+                if repo.schema_version() < MIGRATIONS[-1][0]:
+                    print("Warning: migrations are pending; run `migrations.py migrate`",
+                          file=sys.stderr)
+                failures = verify(repo, verbose=args.verbose)
+                print(f"{failures} queries fall back to a full table scan")
+                if failures:
+                    return 1
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""A Treeview that loads its rows page by page as the user scrolls.
+
+Rows are fetched with keyset pagination: each request continues after
+(or before) the key of the last (or first) row on screen, so every page
+costs one index range scan however deep the user has scrolled. Only
+`max_pages` pages are kept in the widget; pages scrolled far out of view
+are dropped and fetched again if the user scrolls back, so memory stays
+flat however many rows match.
+"""
+import tkinter as tk
+from collections import deque
+from tkinter import ttk
+
+PAGE_SIZE = 100
+MAX_PAGES = 3
+EDGE = 0.15  # fraction of the scroll range that triggers a load
+
+
+class _Page:
+    __slots__ = ('first', 'last', 'items')
+
+    def __init__(self, first, last, items):
+        self.first = first
+        self.last = last
+        self.items = items
+
+
+class PagedGrid(tk.Frame):
+    """Scrollable, lazily loaded Treeview.
+
+    `fetch(after=None, before=None, limit=...)` returns rows in display
+    order; `key_of(row)` gives the keyset key of a row and `format_row`
+    the tuple of column values. `run(fn, on_done, on_error)` runs `fn`
+    off the Tk thread and calls `on_done(result)` or `on_error(error)`
+    back on it, returning a handle whose `cancelled` is set if the call
+    is dropped.
+    """
+
+    def __init__(self, parent, columns, fetch, key_of, format_row, run,
+                 page_size=PAGE_SIZE, max_pages=MAX_PAGES, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.fetch = fetch
+        self.key_of = key_of
+        self.format_row = format_row
+        self.run = run
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+        self.tree = ttk.Treeview(self, columns=[c for c, _ in columns], show="headings")
+        for column, heading in columns:
+            self.tree.heading(column, text=heading)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill=tk.BOTH, expand=True)
+
+        self._pages = deque()
+        self._generation = 0
+        self._loading = False
+        self._request = None
+        self._at_end = False
+        self._dropped_above = 0  # pages dropped from the top
+        self.reload()
+
+    def reload(self):
+        """Forget every row and fetch the first page again."""
+        self.tree.delete(*self.tree.get_children())
+        self._pages.clear()
+        self._generation += 1
+        self._loading = False
+        self._request = None
+        self._at_end = False
+        self._dropped_above = 0
+        self._load(after=None)
+
+    def _busy(self):
+        # A cancelled load never calls back, so it must not block the next one
+        return self._loading and not getattr(self._request, 'cancelled', False)
+
+    def _load(self, after=None, before=None):
+        if self._busy():
+            return
+        self._loading = True
+        generation = self._generation
+
+        def done(rows):
+            if generation != self._generation:
+                return  # reloaded while this page was in flight
+            self._loading = False
+            if self.winfo_exists():
+                self._add_page(rows, at_top=before is not None)
+
+        def failed(error):
+            # Scrolling to the edge again retries the page
+            if generation == self._generation:
+                self._loading = False
+
+        self._request = self.run(
+            lambda: self.fetch(after=after, before=before, limit=self.page_size), done, failed)
+
+    def _add_page(self, rows, at_top):
+        if not at_top and len(rows) < self.page_size:
+            self._at_end = True
+        if at_top and len(rows) < self.page_size:
+            # Rows above were deleted and this page reaches the top
+            self._dropped_above = 1 if rows else 0
+        if not rows:
+            return
+        if at_top:
+            items = [self.tree.insert("", i, values=self.format_row(row))
+                     for i, row in enumerate(rows)]
+            self._pages.appendleft(_Page(self.key_of(rows[0]), self.key_of(rows[-1]), items))
+            self._dropped_above -= 1
+            # Keep the rows the user was looking at in place
+            self.tree.yview_scroll(len(items), "units")
+            if len(self._pages) > self.max_pages:
+                dropped = self._pages.pop()
+                self.tree.delete(*dropped.items)
+                self._at_end = False
+        else:
+            items = [self.tree.insert("", tk.END, values=self.format_row(row)) for row in rows]
+            self._pages.append(_Page(self.key_of(rows[0]), self.key_of(rows[-1]), items))
+            if len(self._pages) > self.max_pages:
+                dropped = self._pages.popleft()
+                self.tree.delete(*dropped.items)
+                self._dropped_above += 1
+                self.tree.yview_scroll(-len(dropped.items), "units")
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._busy() or not self._pages:
+            return
+        if float(last) >= 1 - EDGE and not self._at_end:
+            self._load(after=self._pages[-1].last)
+        elif float(first) <= EDGE and self._dropped_above > 0:
+            self._load(before=self._pages[0].first)
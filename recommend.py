@@ -0,0 +1,356 @@
+""""Readers who borrowed this also borrowed" recommendations.
+
+    python recommend.py update
+    python recommend.py update --rebuild --top-k 30
+    python recommend.py show 42
+
+`update` reads the transactions added since the last run and folds
+them into a sparse book-by-book co-borrowing matrix: the count for a
+pair of books is the number of students who borrowed both. The matrix
+and each student's borrowed books are kept as CSR arrays (indptr,
+indices, counts), and only the rows new loans touched get their top-K
+neighbours recomputed. Run it from cron after the fines engine.
+
+The top-K table is one .npy file of (book_id, count) pairs indexed by
+book_id, which Recommender memory-maps, so a lookup is a row read and
+the screens never query transactions. Each update writes a new
+version directory and then swaps state.json, so a reader never sees a
+half-written table.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+from bulk_io import batches
+from storage import STREAM_CHUNK, StorageError, create_repository
+
+RECOMMEND_DIR = os.environ.get("LIBMGMT_RECOMMEND_DIR", "recommendations")
+TOP_K = 20
+MERGE_PAIRS = 5_000_000  # folded pairs held before the matrix grows past them
+RELOAD_INTERVAL = 30.0  # seconds between checks for a newer table
+STATE_FILE = "state.json"
+TOP_DTYPE = [('book_id', '<i4'), ('count', '<i4')]
+
+np = None
+
+
+def _import_numpy():
+    # Loaded on first use: numpy takes longer to import than the GUI
+    # takes to start
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+class CSR:
+    """Sparse rows: the columns of row r are indices[indptr[r]:indptr[r + 1]]."""
+
+    def __init__(self, indptr, indices, counts):
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                   np.zeros(0, dtype=np.int32))
+
+    @property
+    def rows(self):
+        return len(self.indptr) - 1
+
+    def row(self, r):
+        if r >= self.rows:
+            return self.indices[:0], self.counts[:0]
+        start, end = self.indptr[r], self.indptr[r + 1]
+        return self.indices[start:end], self.counts[start:end]
+
+    def add(self, rows, cols, size, width):
+        """A CSR with `size` rows and one added at each (rows[i], cols[i])."""
+        old_rows = np.repeat(np.arange(self.rows, dtype=np.int64), np.diff(self.indptr))
+        keys = np.concatenate([old_rows * width + self.indices,
+                               np.asarray(rows, dtype=np.int64) * width + cols])
+        weights = np.concatenate([self.counts, np.ones(len(rows), dtype=np.int32)])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights).astype(np.int32)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // width, minlength=size), out=indptr[1:])
+        return CSR(indptr, (keys % width).astype(np.int32), counts)
+
+
+def top_neighbours(pairs, rows, k):
+    """(len(rows), k) TOP_DTYPE array of each row's best co-borrowed books."""
+    top = np.zeros((len(rows), k), dtype=TOP_DTYPE)
+    for i, r in enumerate(rows):
+        books, counts = pairs.row(r)
+        # Most borrowers first, then lowest book_id
+        best = np.lexsort((books, -counts))[:k]
+        top['book_id'][i, :len(best)] = books[best]
+        top['count'][i, :len(best)] = counts[best]
+    return top
+
+
+class Model:
+    """Co-borrowing counts, borrowed books per student and the top-K table."""
+
+    FILES = ('pairs_indptr', 'pairs_indices', 'pairs_counts',
+             'borrowed_indptr', 'borrowed_indices', 'top')
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.watermark = 0  # last transaction_id folded in
+        self.loans = 0
+        self.pairs = CSR.empty()
+        self.borrowed = CSR.empty()
+        self.top = np.zeros((0, k), dtype=TOP_DTYPE)
+        # Folded but not yet merged into the matrices
+        self._held = {}  # student_id -> books
+        self._rows, self._cols = [], []
+        self._pending = 0
+
+    @classmethod
+    def load(cls, path):
+        """The model under `path`, or None if there is none yet."""
+        try:
+            with open(os.path.join(path, STATE_FILE), encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        directory = os.path.join(path, state['directory'])
+        arrays = {name: np.load(os.path.join(directory, name + ".npy")) for name in cls.FILES}
+        model = cls(state['k'])
+        model.watermark = state['watermark']
+        model.loans = state['loans']
+        model.pairs = CSR(arrays['pairs_indptr'], arrays['pairs_indices'], arrays['pairs_counts'])
+        model.borrowed = CSR(arrays['borrowed_indptr'], arrays['borrowed_indices'],
+                             np.ones(len(arrays['borrowed_indices']), dtype=np.int32))
+        model.top = arrays['top']
+        return model
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        directory = f"v{time.time_ns()}"
+        target = os.path.join(path, directory)
+        os.mkdir(target)
+        arrays = {
+            'pairs_indptr': self.pairs.indptr, 'pairs_indices': self.pairs.indices,
+            'pairs_counts': self.pairs.counts, 'borrowed_indptr': self.borrowed.indptr,
+            'borrowed_indices': self.borrowed.indices, 'top': self.top,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(target, name + ".npy"), array)
+        state = {'directory': directory, 'k': self.k, 'watermark': self.watermark,
+                 'loans': self.loans, 'books': len(self.top)}
+        temp = os.path.join(path, STATE_FILE + ".tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp, os.path.join(path, STATE_FILE))
+        # Readers may still have the previous version mapped
+        versions = sorted(name for name in os.listdir(path)
+                          if name.startswith("v") and name != directory)
+        for name in versions[:-1]:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    def fold(self, loans):
+        """Add (student_id, book_id) loans. Returns the loans that were new pairs.
+
+        The pairs are only collected here; `merge` adds them to the
+        matrices, once they outgrow the matrix or when the update ends,
+        so folding a long history chunk by chunk does not rebuild the
+        whole matrix for every chunk.
+        """
+        new = {}  # student_id -> books first borrowed in this batch
+        for student_id, book_id in loans:
+            books = new.setdefault(student_id, [])
+            if book_id not in books:
+                books.append(book_id)
+        folded = 0
+        for student_id, books in new.items():
+            old, _ = self.borrowed.row(student_id)
+            pending = self._held.get(student_id)
+            if pending is not None:
+                old = np.concatenate([old, pending])
+            books = np.setdiff1d(np.array(books, dtype=np.int32), old)
+            if not len(books):
+                continue
+            held = np.concatenate([old, books])
+            for book_id in books:
+                # The new book pairs with everything else the student
+                # has borrowed, and the old books pair with it
+                partners = held[held != book_id]
+                self._rows.append(np.full(len(partners), book_id, dtype=np.int64))
+                self._cols.append(partners)
+                self._rows.append(old.astype(np.int64))
+                self._cols.append(np.full(len(old), book_id, dtype=np.int32))
+                self._pending += len(partners) + len(old)
+            self._held[student_id] = books if pending is None else np.concatenate([pending, books])
+            folded += len(books)
+        self.loans += folded
+        if self._pending > max(MERGE_PAIRS, len(self.pairs.indices)):
+            self.merge()
+        return folded
+
+    def merge(self):
+        """Add the folded pairs to the matrices and recompute the rows they touched."""
+        if not self._held:
+            return
+        borrowers = np.concatenate([np.full(len(books), student_id, dtype=np.int64)
+                                    for student_id, books in self._held.items()])
+        borrowed = np.concatenate(list(self._held.values()))
+        rows = np.concatenate(self._rows)
+        cols = np.concatenate(self._cols)
+        self._held, self._rows, self._cols, self._pending = {}, [], [], 0
+        books = max(len(self.top), self.pairs.rows, int(borrowed.max()) + 1)
+        self.borrowed = self.borrowed.add(borrowers, borrowed,
+                                          max(self.borrowed.rows, int(borrowers.max()) + 1),
+                                          np.iinfo(np.int32).max)
+        if len(rows):
+            self.pairs = self.pairs.add(rows, cols, books, books)
+        if len(self.top) < books:
+            top = np.zeros((books, self.k), dtype=TOP_DTYPE)
+            top[:len(self.top)] = self.top
+            self.top = top
+        touched = np.unique(rows)
+        self.top[touched] = top_neighbours(self.pairs, touched, self.k)
+
+
+def update(repo, path=RECOMMEND_DIR, k=TOP_K, rebuild=False, chunk_size=STREAM_CHUNK, log=None):
+    """Fold new transactions into the model under `path`. Returns the loans read."""
+    if not _import_numpy():
+        raise StorageError("Recommendations need numpy")
+    model = None if rebuild else Model.load(path)
+    if model is None or model.k != k:
+        model = Model(k)
+        if not rebuild and log:
+            log("recommendations: building from scratch")
+    read = 0
+    tables = [('transactions', model.watermark or None)]
+    if not model.watermark:
+        # Loans archived later were folded in while still in transactions
+        tables.insert(0, ('transactions_archive', None))
+    for table, after in tables:
+        for chunk in batches(repo.stream_table(table, chunk_size, after=after), chunk_size):
+            model.fold((row['student_id'], row['book_id']) for row in chunk
+                       if row['student_id'] is not None and row['book_id'] is not None)
+            model.watermark = max(model.watermark or 0, chunk[-1]['transaction_id'])
+            read += len(chunk)
+            if log:
+                log(f"recommendations: {read} transactions read")
+    model.merge()
+    if read or rebuild:
+        model.save(path)
+    return read
+
+
+class Recommender:
+    """Memory-mapped top-K lookups, picking up new tables as they appear.
+
+    Without numpy or a table on disk, every lookup comes back empty.
+    """
+
+    def __init__(self, path=RECOMMEND_DIR, check_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._top = None
+        self._stamp = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _table(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._top
+            self._checked_at = now
+            state_file = os.path.join(self.path, STATE_FILE)
+            try:
+                stamp = os.stat(state_file).st_mtime_ns
+            except OSError:
+                stamp = None
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._top = None
+                if stamp is not None and _import_numpy():
+                    try:
+                        with open(state_file, encoding='utf-8') as f:
+                            directory = json.load(f)['directory']
+                        self._top = np.load(os.path.join(self.path, directory, "top.npy"),
+                                            mmap_mode='r')
+                    except (OSError, ValueError, KeyError):
+                        pass  # caught mid-swap: tried again next check
+            return self._top
+
+    def similar(self, book_ids, limit=10):
+        """(book_id, count) of the books most often borrowed with `book_ids`."""
+        top = self._table()
+        if top is None:
+            return []
+        book_ids = set(book_ids)
+        scores = {}
+        for book_id in book_ids:
+            if 0 < book_id < len(top):
+                for other, count in top[book_id].tolist():
+                    if other and other not in book_ids:
+                        scores[other] = scores.get(other, 0) + count
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def similar_titles(self, catalog, title, limit=5):
+        """Titles borrowed by readers of `title`, resolved through a CatalogCache."""
+        titles = []
+        # Copies of one title share readers, so their rows are merged
+        for book_id, _ in self.similar(catalog.ids_for_title(title), limit * 3):
+            book = catalog.get(book_id)
+            if book is not None and book.title != title and book.title not in titles:
+                titles.append(book.title)
+                if len(titles) == limit:
+                    break
+        return titles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Co-borrowing recommendations")
+    parser.add_argument('action', choices=('update', 'show'))
+    parser.add_argument('book_id', nargs='?', type=int, help="book to show neighbours of")
+    parser.add_argument('--path', default=RECOMMEND_DIR, help="recommendations directory")
+    parser.add_argument('--top-k', type=int, default=TOP_K, help="neighbours kept per book")
+    parser.add_argument('--rebuild', action='store_true', help="start over from every transaction")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    args = parser.parse_args(argv)
+
+    if args.action == 'show':
+        if args.book_id is None:
+            parser.error("show needs a book_id")
+        for book_id, count in Recommender(args.path).similar([args.book_id], args.top_k):
+            print(f"{book_id:>8}  {count} readers")
+        return 0
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            start = time.perf_counter()
+            read = update(repo, args.path, args.top_k, args.rebuild, log=print)
+            print(f"recommendations: {read} new transactions in {time.perf_counter() - start:.1f}s")
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,476 @@
+"""Local SQLite read replica for kiosks and desks on a slow or flaky link.
+
+    LIBMGMT_BACKEND=replica python libmgmt.py
+    python replica.py sync
+    python replica.py status
+
+ReplicaRepository keeps a SQLite copy of books, students, transactions
+and reviews and serves every read from it. Archived loans are copied
+once, on the first pull; the replica does not archive its own. New
+rows are pulled by primary key watermark. The tables carry no
+modification timestamps, so books and loans that changed are pulled
+from the source's catalog_changes and loan_changes logs, by change id
+watermark. Pulls run on a background thread every
+LIBMGMT_REPLICA_INTERVAL seconds.
+
+Checkouts, returns and reviews go into the outbound table in the same
+local transaction that applies them to the replica, so a queued write
+survives a crash or a restart. The sync thread replays the queue in
+order once the source is reachable. A replay the source refuses (a book
+issued at another desk meanwhile, a loan already closed) is marked as a
+conflict, and the pull that follows brings the replica back in line.
+Reviews show up once replayed, as the rating aggregates come from the
+source. The fines ledger is not mirrored, and holds are placed with the
+source directly: a title's queue is shared by every desk.
+
+The source is a database backend (LIBMGMT_REPLICA_SOURCE, default
+mysql): the HTTP service does not stream tables.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from bulk_io import batches
+from instrumentation import INSTRUMENTS, running
+from storage import (POOL_SIZE, STREAM_CHUNK, TABLE_COLUMNS, SQLiteRepository, StorageError,
+                     create_repository)
+
+REPLICA_PATH = os.environ.get("LIBMGMT_REPLICA_PATH", "library_replica.db")
+REPLICA_SOURCE = os.environ.get("LIBMGMT_REPLICA_SOURCE", "mysql")
+SYNC_INTERVAL = float(os.environ.get("LIBMGMT_REPLICA_INTERVAL", "30"))  # seconds
+MAX_ATTEMPTS = 5  # replays the source rejects with an error before giving up
+REPLAY_BATCH = 100
+MIRRORED = ('books', 'students', 'transactions', 'reviews')  # parents first
+
+REPLICA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replica_state (
+    name VARCHAR(50) PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outbound (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    op VARCHAR(20) NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'done', 'conflict', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    detail TEXT,
+    created_at TIMESTAMP NOT NULL,
+    replayed_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_status ON outbound (status, entry_id);
+"""
+
+# mysql.connector returns DECIMAL columns as Decimal
+sqlite3.register_adapter(Decimal, float)
+
+
+class ReplicaRepository(SQLiteRepository):
+    """SQLiteRepository that mirrors a source repository and queues writes.
+
+    `source` is a LibraryRepository, or None to create one from
+    LIBMGMT_REPLICA_SOURCE on first sync. With `interval` 0 no sync
+    thread is started; call `sync()` directly.
+    """
+
+    def __init__(self, path=REPLICA_PATH, source=None, interval=SYNC_INTERVAL,
+                 pool_size=POOL_SIZE):
+        super().__init__(path, pool_size)
+        with self._session() as session:
+            session.conn.executescript(REPLICA_SCHEMA)
+        self._source = source
+        self._source_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.online = None  # unknown until the first sync
+        self.last_sync = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._sync_loop, args=(interval,),
+                                            name="libmgmt-replica", daemon=True)
+            self._thread.start()
+
+    def _source_repo(self):
+        with self._source_lock:
+            if self._source is None:
+                self._source = create_repository(REPLICA_SOURCE)
+            return self._source
+
+    # -- writes: applied locally and queued -----------------------------
+
+    @staticmethod
+    def _enqueue(session, op, **args):
+        session.execute(
+            "INSERT INTO outbound (op, args, created_at) VALUES (%s, %s, %s)",
+            (op, json.dumps(args), datetime.now())
+        )
+        return session.lastrowid
+
+    def login(self, name, email):
+        rows = self._fetchall("SELECT student_id FROM students WHERE email = %s", (email,))
+        if rows:
+            return {'id': rows[0]['student_id'], 'name': name, 'email': email}
+        # New students get their id from the source
+        try:
+            student = self._source_repo().login(name, email)
+        except StorageError as e:
+            raise StorageError(f"New students can only register while online: {e}") from e
+        with self._transaction() as session:
+            session.execute(
+                "INSERT INTO students (student_id, name, email) VALUES (%s, %s, %s)"
+                " ON CONFLICT DO NOTHING", (student['id'], name, email)
+            )
+        return student
+
+    def _issue(self, session, student_id, book_id, due_date):
+        session.execute(
+            "UPDATE books SET status = 'issued' WHERE book_id = %s AND status = 'available'",
+            (book_id,)
+        )
+        if session.rowcount != 1:
+            return False
+        entry = self._enqueue(session, 'checkout', student_id=student_id, book_id=book_id)
+        # A provisional loan under a negative id, dropped once the
+        # source's own row has been pulled
+        session.execute(
+            "INSERT INTO transactions (transaction_id, book_id, student_id, due_date)"
+            " VALUES (%s, %s, %s, %s)", (-entry, book_id, student_id, due_date)
+        )
+        return True
+
+    def _close_loan(self, session, book_id, student_id, return_date):
+        sql = """SELECT transaction_id, student_id, due_date FROM transactions
+                 WHERE book_id = %s AND return_date IS NULL"""
+        params = [book_id]
+        if student_id is not None:
+            sql += " AND student_id = %s"
+            params.append(student_id)
+        loan = session.execute(sql, params).fetchone()
+        if not loan:
+            return None
+        days_late = max(0, (return_date - loan['due_date']).days)
+        penalty = self.fine_policy.fine(days_late)
+        session.execute(
+            "UPDATE transactions SET return_date = %s, penalty_amount = %s"
+            " WHERE transaction_id = %s", (return_date, penalty, loan['transaction_id'])
+        )
+        session.execute("UPDATE books SET status = 'available' WHERE book_id = %s", (book_id,))
+        self._enqueue(session, 'checkin', student_id=loan['student_id'], book_id=book_id)
+        return penalty
+
+    def _checkout(self, student_id, book_id, due_date):
+        with self._transaction() as session:
+            issued = self._issue(session, student_id, book_id, due_date)
+        self._wake.set()
+        return issued
+
+    def _checkout_many(self, student_id, book_ids, due_date):
+        with self._transaction() as session:
+            issued = {book_id for book_id in book_ids
+                      if self._issue(session, student_id, book_id, due_date)}
+        self._wake.set()
+        return issued
+
+    def _checkin(self, student_id, book_id, return_date):
+        with self._transaction() as session:
+            penalty = self._close_loan(session, book_id, student_id, return_date)
+        self._wake.set()
+        return penalty
+
+    def _checkin_many(self, book_ids, student_id, return_date):
+        with self._transaction() as session:
+            penalties = {book_id: self._close_loan(session, book_id, student_id, return_date)
+                         for book_id in book_ids}
+        self._wake.set()
+        return {book_id: penalty for book_id, penalty in penalties.items() if penalty is not None}
+
+    def add_review(self, student_id, title, text, rating, book_id=None):
+        with self._transaction() as session:
+            if book_id is not None:
+                book = session.execute(
+                    "SELECT book_id FROM books WHERE book_id = %s", (book_id,)
+                ).fetchone()
+            else:
+                book = session.execute(
+                    "SELECT book_id FROM books WHERE title = %s", (title,)
+                ).fetchone()
+            if not book:
+                return False
+            self._enqueue(session, 'review', student_id=student_id, title=title,
+                          text=text, rating=int(rating), book_id=book_id)
+        self._wake.set()
+        return True
+
+    # -- holds: one queue per title, kept by the source ------------------
+
+    def place_hold(self, student_id, title):
+        return self._source_repo().place_hold(student_id, title)
+
+    def cancel_hold(self, student_id, hold_id):
+        return self._source_repo().cancel_hold(student_id, hold_id)
+
+    def holds(self, student_id):
+        return self._source_repo().holds(student_id)
+
+    # -- sync -----------------------------------------------------------
+
+    def _sync_loop(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except StorageError:
+                pass  # offline: kept in last_error and tried again
+            # Queued writes wake the loop early
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def sync(self):
+        """Replay queued writes, then pull changes. Returns (replayed, pulled)."""
+        with self._sync_lock, running("replica.sync"):
+            start = time.perf_counter()
+            try:
+                source = self._source_repo()
+                source.catalog_version()  # reachable?
+                replayed = self._push(source)
+                pulled = self._pull(source)
+            except StorageError as e:
+                self.online = False
+                self.last_error = str(e)
+                INSTRUMENTS.action("replica.sync", time.perf_counter() - start, failed=True)
+                raise
+            self.online = True
+            self.last_sync = datetime.now()
+            self.last_error = None
+            INSTRUMENTS.action("replica.sync", time.perf_counter() - start)
+            return replayed, pulled
+
+    def _push(self, source):
+        replayed = 0
+        while True:
+            entries = self._fetchall("""
+                SELECT entry_id, op, args, attempts FROM outbound
+                WHERE status = 'pending' ORDER BY entry_id LIMIT %s
+                """, (REPLAY_BATCH,))
+            if not entries:
+                return replayed
+            for entry in entries:
+                args = json.loads(entry['args'])
+                try:
+                    status, detail = self._replay(source, entry['op'], args)
+                except StorageError as e:
+                    try:
+                        source.catalog_version()
+                    except StorageError:
+                        raise e  # the link went down: try again next round
+                    # The source is up but failed this entry; later
+                    # entries wait so the queue stays in order
+                    attempts = entry['attempts'] + 1
+                    status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+                    self._settle(entry['entry_id'], status, str(e))
+                    if status == 'pending':
+                        raise
+                    continue
+                self._settle(entry['entry_id'], status, detail)
+                if status == 'conflict' and 'book_id' in args:
+                    self._refresh_book(source, args['book_id'])
+                replayed += 1
+
+    @staticmethod
+    def _replay(source, op, args):
+        """Apply one queued write to the source. Returns (status, detail)."""
+        if op == 'checkout':
+            if source.checkout(args['student_id'], args['book_id']):
+                return 'done', None
+            # An earlier attempt may have gone through before the link dropped
+            if any(loan['book_id'] == args['book_id']
+                   for loan in source.open_loans(args['student_id'])):
+                return 'done', None
+            return 'conflict', "book was issued at another desk"
+        if op == 'checkin':
+            penalty = source.checkin(args['student_id'], args['book_id'])
+            if penalty is None:
+                return 'conflict', "loan was already closed"
+            return 'done', f"penalty Rs. {penalty}"
+        if op == 'review':
+            if source.add_review(args['student_id'], args['title'], args['text'], args['rating'],
+                                 args.get('book_id')):
+                return 'done', None
+            return 'conflict', "book not found"
+        raise StorageError(f"Unknown queued operation: {op}")
+
+    def _refresh_book(self, source, book_id):
+        # The source refused a queued write, so the local status is wrong
+        rows = source.stream_table('books', chunk_size=1, after=book_id - 1)
+        try:
+            book = next(rows, None)
+        finally:
+            rows.close()
+        if book is None or book['book_id'] != book_id:
+            return
+        with self._transaction() as session:
+            self._upsert(session, 'books', TABLE_COLUMNS['books'], [book])
+
+    def _settle(self, entry_id, status, detail):
+        with self._transaction() as session:
+            session.execute("""
+                UPDATE outbound
+                SET status = %s, detail = %s, attempts = attempts + 1, replayed_at = %s
+                WHERE entry_id = %s
+                """, (status, detail, datetime.now(), entry_id))
+
+    def _state(self, session):
+        rows = session.execute("SELECT name, value FROM replica_state").fetchall()
+        return {row['name']: row['value'] for row in rows}
+
+    @staticmethod
+    def _save_state(session, **values):
+        session.executemany(
+            "INSERT INTO replica_state (name, value) VALUES (%s, %s)"
+            " ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+            list(values.items())
+        )
+
+    @staticmethod
+    def _upsert(session, table, columns, rows):
+        session.executemany("""
+            INSERT INTO {table} ({columns}) VALUES ({marks})
+            ON CONFLICT ({key}) DO UPDATE SET {updates}""".format(
+                table=table, columns=", ".join(columns), marks=", ".join(["%s"] * len(columns)),
+                key=columns[0],
+                updates=", ".join(f"{c} = excluded.{c}" for c in columns[1:])),
+            [tuple(row[c] for c in columns) for row in rows])
+
+    def _pull(self, source):
+        with self._session() as session:
+            state = self._state(session)
+        first = 'catalog' not in state
+        # Versions are read before the rows: changes that race with the
+        # pull are fetched again next time
+        catalog_version = source.catalog_version()
+        loan_version = source.loan_version()
+
+        pulled = 0
+        for table in MIRRORED:
+            columns = TABLE_COLUMNS[table]
+            rows = source.stream_table(table, after=state.get(table, 0))
+            for chunk in batches(rows, STREAM_CHUNK):
+                with self._transaction() as session:
+                    self._upsert(session, table, columns, chunk)
+                    state[table] = chunk[-1][columns[0]]
+                    self._save_state(session, **{table: state[table]})
+                pulled += len(chunk)
+        if first:
+            # Loans archived at the source later stay in the local transactions
+            columns = TABLE_COLUMNS['transactions_archive']
+            for chunk in batches(source.stream_table('transactions_archive'), STREAM_CHUNK):
+                ids = [row['transaction_id'] for row in chunk]
+                with self._transaction() as session:
+                    self._upsert(session, 'transactions_archive', columns, chunk)
+                    # Moved while this pull was running
+                    session.execute("DELETE FROM transactions WHERE transaction_id IN ({})".format(
+                        ", ".join(["%s"] * len(ids))), ids)
+                pulled += len(chunk)
+            with self._transaction() as session:
+                self._save_state(session, catalog=catalog_version, loans=loan_version)
+            return pulled
+
+        catalog_version, books = source.catalog_changes(state['catalog'])
+        loan_version, loans = source.loan_changes(state['loans'])
+        # Rows past the watermarks are new: the next pull streams them
+        books = {row['book_id']: row for row in books
+                 if row['title'] is not None and row['book_id'] <= state.get('books', 0)}
+        loans = {row['transaction_id']: row for row in loans
+                 if row['book_id'] is not None and row['transaction_id'] <= state.get('transactions', 0)}
+        with self._transaction() as session:
+            # The source's rows for replayed checkouts are in by now
+            session.execute("""
+                DELETE FROM transactions
+                WHERE transaction_id < 0 AND -transaction_id IN (
+                    SELECT entry_id FROM outbound WHERE status <> 'pending')
+                """)
+            if session.execute(
+                    "SELECT 1 FROM outbound WHERE status = 'pending' LIMIT 1").fetchone():
+                # Writes queued during this sync would be overwritten
+                return pulled
+            self._upsert(session, 'books', ('book_id', 'title', 'category', 'status'),
+                         books.values())
+            self._upsert(session, 'transactions', TABLE_COLUMNS['transactions'], loans.values())
+            self._save_state(session, catalog=catalog_version, loans=loan_version)
+        return pulled + len(books) + len(loans)
+
+    def status(self):
+        """Sync state, watermarks and queue counts, for display."""
+        with self._session() as session:
+            watermarks = self._state(session)
+            queue = {row['status']: row['entries'] for row in session.execute(
+                "SELECT status, COUNT(*) AS entries FROM outbound GROUP BY status").fetchall()}
+            problems = session.execute("""
+                SELECT entry_id, op, args, status, detail, created_at FROM outbound
+                WHERE status IN ('conflict', 'failed') ORDER BY entry_id DESC LIMIT 20
+                """).fetchall()
+        return {
+            'online': self.online,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+            'watermarks': watermarks,
+            'queue': queue,
+            'problems': problems,
+        }
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._source_lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+        super().close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local read replica")
+    parser.add_argument('action', choices=('sync', 'status'))
+    parser.add_argument('--path', default=REPLICA_PATH, help="replica SQLite file")
+    parser.add_argument('--source', choices=('mysql', 'sqlite'), default=REPLICA_SOURCE)
+    parser.add_argument('--source-sqlite-path', help="SQLite database to mirror")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.source_sqlite_path and args.source == 'sqlite':
+        options['path'] = args.source_sqlite_path
+    try:
+        source = create_repository(args.source, **options) if args.action == 'sync' else None
+        replica = ReplicaRepository(args.path, source=source, interval=0)
+        try:
+            if args.action == 'sync':
+                replayed, pulled = replica.sync()
+                print(f"replayed {replayed} queued writes, pulled {pulled} rows")
+            status = replica.status()
+            print("watermarks: " + ", ".join(f"{name} {value}"
+                                             for name, value in sorted(status['watermarks'].items())))
+            print("queue: " + (", ".join(f"{count} {name}"
+                                         for name, count in sorted(status['queue'].items())) or "empty"))
+            for entry in status['problems']:
+                print(f"{entry['status']:>8} #{entry['entry_id']} {entry['op']} {entry['args']}:"
+                      f" {entry['detail']}")
+        finally:
+            replica.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Circulation reports over the whole loan history.
+
+    python reports.py --output reports/
+    python reports.py --since 2024-01-01 --until 2025-01-01 --format parquet
+
+Loans (joined with their books) and reviews (joined with students and
+books) are streamed through an unbuffered cursor and summed a chunk at
+a time with NumPy, so memory depends on the number of categories,
+months, titles and reviewers, not on the number of loans. Writes:
+
+    summary               loans, returns, loan length and penalty totals
+    loans_by_month        loans, returns, loan length and penalties per category and month
+    title_utilisation     loans, days on loan and reviews per title
+    top_reviewers         the students who wrote the most reviews
+
+as CSV, or as Parquet with pyarrow installed. --since and --until
+select loans by issue date and reviews by the date they were written.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bulk_io import batches
+from storage import STREAM_CHUNK, StorageError, create_repository
+
+MAX_LOAN_DAYS = 366  # loan lengths above this share the last histogram bin
+TOP_REVIEWERS = 20
+NO_CATEGORY = "(none)"
+FORMATS = ('csv', 'parquet')
+
+
+def group_sums(keys, columns):
+    """Sum each of `columns` over equal `keys`. Returns (unique keys, sums rows)."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = np.stack([np.bincount(inverse, weights=column, minlength=len(unique))
+                     for column in columns], axis=1)
+    return unique, sums
+
+
+class Totals:
+    """Running sums per key, merged from one chunk's group_sums at a time."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = {}
+
+    def add(self, keys, sums):
+        for key, row in zip(keys.tolist(), sums):
+            total = self.rows.get(key)
+            if total is None:
+                self.rows[key] = row.copy()
+            else:
+                total += row
+
+    def get(self, key):
+        row = self.rows.get(key)
+        return dict(zip(self.columns, row if row is not None else np.zeros(len(self.columns))))
+
+
+class Circulation:
+    """Loan and review aggregates, fed chunk by chunk."""
+
+    def __init__(self, as_of):
+        self.as_of = np.datetime64(as_of, 's')
+        self.categories = {}  # category -> code
+        self.by_month = Totals(('loans', 'returned', 'loan_days', 'penalties'))
+        self.by_title = Totals(('loans', 'loan_days'))
+        self.reviews_by_title = Totals(('reviews', 'rating_sum', 'rated'))
+        self.reviewers = Totals(('reviews', 'rating_sum', 'rated'))
+        self.names = {}  # student_id -> name, for reviewers
+        self.copies = {}  # title -> copies
+        self.lengths = np.zeros(MAX_LOAN_DAYS + 1, dtype=np.int64)
+        self.loans = 0
+        self.first_issued = None
+
+    def _category_codes(self, categories):
+        unique, inverse = np.unique(np.array(categories), return_inverse=True)
+        codes = np.array([self.categories.setdefault(c, len(self.categories))
+                          for c in unique.tolist()], dtype=np.int64)
+        return codes[inverse]
+
+    def add_loans(self, rows):
+        rows = [row for row in rows if row['issued_date'] is not None]
+        if not rows:
+            return
+        issued = np.array([row['issued_date'] for row in rows], dtype='datetime64[s]')
+        returned = np.array([row['return_date'] for row in rows], dtype='datetime64[s]')
+        closed = ~np.isnat(returned)
+        # Open loans count up to the report date
+        days = (np.where(closed, returned, self.as_of) - issued) / np.timedelta64(1, 'D')
+        days = np.maximum(days, 0)
+        penalties = np.array([float(row['penalty_amount'] or 0) for row in rows])
+        ones = np.ones(len(rows))
+
+        # Months since 1970 fit in 20 bits, categories in the rest
+        months = issued.astype('datetime64[M]').astype(np.int64)
+        codes = self._category_codes([row['category'] or NO_CATEGORY for row in rows])
+        keys, sums = group_sums((codes << 20) | months,
+                                (ones, closed.astype(float), days, penalties))
+        self.by_month.add(keys, sums)
+
+        titles = np.array([row['title'] or "" for row in rows])
+        keys, sums = group_sums(titles, (ones, days))
+        self.by_title.add(keys, sums)
+
+        self.lengths += np.bincount(np.minimum(days.astype(np.int64), MAX_LOAN_DAYS),
+                                    minlength=MAX_LOAN_DAYS + 1)
+        self.loans += len(rows)
+        first = issued.min()
+        if self.first_issued is None or first < self.first_issued:
+            self.first_issued = first
+
+    def add_books(self, rows):
+        titles = np.array([row['title'] for row in rows])
+        keys, counts = np.unique(titles, return_counts=True)
+        for title, count in zip(keys.tolist(), counts.tolist()):
+            self.copies[title] = self.copies.get(title, 0) + count
+
+    def add_reviews(self, rows):
+        if not rows:
+            return
+        ratings = np.array([row['rating'] or 0 for row in rows], dtype=float)
+        rated = (ratings > 0).astype(float)
+        ones = np.ones(len(rows))
+        titles = np.array([row['title'] or "" for row in rows])
+        keys, sums = group_sums(titles, (ones, ratings, rated))
+        self.reviews_by_title.add(keys, sums)
+        students = np.array([row['student_id'] or 0 for row in rows], dtype=np.int64)
+        keys, sums = group_sums(students, (ones, ratings, rated))
+        self.reviewers.add(keys, sums)
+        for row in rows:
+            if row['student_id'] is not None:
+                self.names.setdefault(row['student_id'], row['name'])
+
+    # -- reports --------------------------------------------------------
+
+    def _percentile(self, pct):
+        total = self.lengths.sum()
+        if not total:
+            return None
+        return int(np.searchsorted(np.cumsum(self.lengths), total * pct / 100))
+
+    def summary(self):
+        months = self.by_month.rows.values()
+        returned = sum(row[1] for row in months)
+        loan_days = sum(row[2] for row in months)
+        return ["loans", "returned", "open", "average_loan_days", "median_loan_days",
+                "p90_loan_days", "penalties", "reviews"], [[
+            self.loans, int(returned), self.loans - int(returned),
+            round(loan_days / self.loans, 2) if self.loans else None,
+            self._percentile(50), self._percentile(90),
+            round(sum(row[3] for row in months), 2),
+            int(sum(row[0] for row in self.reviewers.rows.values())),
+        ]]
+
+    def loans_by_month(self):
+        names = {code: category for category, code in self.categories.items()}
+        rows = []
+        for key in sorted(self.by_month.rows, key=lambda k: (names[k >> 20], k & 0xFFFFF)):
+            loans, returned, loan_days, penalties = self.by_month.rows[key]
+            month = np.datetime64(key & 0xFFFFF, 'M')
+            rows.append([names[key >> 20], str(month), int(loans), int(returned),
+                         round(loan_days / loans, 2), round(penalties, 2)])
+        return ["category", "month", "loans", "returned", "average_loan_days", "penalties"], rows
+
+    def title_utilisation(self, since=None, until=None):
+        # Share of the period each title's copies spent on loan
+        start = np.datetime64(since, 's') if since else self.first_issued
+        end = np.datetime64(until, 's') if until else self.as_of
+        period = max((end - start) / np.timedelta64(1, 'D'), 1) if start is not None else None
+        rows = []
+        for title in sorted(set(self.copies) | set(self.by_title.rows)):
+            loans = self.by_title.get(title)
+            reviews = self.reviews_by_title.get(title)
+            copies = self.copies.get(title, 0)
+            utilisation = (round(loans['loan_days'] / (copies * period), 4)
+                           if copies and period else None)
+            rows.append([title, copies, int(loans['loans']), round(loans['loan_days'], 1),
+                         utilisation, int(reviews['reviews']),
+                         round(reviews['rating_sum'] / reviews['rated'], 2)
+                         if reviews['rated'] else None])
+        return ["title", "copies", "loans", "loan_days", "utilisation", "reviews",
+                "average_rating"], rows
+
+    def top_reviewers(self, limit=TOP_REVIEWERS):
+        ranked = sorted(((key, row) for key, row in self.reviewers.rows.items() if key),
+                        key=lambda item: (-item[1][0], item[0]))[:limit]
+        return ["student_id", "name", "reviews", "average_rating"], [
+            [student_id, self.names.get(student_id), int(row[0]),
+             round(row[1] / row[2], 2) if row[2] else None]
+            for student_id, row in ranked]
+
+
+def write_report(path, columns, rows, fmt='csv'):
+    if fmt == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise StorageError("Parquet output needs pyarrow") from None
+        table = pyarrow.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+        pyarrow.parquet.write_table(table, path)
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def run(repo, output, fmt='csv', since=None, until=None, chunk_size=STREAM_CHUNK,
+        top=TOP_REVIEWERS, log=None):
+    """Stream the history and write every report. Returns the files written."""
+    if np is None:
+        raise StorageError("Reports need numpy")
+    if fmt not in FORMATS:
+        raise StorageError(f"Unknown report format: {fmt}")
+    report = Circulation(until or datetime.now())
+    start = time.perf_counter()
+    for chunk in batches(repo.circulation(since, until, chunk_size), chunk_size):
+        report.add_loans(chunk)
+        if log:
+            rate = report.loans / max(time.perf_counter() - start, 1e-9)
+            log(f"reports: {report.loans} loans read ({rate:,.0f} loans/s)")
+    for chunk in batches(repo.stream_table('books', chunk_size), chunk_size):
+        report.add_books(chunk)
+    for chunk in batches(repo.review_activity(since, until, chunk_size), chunk_size):
+        report.add_reviews(chunk)
+
+    os.makedirs(output, exist_ok=True)
+    written = []
+    for name, (columns, rows) in (
+            ("summary", report.summary()),
+            ("loans_by_month", report.loans_by_month()),
+            ("title_utilisation", report.title_utilisation(since, until)),
+            ("top_reviewers", report.top_reviewers(top))):
+        path = os.path.join(output, f"{name}.{fmt}")
+        write_report(path, columns, rows, fmt)
+        written.append(path)
+    return written
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value}") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Circulation reports")
+    parser.add_argument('--output', '-o', default="reports", help="directory for the reports")
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--since', type=_date,
+                        help="first issue or review date (YYYY-MM-DD)")
+    parser.add_argument('--until', type=_date,
+                        help="issue and review dates before this (YYYY-MM-DD)")
+    parser.add_argument('--top', type=int, default=TOP_REVIEWERS, help="reviewers listed")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK)
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            written = run(repo, args.output, args.format, args.since, args.until,
+                          args.chunk_size, args.top, log=lambda msg: print(msg, file=sys.stderr))
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    for path in written:
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""Client-side catalog search.
+
+TrigramIndex is an inverted index from character trigrams to book ids.
+Matching on trigrams instead of whole words gives prefix matches for
+free (the last query word is looked up without its closing boundary)
+and tolerates typos, since a misspelt word still shares most of its
+trigrams with the intended one.
+
+TitleIndex is the typeahead behind the title entry boxes: every
+distinct title, sorted by its normalized form and packed into one
+string, searched with bisect. Prefix matches come straight from the
+sorted order; typos are forgiven by also trying every prefix one edit
+away, where the replacement and inserted characters are the ones that
+actually follow in the index.
+"""
+import heapq
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+MIN_SCORE = 0.4  # share of query trigrams a book must contain
+EXACT_GRAMS = 3  # queries this short must match exactly
+SUGGESTIONS = 10
+FUZZY_MIN = 3  # shorter suggestion queries only match as prefixes
+REBUILD_AFTER = 1000  # titles added or removed before a TitleIndex is rebuilt
+_LAST = "\U0010ffff"  # sorts after any character a title can contain
+
+
+def normalize(text):
+    """Lower-case `text` and strip accents."""
+    if text is None:
+        return ""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def words(text):
+    return re.findall(r"\w+", normalize(text))
+
+
+def trigrams(word, prefix=False):
+    """Trigrams of `word` padded with word boundaries.
+
+    With `prefix` the closing boundary is left out, so the result is a
+    subset of the trigrams of every word starting with `word`.
+    """
+    padded = "  " + word + ("" if prefix else " ")
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _doc_trigrams(title, category):
+    grams = set()
+    for word in words(title) + words(category):
+        grams.update(trigrams(word))
+    return grams
+
+
+class TrigramIndex:
+    """Ranked, typo-tolerant search over book titles and categories."""
+
+    def __init__(self, min_score=MIN_SCORE):
+        self.min_score = min_score
+        self._postings = {}
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, title, category):
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        self._docs[doc_id] = (title, category)
+        for gram in _doc_trigrams(title, category):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(doc_id)
+
+    def remove(self, doc_id):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for gram in _doc_trigrams(*doc):
+            postings = self._postings[gram]
+            postings.remove(doc_id)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, query, limit=50, offset=0):
+        """Return (total, doc_ids) for one page of matches, best first."""
+        query_words = words(query)
+        if not query_words:
+            return 0, []
+        grams = set()
+        for i, word in enumerate(query_words):
+            grams.update(trigrams(word, prefix=i == len(query_words) - 1))
+        # The last word may also be complete: its closing trigram is not
+        # required, but counts towards the score when it matches.
+        scored = grams | set(trigrams(query_words[-1]))
+
+        counts = Counter()
+        for gram in scored:
+            postings = self._postings.get(gram)
+            if postings is not None:
+                counts.update(postings)
+
+        if len(grams) <= EXACT_GRAMS:
+            needed = len(grams)
+        else:
+            needed = self.min_score * len(grams)
+        matches = [(doc_id, shared) for doc_id, shared in counts.items() if shared >= needed]
+        if not matches:
+            return 0, []
+
+        def rank(match):
+            doc_id, shared = match
+            title = normalize(self._docs[doc_id][0])
+            title_words = words(title)
+            # Books whose title starts with the query words come first
+            in_title = all(any(w.startswith(q) for w in title_words) for q in query_words)
+            return (-shared, not in_title, len(title), title, doc_id)
+
+        page = heapq.nsmallest(offset + limit, matches, key=rank)[offset:]
+        return len(matches), [doc_id for doc_id, _ in page]
+
+
+def title_key(title):
+    """Sort and match key of a title: normalized, single-spaced."""
+    return " ".join(normalize(title).split())
+
+
+def _one_edit(prefix, key):
+    """Whether `key` starts with a string at most one edit from `prefix`."""
+    if key.startswith(prefix):
+        return True
+    for i, c in enumerate(prefix):
+        if i >= len(key) or key[i] != c:
+            rest = prefix[i + 1:]
+            return (key.startswith(rest, i)  # deleted
+                    or key.startswith(rest, i + 1)  # replaced
+                    or key.startswith(prefix[i:], i + 1)  # inserted
+                    or (len(key) > i + 1 and key[i] == prefix[i + 1:i + 2]
+                        and key.startswith(c + prefix[i + 2:], i + 1)))  # swapped
+    return False
+
+
+class _Keys:
+    """Sequence view of the keys packed into one string, for bisect."""
+
+    __slots__ = ('text', 'offsets')
+
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+
+class TitleIndex:
+    """Prefix and one-typo typeahead over titles, resolving to book ids.
+
+    Built once from a {title: book_ids} mapping. Books added or renamed
+    later go into a small overlay that is scanned on every lookup;
+    `stale` turns true once it has grown large enough that the owner
+    should build a new index.
+    """
+
+    def __init__(self, titles):
+        names = list(titles)
+        keys = [title_key(title) for title in names]
+        order = sorted(range(len(names)), key=keys.__getitem__)
+        offsets = array('I', [0])
+        ids = array('I')
+        starts = array('I', [0])
+        end = 0
+        for i in order:
+            end += len(keys[i])
+            offsets.append(end)
+            ids.extend(titles[names[i]])
+            starts.append(len(ids))
+        self._keys = _Keys("".join([keys[i] for i in order]), offsets)
+        self._titles = [names[i] for i in order]
+        self._ids = ids
+        self._starts = starts
+        self._added = {}  # book_id -> title, since the build
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._titles)
+
+    @property
+    def stale(self):
+        return len(self._added) + len(self._removed) > REBUILD_AFTER
+
+    def add(self, book_id, title):
+        self._added[book_id] = title
+
+    def remove(self, book_id):
+        if self._added.pop(book_id, None) is None:
+            self._removed.add(book_id)
+
+    def _range(self, prefix, lo=0, hi=None):
+        keys = self._keys
+        hi = len(keys) if hi is None else hi
+        lo = bisect_left(keys, prefix, lo, hi)
+        return lo, bisect_left(keys, prefix + _LAST, lo, hi)
+
+    def _first(self, prefix, lo, hi, limit):
+        """Up to `limit` slots in [lo, hi) whose key starts with `prefix`."""
+        keys = self._keys
+        slot = bisect_left(keys, prefix, lo, hi)
+        end = min(hi, slot + limit)
+        slots = []
+        while slot < end and keys[slot].startswith(prefix):
+            slots.append(slot)
+            slot += 1
+        return slots
+
+    def _next_chars(self, prefix, lo, hi):
+        """Characters that follow `prefix` in keys[lo:hi], all starting with it."""
+        keys, depth, chars = self._keys, len(prefix), []
+        while lo < hi:
+            key = keys[lo]
+            if len(key) == depth:
+                lo += 1
+                continue
+            chars.append(key[depth])
+            lo = bisect_left(keys, prefix + key[depth] + _LAST, lo, hi)
+        return chars
+
+    def _fuzzy(self, query, limit):
+        """Slots whose key starts one edit away from `query`.
+
+        The edit is tried at each position, last first, inside the
+        range of keys sharing the unedited head, so later positions
+        (where typos are more often noticed) fill the limit first.
+        """
+        ranges = [(0, len(self._keys))]
+        for i in range(len(query) - 1):
+            lo, hi = self._range(query[:i + 1], *ranges[-1])
+            if lo == hi:
+                break
+            ranges.append((lo, hi))
+        slots = {}
+        for i in reversed(range(len(ranges))):
+            lo, hi = ranges[i]
+            head, tail = query[:i], query[i + 1:]
+            variants = [head + tail]
+            if tail:
+                variants.append(head + tail[0] + query[i] + tail[1:])
+            for c in self._next_chars(head, lo, hi):
+                if c != query[i]:
+                    variants.append(head + c + tail)
+                variants.append(head + c + query[i:])
+            for variant in variants:
+                if variant and variant != query:
+                    slots.update(dict.fromkeys(self._first(variant, lo, hi, limit)))
+            if len(slots) >= limit:
+                break
+        return list(slots)
+
+    def _book_ids(self, slot):
+        ids = sorted(self._ids[self._starts[slot]:self._starts[slot + 1]])
+        if self._removed:
+            return [book_id for book_id in ids if book_id not in self._removed]
+        return ids
+
+    def suggest(self, text, limit=SUGGESTIONS):
+        """(title, book_ids) for titles starting with `text`, then near misses
+        once `text` is FUZZY_MIN characters long."""
+        query = title_key(text)
+        if not query:
+            return []
+        suggestions = {}
+        fuzzy = len(query) >= FUZZY_MIN
+        slots = self._first(query, 0, len(self._keys), limit)
+        if fuzzy and len(slots) < limit:
+            slots += [slot for slot in self._fuzzy(query, limit) if slot not in slots]
+        for slot in slots:
+            ids = self._book_ids(slot)
+            if ids:
+                suggestions[self._titles[slot]] = ids
+            if len(suggestions) >= limit:
+                break
+        # Books added since the build: exact prefixes first
+        added = sorted((not title_key(title).startswith(query), title_key(title), title, book_id)
+                       for book_id, title in self._added.items()
+                       if (_one_edit(query, title_key(title)) if fuzzy
+                           else title_key(title).startswith(query)))
+        for _, _, title, book_id in added:
+            if title in suggestions or len(suggestions) < limit:
+                suggestions.setdefault(title, []).append(book_id)
+        return list(suggestions.items())[:limit]
+
+    def resolve(self, title):
+        """Book ids of the titles equal to `title`, ignoring case and accents."""
+        key = title_key(title)
+        lo, hi = self._range(key)
+        ids = []
+        for slot in range(lo, hi):
+            if self._keys[slot] == key:
+                ids.extend(self._book_ids(slot))
+        ids.extend(book_id for book_id, added in self._added.items() if title_key(added) == key)
+        return sorted(ids)
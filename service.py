@@ -0,0 +1,563 @@
+"""Headless library service: the repository as a JSON HTTP API.
+
+    python service.py --port 8080
+    LIBMGMT_SERVICE_TOKEN=<secret> python service.py --host 0.0.0.0
+
+The service listens on localhost unless told otherwise. Every request
+must carry the shared LIBMGMT_SERVICE_TOKEN as a bearer token when one
+is set, and the service refuses to listen on another interface without
+one, since any client can check books in and out for any student.
+
+One service process holds one connection pool for any number of desks
+and kiosks. Identical GET requests that arrive while one is already
+running share its result instead of each hitting the database, and the
+latency of every route is reported at GET /metrics (JSON) and, with the
+query metrics, at GET /metrics/prometheus.
+
+HTTPRepository is the client side: a LibraryRepository that talks to
+the service, selected in the GUI with LIBMGMT_BACKEND=http.
+"""
+import argparse
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from executor import LatencyMetrics
+from instrumentation import INSTRUMENTS, PROFILER, configure, running
+from storage import (EVENT_BATCH, HISTORY_PAGE_SIZE, REVIEW_PAGE_SIZE, SEARCH_PAGE_SIZE,
+                     STREAM_CHUNK, LibraryRepository, StorageError, create_repository)
+
+SERVICE_URL = os.environ.get("LIBMGMT_SERVICE_URL", "http://localhost:8080")
+SERVICE_TOKEN = os.environ.get("LIBMGMT_SERVICE_TOKEN") or None
+DATETIME_FIELDS = {'issued_date', 'due_date', 'return_date', 'created_at'}
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _decode(obj):
+    for field in DATETIME_FIELDS & obj.keys():
+        if isinstance(obj[field], str):
+            obj[field] = datetime.fromisoformat(obj[field])
+    return obj
+
+
+class BadRequest(Exception):
+    """A request whose parameters do not make sense; answered with 400."""
+
+
+_REQUIRED = object()
+
+
+def _int(values, field, default=_REQUIRED):
+    value = values.get(field)
+    if value is None:
+        if default is _REQUIRED:
+            raise BadRequest(f"{field} is required")
+        return default
+    if isinstance(value, (bool, float)):
+        raise BadRequest(f"{field} must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{field} must be an integer") from None
+
+
+def _ints(values, field):
+    items = values.get(field)
+    if not isinstance(items, list):
+        raise BadRequest(f"{field} must be a list of integers")
+    return [_int({field: item}, field) for item in items]
+
+
+def _str(values, field, default=_REQUIRED):
+    value = values.get(field)
+    if value is None:
+        if default is _REQUIRED:
+            raise BadRequest(f"{field} is required")
+        return default
+    if not isinstance(value, str):
+        raise BadRequest(f"{field} must be a string")
+    return value
+
+
+def _key(values, field):
+    """Keyset key from JSON: [timestamp, id]."""
+    value = values.get(field)
+    if value is None:
+        return None
+    try:
+        issued, row_id = json.loads(value)
+        return datetime.fromisoformat(issued), int(row_id)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{field} must be a [timestamp, id] pair") from None
+
+
+def _dump_key(value):
+    return json.dumps(value, default=_encode) if value is not None else None
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class LibraryService:
+    """Routes HTTP requests to repository calls."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.metrics = LatencyMetrics()
+        self.reads = SingleFlight()
+        self.routes = [
+            ("GET", r"/books/available", "available",
+             lambda m, q, b: repo.available_books()),
+            ("GET", r"/books/titles", "titles",
+             lambda m, q, b: repo.all_titles()),
+            ("GET", r"/books/search", "search",
+             lambda m, q, b: repo.search(_str(q, 'q', ''), _int(q, 'limit', SEARCH_PAGE_SIZE),
+                                         _int(q, 'offset', 0))),
+            ("GET", r"/categories", "categories",
+             lambda m, q, b: repo.categories()),
+            ("GET", r"/categories/books", "category_books",
+             lambda m, q, b: repo.books_in_category(q.get('category'))),
+            ("GET", r"/students/(\d+)/loans", "loans",
+             lambda m, q, b: repo.open_loans(int(m[1]))),
+            ("GET", r"/students/(\d+)/holds", "holds",
+             lambda m, q, b: repo.holds(int(m[1]))),
+            ("GET", r"/loans/overdue", "overdue",
+             lambda m, q, b: repo.overdue_loans(_int(q, 'limit', 100))),
+            ("GET", r"/students/(\d+)/history", "history",
+             lambda m, q, b: repo.transaction_history(int(m[1]))),
+            ("GET", r"/students/(\d+)/history/page", "history_page",
+             lambda m, q, b: repo.history_page(int(m[1]), _key(q, 'after'), _key(q, 'before'),
+                                               _int(q, 'limit', HISTORY_PAGE_SIZE))),
+            ("GET", r"/reviews", "reviews",
+             lambda m, q, b: repo.reviews_for(_str(q, 'title', ''))),
+            ("GET", r"/reviews/summary", "review_summary",
+             lambda m, q, b: repo.review_summary(_str(q, 'title', ''))),
+            ("GET", r"/reviews/page", "review_page",
+             lambda m, q, b: repo.review_page(_str(q, 'title', ''), _key(q, 'after'),
+                                              _int(q, 'limit', REVIEW_PAGE_SIZE))),
+            ("GET", r"/catalog/version", "catalog_version",
+             lambda m, q, b: repo.catalog_version()),
+            ("GET", r"/catalog/books", "catalog_books",
+             lambda m, q, b: repo.catalog_books()),
+            ("GET", r"/catalog/changes", "catalog_changes",
+             lambda m, q, b: repo.catalog_changes(_int(q, 'since', 0))),
+            ("GET", r"/events/version", "events_version",
+             lambda m, q, b: repo.events_version()),
+            ("GET", r"/events", "catalog_events",
+             lambda m, q, b: repo.catalog_events(_int(q, 'since', 0),
+                                                 _int(q, 'limit', EVENT_BATCH))),
+            ("GET", r"/metrics", "metrics",
+             lambda m, q, b: self.snapshot()),
+            ("POST", r"/login", "login",
+             lambda m, q, b: repo.login(_str(b, 'name'), _str(b, 'email'))),
+            ("POST", r"/checkout", "checkout",
+             lambda m, q, b: repo.checkout(_int(b, 'student_id'), _int(b, 'book_id'))),
+            ("POST", r"/checkin", "checkin",
+             lambda m, q, b: repo.checkin(_int(b, 'student_id'), _int(b, 'book_id'))),
+            ("POST", r"/checkout/batch", "checkout_many",
+             lambda m, q, b: repo.checkout_many(_int(b, 'student_id'), _ints(b, 'book_ids'))),
+            ("POST", r"/checkin/batch", "checkin_many",
+             lambda m, q, b: repo.checkin_many(_ints(b, 'book_ids'), _int(b, 'student_id', None))),
+            ("POST", r"/borrow", "borrow",
+             lambda m, q, b: repo.borrow(_int(b, 'student_id'), _str(b, 'title'))),
+            ("POST", r"/return", "return",
+             lambda m, q, b: repo.return_book(_int(b, 'student_id'), _str(b, 'title'))),
+            ("POST", r"/holds", "place_hold",
+             lambda m, q, b: repo.place_hold(_int(b, 'student_id'), _str(b, 'title'))),
+            ("POST", r"/holds/cancel", "cancel_hold",
+             lambda m, q, b: repo.cancel_hold(_int(b, 'student_id'), _int(b, 'hold_id'))),
+            ("POST", r"/reviews", "add_review",
+             lambda m, q, b: repo.add_review(
+                 _int(b, 'student_id'), _str(b, 'title'), _str(b, 'text'), _int(b, 'rating'),
+                 _int(b, 'book_id', None))),
+        ]
+
+    def snapshot(self):
+        return {'routes': self.metrics.snapshot(), 'shared_reads': self.reads.shared}
+
+    def dispatch(self, method, target, body):
+        """Return (status, payload) for one request.
+
+        Only parameters that fail validation are the client's fault
+        (400); anything else raised while serving is logged as a server
+        error (500).
+        """
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        for route_method, pattern, name, handler in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, {'error': f"No route for {method} {url.path}"}
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            with running(name), PROFILER.profile():
+                if method == "GET":
+                    result = self.reads.do(target, lambda: handler(match, query, body))
+                else:
+                    result = handler(match, query, body)
+            failed = False
+            return 200, {'result': result}
+        except BadRequest as e:
+            return 400, {'error': f"Bad request: {e}"}
+        except StorageError as e:
+            return 500, {'error': str(e)}
+        except Exception:
+            print(f"Error serving {method} {url.path}:", file=sys.stderr)
+            traceback.print_exc()
+            return 500, {'error': "Internal server error"}
+        finally:
+            seconds = time.perf_counter() - start
+            self.metrics.record(name, seconds, failed)
+            INSTRUMENTS.action(name, seconds, failed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for desks that poll
+
+    def _authorized(self):
+        token = self.server.token
+        if token is None:
+            return True
+        scheme, _, given = (self.headers.get('Authorization') or "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(given.encode(), token.encode())
+
+    def _serve(self, method):
+        if not self._authorized():
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            self._reply(401, {'error': "Missing or wrong service token"})
+            return
+        if method == "GET" and urlsplit(self.path).path == "/metrics/prometheus":
+            data = INSTRUMENTS.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                self._reply(400, {'error': "Body is not valid JSON"})
+                return
+            if not isinstance(body, dict):
+                self._reply(400, {'error': "Body must be a JSON object"})
+                return
+        status, payload = self.server.service.dispatch(method, self.path, body or {})
+        self._reply(status, payload)
+
+    def _reply(self, status, payload):
+        try:
+            data = json.dumps(payload, default=_encode).encode()
+        except (TypeError, ValueError):
+            print(f"Error encoding the reply to {self.command} {self.path}:", file=sys.stderr)
+            traceback.print_exc()
+            status, data = 500, json.dumps({'error': "Internal server error"}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._serve("GET")
+
+    def do_POST(self):
+        self._serve("POST")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def _loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_server(repo, host="127.0.0.1", port=8080, verbose=False, token=SERVICE_TOKEN):
+    """Build the service's HTTP server. Raises ValueError if it would be open to the network."""
+    if token is None and not _loopback(host):
+        raise ValueError(f"Refusing to listen on {host} without LIBMGMT_SERVICE_TOKEN")
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = LibraryService(repo)
+    server.verbose = verbose
+    server.token = token
+    return server
+
+
+class HTTPRepository(LibraryRepository):
+    """LibraryRepository served by a remote LibraryService."""
+
+    def __init__(self, url=SERVICE_URL, timeout=30, token=SERVICE_TOKEN):
+        parts = urlsplit(url)
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._timeout = timeout
+        self._token = token
+        self._local = threading.local()  # one keep-alive connection per thread
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self, fresh=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, method, path, query=None, body=None):
+        if query:
+            path += "?" + urlencode({k: v for k, v in query.items() if v is not None})
+        data = json.dumps(body, default=_encode).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data else {}
+        if self._token is not None:
+            headers['Authorization'] = f"Bearer {self._token}"
+        conn = self._connection()
+        for attempt in range(2):
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                payload = json.loads(response.read(), object_hook=_decode)
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                # Most likely the server closed an idle keep-alive
+                # connection, but the request may also have run. Only a
+                # read is safe to send again; a checkout is not.
+                if attempt or method != "GET":
+                    self._connection(fresh=True)
+                    raise StorageError(f"Library service unavailable: {e}") from e
+                conn = self._connection(fresh=True)
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self._connection(fresh=True)
+                raise StorageError(f"Library service unavailable: {e}") from e
+        if response.status != 200:
+            raise StorageError(payload.get('error', f"HTTP {response.status}"))
+        return payload['result']
+
+    def login(self, name, email):
+        return self._call("POST", "/login", body={'name': name, 'email': email})
+
+    def available_books(self):
+        return self._call("GET", "/books/available")
+
+    def all_titles(self):
+        return self._call("GET", "/books/titles")
+
+    def checkout(self, student_id, book_id):
+        return self._call("POST", "/checkout", body={'student_id': student_id, 'book_id': book_id})
+
+    def checkin(self, student_id, book_id):
+        return self._call("POST", "/checkin", body={'student_id': student_id, 'book_id': book_id})
+
+    def checkout_many(self, student_id, book_ids):
+        result = self._call("POST", "/checkout/batch",
+                            body={'student_id': student_id, 'book_ids': list(book_ids)})
+        return [tuple(pair) for pair in result]
+
+    def checkin_many(self, book_ids, student_id=None):
+        result = self._call("POST", "/checkin/batch",
+                            body={'student_id': student_id, 'book_ids': list(book_ids)})
+        return [tuple(pair) for pair in result]
+
+    def borrow(self, student_id, title):
+        return self._call("POST", "/borrow", body={'student_id': student_id, 'title': title})
+
+    def place_hold(self, student_id, title):
+        return self._call("POST", "/holds", body={'student_id': student_id, 'title': title})
+
+    def cancel_hold(self, student_id, hold_id):
+        return self._call("POST", "/holds/cancel",
+                          body={'student_id': student_id, 'hold_id': hold_id})
+
+    def holds(self, student_id):
+        return self._call("GET", f"/students/{int(student_id)}/holds")
+
+    def open_loans(self, student_id):
+        return self._call("GET", f"/students/{int(student_id)}/loans")
+
+    def return_book(self, student_id, title):
+        result = self._call("POST", "/return", body={'student_id': student_id, 'title': title})
+        return tuple(result) if result is not None else None
+
+    def overdue_loans(self, limit=100):
+        return self._call("GET", "/loans/overdue", {'limit': limit})
+
+    def transaction_history(self, student_id):
+        return self._call("GET", f"/students/{int(student_id)}/history")
+
+    def history_page(self, student_id, after=None, before=None, limit=HISTORY_PAGE_SIZE):
+        return self._call("GET", f"/students/{int(student_id)}/history/page",
+                          {'after': _dump_key(after), 'before': _dump_key(before), 'limit': limit})
+
+    def search(self, term, limit=SEARCH_PAGE_SIZE, offset=0):
+        return self._call("GET", "/books/search", {'q': term, 'limit': limit, 'offset': offset})
+
+    def categories(self):
+        return self._call("GET", "/categories")
+
+    def books_in_category(self, category):
+        return self._call("GET", "/categories/books", {'category': category})
+
+    def reviews_for(self, title):
+        return self._call("GET", "/reviews", {'title': title})
+
+    def review_summary(self, title):
+        return self._call("GET", "/reviews/summary", {'title': title})
+
+    def review_page(self, title, after=None, limit=REVIEW_PAGE_SIZE):
+        return self._call("GET", "/reviews/page",
+                          {'title': title, 'after': _dump_key(after), 'limit': limit})
+
+    def add_review(self, student_id, title, text, rating, book_id=None):
+        return self._call("POST", "/reviews", body={
+            'student_id': student_id, 'title': title, 'text': text, 'rating': rating,
+            'book_id': book_id})
+
+    def catalog_version(self):
+        return self._call("GET", "/catalog/version")
+
+    def catalog_books(self):
+        return tuple(self._call("GET", "/catalog/books"))
+
+    def catalog_changes(self, since):
+        return tuple(self._call("GET", "/catalog/changes", {'since': since}))
+
+    def events_version(self):
+        return self._call("GET", "/events/version")
+
+    def catalog_events(self, since, limit=EVENT_BATCH):
+        return tuple(self._call("GET", "/events", {'since': since, 'limit': limit}))
+
+    def bulk_insert(self, table, columns, rows, checkpoint=None):
+        raise StorageError("Bulk import is not available through the library service")
+
+    def import_checkpoint(self, source):
+        raise StorageError("Bulk import is not available through the library service")
+
+    def clear_import_checkpoint(self, source):
+        raise StorageError("Bulk import is not available through the library service")
+
+    def stream_table(self, table, chunk_size=STREAM_CHUNK, after=None):
+        raise StorageError("Bulk export is not available through the library service")
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the library HTTP/JSON service")
+    parser.add_argument('--host', default="127.0.0.1",
+                        help="interface to listen on; others need LIBMGMT_SERVICE_TOKEN")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'))
+    parser.add_argument('--sqlite-path', help="SQLite database file")
+    parser.add_argument('--pool-size', type=int, help="database connections to share")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    backend = args.backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    if backend == 'http':
+        parser.error("the service needs a database backend, not http")
+    configure()
+    options = {}
+    if args.sqlite_path and backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    if args.pool_size:
+        options['pool_size'] = args.pool_size
+    try:
+        repo = create_repository(backend, **options)
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    try:
+        server = make_server(repo, args.host, args.port, args.verbose)
+    except ValueError as e:
+        repo.close()
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Library service listening on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        repo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
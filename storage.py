@@ -0,0 +1,2366 @@
+"""Storage layer for the library management system.
+
+The GUI talks to a LibraryRepository instead of holding its own
+connection. Both backends run the same SQL: MySQL through a
+mysql.connector connection pool with prepared statements, and SQLite
+with the same schema so the logic can be tested and benchmarked
+without a MySQL server.
+"""
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from instrumentation import INSTRUMENTS, operation, statement_label
+
+# mysql.connector is slow to import, so it is loaded by the first
+# MySQLRepository rather than with this module.
+mysql = None
+pooling = None
+
+LOAN_DAYS = 7
+PENALTY_PER_DAY = float(os.environ.get("LIBMGMT_FINE_RATE", "1.0"))  # Rs. per day
+FINE_GRACE_DAYS = int(os.environ.get("LIBMGMT_FINE_GRACE_DAYS", "0"))
+FINE_CAP = float(os.environ["LIBMGMT_FINE_CAP"]) if os.environ.get("LIBMGMT_FINE_CAP") else None
+ARCHIVE_AFTER_DAYS = int(os.environ.get("LIBMGMT_ARCHIVE_AFTER_DAYS", "365"))  # since the return
+ARCHIVE_BATCH = 1000  # loans moved per transaction
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.02  # seconds, doubled on every retry
+
+DB_CONFIG = {
+    "host": os.environ.get("LIBMGMT_DB_HOST", "localhost"),
+    "user": os.environ.get("LIBMGMT_DB_USER", "root"),  # Replace with your MySQL username
+    "password": os.environ.get("LIBMGMT_DB_PASSWORD", "dheeraj036"),  # Replace with your MySQL password
+    "database": os.environ.get("LIBMGMT_DB_NAME", "library_management"),
+}
+POOL_SIZE = int(os.environ.get("LIBMGMT_POOL_SIZE", "5"))
+SEARCH_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 100
+REVIEW_PAGE_SIZE = 20
+STREAM_CHUNK = 1000
+EVENT_BATCH = 500  # catalog events per poll
+
+# Columns of each table, primary key first, for bulk import and export.
+TABLE_COLUMNS = {
+    'books': ('book_id', 'title', 'category', 'status', 'created_at'),
+    'students': ('student_id', 'name', 'email', 'created_at'),
+    'transactions': ('transaction_id', 'book_id', 'student_id', 'issued_date',
+                     'due_date', 'return_date', 'penalty_amount'),
+    'transactions_archive': ('transaction_id', 'book_id', 'student_id', 'issued_date',
+                             'due_date', 'return_date', 'penalty_amount'),
+    'reviews': ('review_id', 'book_id', 'student_id', 'review_text', 'rating', 'created_at'),
+}
+FULLTEXT_MIN_TOKEN = 3  # InnoDB innodb_ft_min_token_size
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+SQLITE_PATH = os.environ.get("LIBMGMT_SQLITE_PATH", "library_management.db")
+AUTO_MIGRATE = os.environ.get("LIBMGMT_AUTO_MIGRATE", "1") != "0"
+
+# Schema changes for existing databases, applied in order and recorded
+# in schema_version. A step is an index to create, as (table, name,
+# columns, unique), an index to drop, as (table, name), or the name of
+# a repository method taking a session.
+MIGRATIONS = (
+    (1, "unique student email", (
+        '_merge_duplicate_students',
+        ('students', 'uq_students_email', ('email',), True),
+    )),
+    (2, "covering index for open loans", (
+        ('transactions', 'idx_open_loans',
+         ('student_id', 'return_date', 'due_date', 'book_id', 'issued_date'), False),
+    )),
+    (3, "covering index for categories", (
+        ('books', 'idx_category', ('category', 'title', 'status'), False),
+    )),
+    (4, "reviews by book and date", (
+        ('reviews', 'idx_reviews_book_created', ('book_id', 'created_at', 'review_id'), False),
+        # The book_id prefix index only lured the planner into sorting
+        ('reviews', 'idx_reviews_book'),
+        ('reviews', 'book_id'),
+    )),
+    (5, "catalog event feed", (
+        '_create_catalog_events',
+    )),
+    (6, "title holdings and holds queue", (
+        '_create_holdings',
+    )),
+    (7, "archive for closed loans", (
+        ('transactions', 'idx_transactions_returned', ('return_date',), False),
+        '_create_archive',
+    )),
+    # Objects that earlier releases only shipped in library_management.sql
+    (8, "catalog change counter", (
+        '_create_change_log',
+    )),
+    (9, "full-text search and history by date", (
+        '_create_fulltext',
+        ('transactions', 'idx_student_issued', ('student_id', 'issued_date', 'transaction_id'),
+         False),
+    )),
+    (10, "import checkpoints", (
+        '_create_import_checkpoints',
+    )),
+    (11, "fines ledger", (
+        '_create_fines_ledger',
+    )),
+    (12, "review aggregates", (
+        '_create_review_aggregates',
+    )),
+    (13, "title categories follow their books", (
+        '_create_holdings',
+    )),    (14, "title category from its oldest copy", (
+        '_create_holdings',
+    )),
+)
+# Tables with a student_id column, repointed when students are merged
+STUDENT_TABLES = ('transactions', 'transactions_archive', 'reviews', 'loan_fines', 'holds',
+                  'catalog_events')
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER NOT NULL PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+)"""
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title VARCHAR(200) NOT NULL,
+    category VARCHAR(50) DEFAULT NULL,
+    status TEXT DEFAULT 'available' CHECK (status IN ('available', 'issued')),
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_title ON books (title);
+CREATE INDEX IF NOT EXISTS idx_status ON books (status);
+
+CREATE TABLE IF NOT EXISTS students (
+    student_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER REFERENCES books (book_id),
+    student_id INTEGER REFERENCES students (student_id),
+    issued_date TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    due_date TIMESTAMP DEFAULT NULL,
+    return_date TIMESTAMP DEFAULT NULL,
+    penalty_amount DECIMAL(10,2) DEFAULT 0.00
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_student ON transactions (student_id);
+CREATE INDEX IF NOT EXISTS idx_book_student ON transactions (book_id, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_issued ON transactions (student_id, issued_date, transaction_id);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER REFERENCES books (book_id),
+    student_id INTEGER REFERENCES students (student_id),
+    review_text TEXT,
+    rating INTEGER CHECK (rating BETWEEN 1 AND 5),
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_book_created ON reviews (book_id, created_at, review_id);
+CREATE INDEX IF NOT EXISTS idx_reviews_student ON reviews (student_id);
+
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS trg_books_insert AFTER INSERT ON books
+BEGIN INSERT INTO catalog_changes (book_id) VALUES (NEW.book_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_books_update AFTER UPDATE ON books
+BEGIN INSERT INTO catalog_changes (book_id) VALUES (NEW.book_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_books_delete AFTER DELETE ON books
+BEGIN INSERT INTO catalog_changes (book_id) VALUES (OLD.book_id); END;
+
+CREATE TABLE IF NOT EXISTS loan_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS trg_transactions_insert AFTER INSERT ON transactions
+BEGIN INSERT INTO loan_changes (transaction_id) VALUES (NEW.transaction_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_transactions_update AFTER UPDATE ON transactions
+BEGIN INSERT INTO loan_changes (transaction_id) VALUES (NEW.transaction_id); END;
+
+CREATE TABLE IF NOT EXISTS loan_fines (
+    transaction_id INTEGER PRIMARY KEY,
+    student_id INTEGER,
+    book_id INTEGER,
+    due_date TIMESTAMP NOT NULL,
+    days_overdue INTEGER NOT NULL,
+    fine DECIMAL(10,2) NOT NULL,
+    accruing INTEGER NOT NULL,
+    as_of TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fines_student ON loan_fines (student_id);
+CREATE INDEX IF NOT EXISTS idx_fines_overdue ON loan_fines (days_overdue);
+CREATE INDEX IF NOT EXISTS idx_fines_accruing ON loan_fines (accruing, due_date);
+
+CREATE TABLE IF NOT EXISTS fine_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    last_change BIGINT NOT NULL,
+    policy VARCHAR(100) NOT NULL,
+    as_of TIMESTAMP NOT NULL,
+    loans INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    source VARCHAR(255) PRIMARY KEY,
+    rows_done BIGINT NOT NULL
+);
+"""
+
+# The feed open screens poll: book changes, new loans, returns and
+# reviews under one sequence number
+SQLITE_EVENTS_DDL = (
+    """CREATE TABLE IF NOT EXISTS catalog_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind VARCHAR(10) NOT NULL,
+    book_id INTEGER NOT NULL,
+    student_id INTEGER DEFAULT NULL,
+    transaction_id INTEGER DEFAULT NULL
+)""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_books_insert AFTER INSERT ON books
+BEGIN INSERT INTO catalog_events (kind, book_id) VALUES ('book', NEW.book_id); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_books_update AFTER UPDATE ON books
+BEGIN INSERT INTO catalog_events (kind, book_id) VALUES ('book', NEW.book_id); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_books_delete AFTER DELETE ON books
+BEGIN INSERT INTO catalog_events (kind, book_id) VALUES ('book', OLD.book_id); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_loan AFTER INSERT ON transactions
+WHEN NEW.book_id IS NOT NULL
+BEGIN INSERT INTO catalog_events (kind, book_id, student_id, transaction_id)
+VALUES ('loan', NEW.book_id, NEW.student_id, NEW.transaction_id); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_return AFTER UPDATE OF return_date ON transactions
+WHEN OLD.return_date IS NULL AND NEW.return_date IS NOT NULL AND NEW.book_id IS NOT NULL
+BEGIN INSERT INTO catalog_events (kind, book_id, student_id, transaction_id)
+VALUES ('return', NEW.book_id, NEW.student_id, NEW.transaction_id); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_events_review AFTER INSERT ON reviews
+WHEN NEW.book_id IS NOT NULL
+BEGIN INSERT INTO catalog_events (kind, book_id, student_id)
+VALUES ('review', NEW.book_id, NEW.student_id); END""",
+)
+SQLITE_SCHEMA += "".join(f"{statement};\n" for statement in SQLITE_EVENTS_DDL)
+
+MYSQL_EVENTS_DDL = (
+    """CREATE TABLE IF NOT EXISTS catalog_events (
+    event_id BIGINT NOT NULL AUTO_INCREMENT,
+    kind VARCHAR(10) NOT NULL,
+    book_id INT NOT NULL,
+    student_id INT DEFAULT NULL,
+    transaction_id INT DEFAULT NULL,
+    PRIMARY KEY (event_id)
+)""",
+    "DROP TRIGGER IF EXISTS trg_events_books_insert",
+    """CREATE TRIGGER trg_events_books_insert AFTER INSERT ON books FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id) VALUES ('book', NEW.book_id)""",
+    "DROP TRIGGER IF EXISTS trg_events_books_update",
+    """CREATE TRIGGER trg_events_books_update AFTER UPDATE ON books FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id) VALUES ('book', NEW.book_id)""",
+    "DROP TRIGGER IF EXISTS trg_events_books_delete",
+    """CREATE TRIGGER trg_events_books_delete AFTER DELETE ON books FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id) VALUES ('book', OLD.book_id)""",
+    "DROP TRIGGER IF EXISTS trg_events_loan",
+    """CREATE TRIGGER trg_events_loan AFTER INSERT ON transactions FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id, student_id, transaction_id)
+SELECT 'loan', NEW.book_id, NEW.student_id, NEW.transaction_id FROM DUAL
+WHERE NEW.book_id IS NOT NULL""",
+    "DROP TRIGGER IF EXISTS trg_events_return",
+    """CREATE TRIGGER trg_events_return AFTER UPDATE ON transactions FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id, student_id, transaction_id)
+SELECT 'return', NEW.book_id, NEW.student_id, NEW.transaction_id FROM DUAL
+WHERE OLD.return_date IS NULL AND NEW.return_date IS NOT NULL AND NEW.book_id IS NOT NULL""",
+    "DROP TRIGGER IF EXISTS trg_events_review",
+    """CREATE TRIGGER trg_events_review AFTER INSERT ON reviews FOR EACH ROW
+INSERT INTO catalog_events (kind, book_id, student_id)
+SELECT 'review', NEW.book_id, NEW.student_id FROM DUAL WHERE NEW.book_id IS NOT NULL""",
+)
+
+# One row per title with its copy counters, kept in step with books by
+# triggers inside the same transaction as every checkout and return,
+# and the FIFO queue of students waiting for a title. A title's category
+# is the category of its oldest copy (lowest book_id); CatalogCache
+# applies the same rule. The last statement counts the copies already
+# there.
+TITLE_CATEGORY_SQL = "(SELECT category FROM books WHERE title = {} ORDER BY book_id LIMIT 1)"
+
+SQLITE_HOLDINGS_DDL = (
+    """CREATE TABLE IF NOT EXISTS titles (
+    title_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title VARCHAR(200) NOT NULL UNIQUE,
+    category VARCHAR(50) DEFAULT NULL,
+    total_copies INTEGER NOT NULL DEFAULT 0,
+    available_copies INTEGER NOT NULL DEFAULT 0
+)""",
+    "CREATE INDEX IF NOT EXISTS idx_titles_available ON titles (available_copies, title)",
+    "CREATE INDEX IF NOT EXISTS idx_titles_category ON titles (category, title)",
+    """CREATE TABLE IF NOT EXISTS holds (
+    hold_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title_id INTEGER NOT NULL REFERENCES titles (title_id),
+    student_id INTEGER NOT NULL REFERENCES students (student_id),
+    created_at TIMESTAMP NOT NULL,
+    served_at TIMESTAMP DEFAULT NULL,
+    book_id INTEGER DEFAULT NULL
+)""",
+    "CREATE INDEX IF NOT EXISTS idx_holds_queue ON holds (title_id, served_at, hold_id)",
+    "CREATE INDEX IF NOT EXISTS idx_holds_student ON holds (student_id, served_at)",
+    "DROP TRIGGER IF EXISTS trg_titles_insert",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_titles_insert AFTER INSERT ON books BEGIN
+INSERT INTO titles (title, category, total_copies, available_copies)
+VALUES (NEW.title, NEW.category, 1, NEW.status IS 'available')
+ON CONFLICT (title) DO UPDATE SET total_copies = total_copies + 1,
+    available_copies = available_copies + excluded.available_copies,
+    category = {TITLE_CATEGORY_SQL.format('NEW.title')}; END""",
+    "DROP TRIGGER IF EXISTS trg_titles_status",
+    """CREATE TRIGGER IF NOT EXISTS trg_titles_status AFTER UPDATE OF status ON books
+WHEN OLD.title IS NEW.title AND OLD.status IS NOT NEW.status BEGIN
+UPDATE titles SET available_copies = available_copies
+    + (NEW.status IS 'available') - (OLD.status IS 'available')
+WHERE title = NEW.title; END""",
+    "DROP TRIGGER IF EXISTS trg_titles_rename",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_titles_rename AFTER UPDATE OF title ON books
+WHEN OLD.title IS NOT NEW.title BEGIN
+UPDATE titles SET total_copies = total_copies - 1,
+    available_copies = available_copies - (OLD.status IS 'available'),
+    category = {TITLE_CATEGORY_SQL.format('OLD.title')}
+WHERE title = OLD.title;
+INSERT INTO titles (title, category, total_copies, available_copies)
+VALUES (NEW.title, NEW.category, 1, NEW.status IS 'available')
+ON CONFLICT (title) DO UPDATE SET total_copies = total_copies + 1,
+    available_copies = available_copies + excluded.available_copies,
+    category = {TITLE_CATEGORY_SQL.format('NEW.title')}; END""",
+    "DROP TRIGGER IF EXISTS trg_titles_delete",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_titles_delete AFTER DELETE ON books BEGIN
+UPDATE titles SET total_copies = total_copies - 1,
+    available_copies = available_copies - (OLD.status IS 'available'),
+    category = {TITLE_CATEGORY_SQL.format('OLD.title')}
+WHERE title = OLD.title; END""",
+    "DROP TRIGGER IF EXISTS trg_titles_category",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_titles_category AFTER UPDATE OF category ON books
+WHEN OLD.title IS NEW.title AND OLD.category IS NOT NEW.category BEGIN
+UPDATE titles SET category = {TITLE_CATEGORY_SQL.format('NEW.title')}
+WHERE title = NEW.title; END""",
+    f"""INSERT INTO titles (title, category, total_copies, available_copies)
+SELECT b.title, {TITLE_CATEGORY_SQL.format('b.title')}, COUNT(*), SUM(b.status IS 'available')
+FROM books b WHERE true GROUP BY b.title
+ON CONFLICT (title) DO UPDATE SET category = excluded.category,
+    total_copies = excluded.total_copies, available_copies = excluded.available_copies""",
+)
+# Created on every start like the other tables; databases whose triggers
+# predate the category rule get them replaced, and the copies already
+# there counted, by the migration
+SQLITE_SCHEMA += "".join(f"{statement};\n" for statement in SQLITE_HOLDINGS_DDL[:-1]
+                         if not statement.startswith("DROP"))
+
+MYSQL_HOLDINGS_DDL = (
+    """CREATE TABLE IF NOT EXISTS titles (
+    title_id INT NOT NULL AUTO_INCREMENT,
+    title VARCHAR(200) NOT NULL,
+    category VARCHAR(50) DEFAULT NULL,
+    total_copies INT NOT NULL DEFAULT 0,
+    available_copies INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (title_id),
+    UNIQUE KEY uq_titles_title (title),
+    KEY idx_titles_available (available_copies, title),
+    KEY idx_titles_category (category, title)
+)""",
+    """CREATE TABLE IF NOT EXISTS holds (
+    hold_id INT NOT NULL AUTO_INCREMENT,
+    title_id INT NOT NULL,
+    student_id INT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    served_at TIMESTAMP NULL DEFAULT NULL,
+    book_id INT DEFAULT NULL,
+    PRIMARY KEY (hold_id),
+    KEY idx_holds_queue (title_id, served_at, hold_id),
+    KEY idx_holds_student (student_id, served_at),
+    FOREIGN KEY (title_id) REFERENCES titles (title_id),
+    FOREIGN KEY (student_id) REFERENCES students (student_id)
+)""",
+    "DROP TRIGGER IF EXISTS trg_titles_insert",
+    f"""CREATE TRIGGER trg_titles_insert AFTER INSERT ON books FOR EACH ROW
+INSERT INTO titles (title, category, total_copies, available_copies)
+VALUES (NEW.title, NEW.category, 1, NEW.status <=> 'available')
+ON DUPLICATE KEY UPDATE total_copies = total_copies + 1,
+    available_copies = available_copies + VALUES(available_copies),
+    category = {TITLE_CATEGORY_SQL.format('NEW.title')}""",
+    "DROP TRIGGER IF EXISTS trg_titles_update",
+    f"""CREATE TRIGGER trg_titles_update AFTER UPDATE ON books FOR EACH ROW
+BEGIN
+    IF OLD.title <=> NEW.title THEN
+        UPDATE titles SET available_copies = available_copies
+            + (NEW.status <=> 'available') - (OLD.status <=> 'available')
+        WHERE title = NEW.title AND NOT (OLD.status <=> NEW.status);
+        UPDATE titles SET category = {TITLE_CATEGORY_SQL.format('NEW.title')}
+        WHERE title = NEW.title AND NOT (OLD.category <=> NEW.category);
+    ELSE
+        UPDATE titles SET total_copies = total_copies - 1,
+            available_copies = available_copies - (OLD.status <=> 'available'),
+            category = {TITLE_CATEGORY_SQL.format('OLD.title')}
+        WHERE title = OLD.title;
+        INSERT INTO titles (title, category, total_copies, available_copies)
+        VALUES (NEW.title, NEW.category, 1, NEW.status <=> 'available')
+        ON DUPLICATE KEY UPDATE total_copies = total_copies + 1,
+            available_copies = available_copies + VALUES(available_copies),
+            category = {TITLE_CATEGORY_SQL.format('NEW.title')};
+    END IF;
+END""",
+    "DROP TRIGGER IF EXISTS trg_titles_delete",
+    f"""CREATE TRIGGER trg_titles_delete AFTER DELETE ON books FOR EACH ROW
+UPDATE titles SET total_copies = total_copies - 1,
+    available_copies = available_copies - (OLD.status <=> 'available'),
+    category = {TITLE_CATEGORY_SQL.format('OLD.title')}
+WHERE title = OLD.title""",
+    f"""INSERT INTO titles (title, category, total_copies, available_copies)
+SELECT b.title, {TITLE_CATEGORY_SQL.format('b.title')}, COUNT(*), SUM(b.status <=> 'available')
+FROM books b GROUP BY b.title
+ON DUPLICATE KEY UPDATE category = VALUES(category),
+    total_copies = VALUES(total_copies), available_copies = VALUES(available_copies)""",
+)
+
+# What SQLITE_SCHEMA and the SQLite start-up create, for MySQL
+# databases imported from an older library_management.sql. Triggers
+# are dropped first so running a step twice is harmless.
+MYSQL_CHANGES_DDL = (
+    """CREATE TABLE IF NOT EXISTS catalog_changes (
+    change_id BIGINT NOT NULL AUTO_INCREMENT,
+    book_id INT NOT NULL,
+    PRIMARY KEY (change_id)
+)""",
+    "DROP TRIGGER IF EXISTS trg_books_insert",
+    """CREATE TRIGGER trg_books_insert AFTER INSERT ON books FOR EACH ROW
+INSERT INTO catalog_changes (book_id) VALUES (NEW.book_id)""",
+    "DROP TRIGGER IF EXISTS trg_books_update",
+    """CREATE TRIGGER trg_books_update AFTER UPDATE ON books FOR EACH ROW
+INSERT INTO catalog_changes (book_id) VALUES (NEW.book_id)""",
+    "DROP TRIGGER IF EXISTS trg_books_delete",
+    """CREATE TRIGGER trg_books_delete AFTER DELETE ON books FOR EACH ROW
+INSERT INTO catalog_changes (book_id) VALUES (OLD.book_id)""",
+)
+
+MYSQL_IMPORT_DDL = (
+    """CREATE TABLE IF NOT EXISTS import_checkpoints (
+    source VARCHAR(255) NOT NULL,
+    rows_done BIGINT NOT NULL,
+    PRIMARY KEY (source)
+)""",
+)
+
+MYSQL_FINES_DDL = (
+    """CREATE TABLE IF NOT EXISTS loan_changes (
+    change_id BIGINT NOT NULL AUTO_INCREMENT,
+    transaction_id INT NOT NULL,
+    PRIMARY KEY (change_id)
+)""",
+    "DROP TRIGGER IF EXISTS trg_transactions_insert",
+    """CREATE TRIGGER trg_transactions_insert AFTER INSERT ON transactions FOR EACH ROW
+INSERT INTO loan_changes (transaction_id) VALUES (NEW.transaction_id)""",
+    "DROP TRIGGER IF EXISTS trg_transactions_update",
+    """CREATE TRIGGER trg_transactions_update AFTER UPDATE ON transactions FOR EACH ROW
+INSERT INTO loan_changes (transaction_id) VALUES (NEW.transaction_id)""",
+    """CREATE TABLE IF NOT EXISTS loan_fines (
+    transaction_id INT NOT NULL,
+    student_id INT DEFAULT NULL,
+    book_id INT DEFAULT NULL,
+    due_date TIMESTAMP NOT NULL,
+    days_overdue INT NOT NULL,
+    fine DECIMAL(10,2) NOT NULL,
+    accruing TINYINT NOT NULL,
+    as_of TIMESTAMP NOT NULL,
+    PRIMARY KEY (transaction_id),
+    KEY idx_fines_student (student_id),
+    KEY idx_fines_overdue (days_overdue),
+    KEY idx_fines_accruing (accruing, due_date)
+)""",
+    """CREATE TABLE IF NOT EXISTS fine_runs (
+    run_id INT NOT NULL AUTO_INCREMENT,
+    last_change BIGINT NOT NULL,
+    policy VARCHAR(100) NOT NULL,
+    as_of TIMESTAMP NOT NULL,
+    loans INT NOT NULL,
+    PRIMARY KEY (run_id)
+)""",
+)
+
+# The backfill recomputes every book's counts, so it is exact even
+# when the table was already there.
+MYSQL_REVIEW_STATS_DDL = (
+    """CREATE TABLE IF NOT EXISTS review_stats (
+    book_id INT NOT NULL,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_1 INT NOT NULL DEFAULT 0,
+    rating_2 INT NOT NULL DEFAULT 0,
+    rating_3 INT NOT NULL DEFAULT 0,
+    rating_4 INT NOT NULL DEFAULT 0,
+    rating_5 INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id)
+)""",
+    "DROP TRIGGER IF EXISTS trg_reviews_stats",
+    """CREATE TRIGGER trg_reviews_stats AFTER INSERT ON reviews FOR EACH ROW
+INSERT INTO review_stats (book_id, review_count, rating_sum,
+                          rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT NEW.book_id, 1, COALESCE(NEW.rating, 0), NEW.rating <=> 1, NEW.rating <=> 2,
+       NEW.rating <=> 3, NEW.rating <=> 4, NEW.rating <=> 5
+FROM DUAL WHERE NEW.book_id IS NOT NULL
+ON DUPLICATE KEY UPDATE
+    review_count = review_count + 1,
+    rating_sum = rating_sum + VALUES(rating_sum),
+    rating_1 = rating_1 + VALUES(rating_1),
+    rating_2 = rating_2 + VALUES(rating_2),
+    rating_3 = rating_3 + VALUES(rating_3),
+    rating_4 = rating_4 + VALUES(rating_4),
+    rating_5 = rating_5 + VALUES(rating_5)""",
+    """INSERT INTO review_stats (book_id, review_count, rating_sum,
+                          rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT book_id, COUNT(*), COALESCE(SUM(rating), 0), SUM(rating <=> 1), SUM(rating <=> 2),
+       SUM(rating <=> 3), SUM(rating <=> 4), SUM(rating <=> 5)
+FROM reviews WHERE book_id IS NOT NULL GROUP BY book_id
+ON DUPLICATE KEY UPDATE review_count = VALUES(review_count),
+    rating_sum = VALUES(rating_sum),
+    rating_1 = VALUES(rating_1), rating_2 = VALUES(rating_2), rating_3 = VALUES(rating_3),
+    rating_4 = VALUES(rating_4), rating_5 = VALUES(rating_5)""",
+)
+
+# Closed loans moved out of transactions by archive.py, so the loan
+# queries only ever see open and recently returned loans. Same columns
+# and keys; transaction_id keeps its original value.
+SQLITE_ARCHIVE_DDL = (
+    """CREATE TABLE IF NOT EXISTS transactions_archive (
+    transaction_id INTEGER PRIMARY KEY,
+    book_id INTEGER REFERENCES books (book_id),
+    student_id INTEGER REFERENCES students (student_id),
+    issued_date TIMESTAMP DEFAULT NULL,
+    due_date TIMESTAMP DEFAULT NULL,
+    return_date TIMESTAMP DEFAULT NULL,
+    penalty_amount DECIMAL(10,2) DEFAULT 0.00
+)""",
+    """CREATE INDEX IF NOT EXISTS idx_archive_student_issued
+ON transactions_archive (student_id, issued_date, transaction_id)""",
+)
+SQLITE_SCHEMA += "".join(f"{statement};\n" for statement in SQLITE_ARCHIVE_DDL)
+
+MYSQL_ARCHIVE_DDL = (
+    """CREATE TABLE IF NOT EXISTS transactions_archive (
+    transaction_id INT NOT NULL,
+    book_id INT DEFAULT NULL,
+    student_id INT DEFAULT NULL,
+    issued_date TIMESTAMP NULL DEFAULT NULL,
+    due_date TIMESTAMP NULL DEFAULT NULL,
+    return_date TIMESTAMP NULL DEFAULT NULL,
+    penalty_amount DECIMAL(10,2) DEFAULT 0.00,
+    PRIMARY KEY (transaction_id),
+    KEY idx_archive_student_issued (student_id, issued_date, transaction_id),
+    KEY idx_archive_book (book_id),
+    FOREIGN KEY (book_id) REFERENCES books (book_id),
+    FOREIGN KEY (student_id) REFERENCES students (student_id)
+)""",
+)
+
+# External-content FTS5 index over books, kept in sync by triggers.
+SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE books_fts USING fts5(
+    title, category, content='books', content_rowid='book_id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER trg_books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, category)
+    VALUES (NEW.book_id, NEW.title, NEW.category);
+END;
+CREATE TRIGGER trg_books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, category)
+    VALUES ('delete', OLD.book_id, OLD.title, OLD.category);
+END;
+CREATE TRIGGER trg_books_fts_update AFTER UPDATE OF title, category ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, category)
+    VALUES ('delete', OLD.book_id, OLD.title, OLD.category);
+    INSERT INTO books_fts (rowid, title, category)
+    VALUES (NEW.book_id, NEW.title, NEW.category);
+END;
+INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+"""
+
+# Per-book rating aggregates, kept in step with reviews by a trigger
+# and backfilled from existing reviews when first created.
+SQLITE_REVIEW_STATS_SCHEMA = """
+CREATE TABLE review_stats (
+    book_id INTEGER PRIMARY KEY,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER trg_reviews_stats AFTER INSERT ON reviews WHEN NEW.book_id IS NOT NULL BEGIN
+    INSERT INTO review_stats (book_id, review_count, rating_sum,
+                              rating_1, rating_2, rating_3, rating_4, rating_5)
+    VALUES (NEW.book_id, 1, COALESCE(NEW.rating, 0), NEW.rating IS 1, NEW.rating IS 2,
+            NEW.rating IS 3, NEW.rating IS 4, NEW.rating IS 5)
+    ON CONFLICT (book_id) DO UPDATE SET
+        review_count = review_count + 1,
+        rating_sum = rating_sum + excluded.rating_sum,
+        rating_1 = rating_1 + excluded.rating_1,
+        rating_2 = rating_2 + excluded.rating_2,
+        rating_3 = rating_3 + excluded.rating_3,
+        rating_4 = rating_4 + excluded.rating_4,
+        rating_5 = rating_5 + excluded.rating_5;
+END;
+INSERT INTO review_stats (book_id, review_count, rating_sum,
+                          rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT book_id, COUNT(*), COALESCE(SUM(rating), 0), SUM(rating IS 1), SUM(rating IS 2),
+       SUM(rating IS 3), SUM(rating IS 4), SUM(rating IS 5)
+FROM reviews WHERE book_id IS NOT NULL GROUP BY book_id;
+"""
+
+# Store datetimes the way datetime('now') does and read TIMESTAMP
+# columns back as datetime, matching what mysql.connector returns.
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode()))
+
+
+class StorageError(Exception):
+    """Raised by a repository for any database failure."""
+
+
+class FinePolicy:
+    """Late fines: `rate` per day overdue after `grace_days`, capped at `max_fine`."""
+
+    __slots__ = ('rate', 'grace_days', 'max_fine')
+
+    def __init__(self, rate=PENALTY_PER_DAY, grace_days=FINE_GRACE_DAYS, max_fine=FINE_CAP):
+        self.rate = rate
+        self.grace_days = grace_days
+        self.max_fine = max_fine
+
+    @staticmethod
+    def days_late(due_date, as_of):
+        """Whole days `as_of` is past `due_date`, negative before it is due.
+
+        The fines engine counts days overdue the same way, in bulk.
+        """
+        return (as_of - due_date) // timedelta(days=1)
+
+    def fine(self, days_overdue):
+        fine = max(0, days_overdue - self.grace_days) * self.rate
+        return fine if self.max_fine is None else min(fine, self.max_fine)
+
+    def key(self):
+        """Identifies the policy, so the fines engine notices when it changes."""
+        return f"rate={self.rate:g} grace={self.grace_days} cap={self.max_fine}"
+
+
+def _import_driver():
+    """Import mysql.connector. Returns False if it is not installed."""
+    global mysql, pooling
+    if pooling is None:
+        try:
+            import mysql.connector
+            from mysql.connector import pooling
+        except ImportError:  # the SQLite backend works without the driver
+            return False
+    return True
+
+
+def check_columns(table, columns):
+    """Raise StorageError unless `columns` all belong to `table`."""
+    if table not in TABLE_COLUMNS:
+        raise StorageError(f"Unknown table: {table}")
+    unknown = set(columns) - set(TABLE_COLUMNS[table])
+    if unknown:
+        raise StorageError(f"Unknown columns for {table}: {', '.join(sorted(unknown))}")
+
+
+def search_tokens(term):
+    """Lower-cased words of a search term."""
+    return re.findall(r"\w+", term.lower())
+
+
+class LibraryRepository(ABC):
+    """Every query the library application issues."""
+
+    @abstractmethod
+    def login(self, name, email):
+        """Return the student for `email`, registering them if new."""
+
+    @abstractmethod
+    def available_books(self):
+        """Rows with title, category, available and copies for titles with a copy free."""
+
+    @abstractmethod
+    def all_titles(self):
+        """Every book title, sorted."""
+
+    @abstractmethod
+    def checkout(self, student_id, book_id):
+        """Issue `book_id` if it is still available. Returns True on success.
+
+        While students wait for the title, the copy goes to the first of
+        them instead, so this is False unless that is `student_id`.
+        """
+
+    @abstractmethod
+    def checkin(self, student_id, book_id):
+        """Close the student's open loan of `book_id`.
+
+        Returns the late penalty, or None if there is no such loan.
+        """
+
+    @abstractmethod
+    def checkout_many(self, student_id, book_ids):
+        """Issue a cart of books in one transaction.
+
+        Returns (book_id, issued) pairs in cart order.
+        """
+
+    @abstractmethod
+    def checkin_many(self, book_ids, student_id=None):
+        """Close the open loans of a cart of books in one transaction.
+
+        With `student_id`, only that student's loans are closed. Returns
+        (book_id, penalty) pairs in cart order; penalty is None for a
+        book that had no open loan.
+        """
+
+    @abstractmethod
+    def borrow(self, student_id, title):
+        """Issue an available copy of `title`.
+
+        Returns the issued book_id, or None if no copy is free.
+        """
+
+    @abstractmethod
+    def place_hold(self, student_id, title):
+        """Queue the student for the next returned copy of `title`.
+
+        Returns the student's place in the queue, None if there is no
+        such title, or 0 if a copy is free to borrow now. A student
+        already waiting keeps their place.
+        """
+
+    @abstractmethod
+    def cancel_hold(self, student_id, hold_id):
+        """Leave a holds queue. Returns False if the hold is not waiting."""
+
+    @abstractmethod
+    def holds(self, student_id):
+        """Rows with hold_id, title, created_at and position for waiting holds."""
+
+    @abstractmethod
+    def open_loans(self, student_id):
+        """Rows with book_id, title, issued_date, due_date and fine for unreturned books.
+
+        `fine` is the fine accrued as of the last fines run.
+        """
+
+    @abstractmethod
+    def overdue_loans(self, limit=100):
+        """The most overdue open loans from the fines ledger, worst first."""
+
+    @abstractmethod
+    def return_book(self, student_id, title):
+        """Close the student's loan of `title`.
+
+        Returns (book_id, penalty), or None if the student has no open
+        loan for that title.
+        """
+
+    @abstractmethod
+    def transaction_history(self, student_id):
+        """All of the student's loans, archived ones included, newest first."""
+
+    @abstractmethod
+    def history_page(self, student_id, after=None, before=None, limit=HISTORY_PAGE_SIZE):
+        """One page of transaction_history, newest first.
+
+        `after` and `before` are (issued_date, transaction_id) keys of
+        the row the page continues from; rows carry both columns.
+        """
+
+    @abstractmethod
+    def search(self, term, limit=SEARCH_PAGE_SIZE, offset=0):
+        """One page of books matching `term`, best match first.
+
+        Every word of `term` must match a word of the title or category,
+        and the last one may be a prefix. When no book matches that way,
+        the books whose words are a typo away are returned instead.
+        """
+
+    @abstractmethod
+    def categories(self):
+        """Distinct categories, sorted."""
+
+    @abstractmethod
+    def books_in_category(self, category):
+        """Rows with title, available and copies for the titles of one category."""
+
+    @abstractmethod
+    def reviews_for(self, title):
+        """Reviews of `title` with reviewer name, newest first."""
+
+    @abstractmethod
+    def review_summary(self, title):
+        """Rating aggregates of `title`: count, average and histogram.
+
+        `histogram` lists the number of 1 to 5 star ratings.
+        """
+
+    @abstractmethod
+    def review_page(self, title, after=None, limit=REVIEW_PAGE_SIZE):
+        """One page of reviews_for(title), newest first.
+
+        `after` is the (created_at, review_id) key of the last row of
+        the previous page; rows carry both columns.
+        """
+
+    @abstractmethod
+    def add_review(self, student_id, title, text, rating, book_id=None):
+        """Store a review of `book_id`, or else of a copy of `title`.
+
+        Returns False if the book does not exist.
+        """
+
+    @abstractmethod
+    def catalog_version(self):
+        """Id of the latest catalog change, 0 if there is none."""
+
+    @abstractmethod
+    def catalog_books(self):
+        """(version, rows) with book_id, title, category and status of every book."""
+
+    @abstractmethod
+    def catalog_changes(self, since):
+        """(version, rows) for books changed after version `since`.
+
+        A deleted book comes back with title, category and status None.
+        """
+
+    @abstractmethod
+    def events_version(self):
+        """Id of the latest catalog event, 0 if there is none."""
+
+    @abstractmethod
+    def catalog_events(self, since, limit=EVENT_BATCH):
+        """(version, rows) for up to `limit` events after version `since`.
+
+        Rows have event_id, kind ('book', 'loan', 'return' or 'review'),
+        book_id, student_id and transaction_id, with the book's current
+        title, category and status and the loan's current issued_date,
+        due_date and return_date. Fields of deleted rows come back None.
+        """
+
+    @abstractmethod
+    def bulk_insert(self, table, columns, rows, checkpoint=None):
+        """Insert `rows` (tuples in `columns` order) in one transaction.
+
+        `checkpoint` is an optional (source, rows_done) pair recorded in
+        the same transaction, so a resumed import never repeats rows.
+        """
+
+    @abstractmethod
+    def import_checkpoint(self, source):
+        """Rows of `source` already imported, 0 if none."""
+
+    @abstractmethod
+    def clear_import_checkpoint(self, source):
+        """Forget the checkpoint of a finished import."""
+
+    @abstractmethod
+    def stream_table(self, table, chunk_size=STREAM_CHUNK, after=None):
+        """Yield every row of `table` as a dict, in primary key order.
+
+        Rows are read through an unbuffered cursor, `chunk_size` at a
+        time, so memory use does not depend on the table size. With
+        `after`, only rows whose primary key is greater are read.
+        """
+
+    def load_data_file(self, table, columns, path):
+        """Bulk load a CSV file server side. Returns the rows loaded."""
+        raise StorageError("LOAD DATA is not supported by this backend")
+
+    # The fines engine (fines.py) works against the database directly.
+
+    def fines_state(self):
+        """{'last_change', 'policy'} of the last fines run, or None."""
+        raise StorageError("The fines engine needs a database backend")
+
+    def loan_version(self):
+        """Id of the latest loan change, 0 if there is none."""
+        raise StorageError("The fines engine needs a database backend")
+
+    def loan_changes(self, since):
+        """(version, rows) for transactions changed after loan version `since`.
+
+        Rows have the TABLE_COLUMNS of transactions; a deleted
+        transaction comes back with everything but transaction_id None.
+        """
+        raise StorageError("Loan changes need a database backend")
+
+    def fine_candidates(self, since=None, overdue_before=None, chunk_size=STREAM_CHUNK,
+                        after=None, limit=None):
+        """Yield the loans whose fine may have changed, by transaction_id.
+
+        With `since` None, every open loan. Otherwise the loans changed
+        after loan version `since`, plus ledger loans still accruing
+        that were due before `overdue_before`. `after` and `limit` page
+        through them by transaction_id.
+        """
+        raise StorageError("The fines engine needs a database backend")
+
+    def clear_fines(self):
+        raise StorageError("The fines engine needs a database backend")
+
+    def write_fines(self, rows, closed=()):
+        """Replace ledger rows and drop the loans in `closed`, in one transaction.
+
+        `rows` are (transaction_id, student_id, book_id, due_date,
+        days_overdue, fine, accruing, as_of) tuples.
+        """
+        raise StorageError("The fines engine needs a database backend")
+
+    def finish_fines_run(self, last_change, policy, as_of, loans):
+        raise StorageError("The fines engine needs a database backend")
+
+    # The archiver (archive.py) moves closed loans out of transactions.
+
+    def archive_loans(self, returned_before, limit=ARCHIVE_BATCH):
+        """Move up to `limit` loans returned before `returned_before` to the archive.
+
+        Runs in one transaction. Returns the number of loans moved.
+        """
+        raise StorageError("Archiving needs a database backend")
+
+    def archive_status(self):
+        """{'loans', 'open_loans', 'oldest_return', 'archived'}: rows in each loan table."""
+        raise StorageError("Archiving needs a database backend")
+
+    # Reports (reports.py) stream the whole history.
+
+    def circulation(self, since=None, until=None, chunk_size=STREAM_CHUNK):
+        """Yield every loan, archived or not, issued in [since, until) with its book's title and category."""
+        raise StorageError("Reports need a database backend")
+
+    def review_activity(self, since=None, until=None, chunk_size=STREAM_CHUNK):
+        """Yield student_id, name, title and rating of every review written in [since, until)."""
+        raise StorageError("Reports need a database backend")
+
+    @abstractmethod
+    def close(self):
+        """Release every connection held by the repository."""
+
+
+class _Session:
+    """A borrowed connection and cursor that returns rows as dicts."""
+
+    def __init__(self, conn, cursor, qmark=False, slow=None):
+        self.conn = conn
+        self.cursor = cursor
+        self._qmark = qmark
+        # Slow statements as (sql, params, seconds, operation), explained
+        # when the connection is given back
+        self.slow = [] if slow is None else slow
+        self._query = None  # [sql, params, seconds, rows] of the statement being read
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if query is not None:
+            sql, params, seconds, rows = query
+            if INSTRUMENTS.query(statement_label(sql), seconds, rows):
+                self.slow.append((sql, params, seconds, operation.get()))
+
+    def _run(self, method, sql, params):
+        if self._qmark:
+            sql = sql.replace("%s", "?")
+        self._finish()
+        start = time.perf_counter()
+        try:
+            method(sql, params)
+        except Exception:
+            INSTRUMENTS.query(statement_label(sql), time.perf_counter() - start, failed=True)
+            raise
+        self._query = [sql, params, time.perf_counter() - start, 0]
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self.cursor.execute, sql, tuple(params))
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self._run(self.cursor.executemany, sql, seq_of_params)
+        # Only the first row's parameters are kept for the slow log
+        self._query[1] = seq_of_params[0] if seq_of_params else ()
+        return self
+
+    def close(self):
+        self._finish()
+
+    def _fetched(self, start, rows):
+        if self._query is not None:
+            self._query[2] += time.perf_counter() - start
+            self._query[3] += rows
+
+    def _columns(self):
+        return [col[0] for col in self.cursor.description]
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self._fetched(start, row is not None)
+        if row is None:
+            return None
+        return dict(zip(self._columns(), row))
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self._fetched(start, len(rows))
+        columns = self._columns()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def fetchmany(self, size):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(size)
+        self._fetched(start, len(rows))
+        columns = self._columns()
+        return [dict(zip(columns, row)) for row in rows]
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+class SQLRepository(LibraryRepository):
+    """Shared SQL for both backends.
+
+    Subclasses provide connections through `_acquire` / `_release`, open
+    transactions with `_begin` and list their driver exception types in
+    `_driver_errors`. Queries are written with %s placeholders.
+    """
+
+    _driver_errors = ()
+    _qmark = False
+    _for_update = ""  # row-lock suffix for SELECTs inside a transaction
+    _penalty_sql = None  # fine from due_date, given return date, grace days and rate
+    _cap_sql = None  # caps the fine expression at a parameter
+    _explain_sql = "EXPLAIN "
+    _events_ddl = ()  # creates catalog_events and its triggers
+    _holdings_ddl = ()  # creates titles and holds, and counts the copies
+    _archive_ddl = ()  # creates transactions_archive
+    # SQLite creates these with SQLITE_SCHEMA on every start
+    _changes_ddl = ()  # creates catalog_changes and its triggers
+    _imports_ddl = ()  # creates import_checkpoints
+    _fines_ddl = ()  # creates loan_changes, its triggers, loan_fines and fine_runs
+    _review_stats_ddl = ()  # creates review_stats, its trigger, and counts the reviews
+    fine_policy = FinePolicy()
+    _typo_catalog = None  # CatalogCache for typo-tolerant search, loaded on first use
+    _typo_lock = threading.Lock()
+
+    @abstractmethod
+    def _acquire(self):
+        """Return (connection, cursor) from the pool."""
+
+    @abstractmethod
+    def _release(self, conn, cursor):
+        """Give a connection back to the pool."""
+
+    @abstractmethod
+    def _begin(self, conn):
+        """Start a transaction on `conn`."""
+
+    @contextmanager
+    def _session(self):
+        try:
+            conn, cursor = self._acquire()
+        except self._driver_errors as e:
+            raise StorageError(str(e)) from e
+        try:
+            session = _Session(conn, cursor, self._qmark)
+            try:
+                yield session
+            finally:
+                session.close()
+                if session.slow:
+                    self._log_slow(conn, session.slow)
+        except self._driver_errors as e:
+            raise StorageError(str(e)) from e
+        finally:
+            self._release(conn, cursor)
+
+    def _log_slow(self, conn, slow):
+        """Write slow statements to the slow-query log with their plans."""
+        for sql, params, seconds, op in slow:
+            plan = None
+            if sql.lstrip()[:6].upper() in ("SELECT", "WITH", "UPDATE", "DELETE"):
+                cursor = self._plain_cursor(conn)
+                try:
+                    cursor.execute(self._explain_sql + sql, params)
+                    plan = [list(row) for row in cursor.fetchall()]
+                except self._driver_errors as e:
+                    plan = f"EXPLAIN failed: {e}"
+                finally:
+                    cursor.close()
+            INSTRUMENTS.log_slow(sql, params, seconds, plan, op)
+
+    def _plain_cursor(self, conn):
+        """Cursor for bulk work: unbuffered and not prepared."""
+        return conn.cursor()
+
+    def full_scans(self, plan):
+        """Tables a MySQL EXPLAIN plan reads in full with no usable index.
+
+        Small tables are often scanned even when an index would do, so
+        only scans without any candidate key count.
+        """
+        return [row[2] for row in plan
+                if row[4] == 'ALL' and row[5] is None and not str(row[2]).startswith('<')]
+
+    def schema_version(self):
+        with self._session() as session:
+            session.execute(SCHEMA_VERSION_SQL)
+            return self._schema_version(session)
+
+    @staticmethod
+    def _schema_version(session):
+        return session.execute(
+            "SELECT COALESCE(MAX(version), 0) AS version FROM schema_version"
+        ).fetchone()['version']
+
+    @contextmanager
+    def _migration_lock(self, session):
+        """Keep other processes from migrating at the same time."""
+        yield
+
+    def migrate(self, log=None):
+        """Apply the pending MIGRATIONS. Returns the versions applied."""
+        applied = []
+        with self._session() as session, self._migration_lock(session):
+            session.execute(SCHEMA_VERSION_SQL)
+            for version, description, steps in MIGRATIONS:
+                if version <= self._schema_version(session):
+                    continue
+                self._begin(session.conn)
+                try:
+                    # Checked again under the lock: another process may
+                    # have got there first
+                    if version <= self._schema_version(session):
+                        session.conn.rollback()
+                        continue
+                    for step in steps:
+                        if isinstance(step, str):
+                            getattr(self, step)(session)
+                        elif len(step) == 2:
+                            self._drop_index(session, *step)
+                        else:
+                            self._create_index(session, *step)
+                    session.execute(
+                        "INSERT INTO schema_version (version, description, applied_at)"
+                        " VALUES (%s, %s, %s)",
+                        (version, description, datetime.now().replace(microsecond=0))
+                    )
+                except BaseException:
+                    session.conn.rollback()
+                    raise
+                session.conn.commit()
+                applied.append(version)
+                if log:
+                    log(f"schema version {version}: {description}")
+        return applied
+
+    def _create_index(self, session, table, name, columns, unique):
+        session.execute("CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format(
+            "UNIQUE " if unique else "", name, table, ", ".join(columns)))
+
+    def _drop_index(self, session, table, name):
+        session.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def _table_exists(self, session, table):
+        return session.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (table,)
+        ).fetchone() is not None
+
+    def _run_ddl(self, session, statements):
+        for statement in statements:
+            session.execute(statement)
+
+    def _create_catalog_events(self, session):
+        self._run_ddl(session, self._events_ddl)
+
+    def _create_holdings(self, session):
+        self._run_ddl(session, self._holdings_ddl)
+
+    def _create_archive(self, session):
+        self._run_ddl(session, self._archive_ddl)
+
+    def _create_change_log(self, session):
+        self._run_ddl(session, self._changes_ddl)
+
+    def _create_fulltext(self, session):
+        """Full-text index for search; SQLite builds books_fts on start instead."""
+
+    def _create_import_checkpoints(self, session):
+        self._run_ddl(session, self._imports_ddl)
+
+    def _create_fines_ledger(self, session):
+        self._run_ddl(session, self._fines_ddl)
+
+    def _create_review_aggregates(self, session):
+        self._run_ddl(session, self._review_stats_ddl)
+
+    def _merge_duplicate_students(self, session):
+        """Fold students sharing an email into the oldest record.
+
+        Runs as the first migration, so tables added by later ones may
+        not exist yet.
+        """
+        duplicates = session.execute("""
+            SELECT s.student_id, MIN(k.student_id) AS keep
+            FROM students s
+            JOIN students k ON k.email = s.email AND k.student_id < s.student_id
+            GROUP BY s.student_id
+            """).fetchall()
+        if not duplicates:
+            return
+        pairs = [(row['keep'], row['student_id']) for row in duplicates]
+        for table in STUDENT_TABLES:
+            if self._table_exists(session, table):
+                session.executemany(
+                    f"UPDATE {table} SET student_id = %s WHERE student_id = %s", pairs)
+        if self._table_exists(session, 'holds'):
+            # A merged student keeps only their first place in each queue
+            repeats = session.execute("""
+                SELECT DISTINCT h.hold_id
+                FROM holds h
+                JOIN holds k ON k.student_id = h.student_id AND k.title_id = h.title_id
+                    AND k.hold_id < h.hold_id AND k.served_at IS NULL
+                WHERE h.served_at IS NULL
+                """).fetchall()
+            session.executemany(
+                "DELETE FROM holds WHERE hold_id = %s", [(row['hold_id'],) for row in repeats])
+        session.executemany(
+            "DELETE FROM students WHERE student_id = %s", [(old,) for _, old in pairs])
+
+    @contextmanager
+    def _bulk(self, session):
+        cursor = self._plain_cursor(session.conn)
+        bulk = _Session(session.conn, cursor, self._qmark, slow=session.slow)
+        try:
+            yield bulk
+        finally:
+            bulk.close()
+            cursor.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._session() as session:
+            self._begin(session.conn)
+            try:
+                yield session
+            except BaseException:
+                session.conn.rollback()
+                raise
+            session.conn.commit()
+
+    def _fetchall(self, sql, params=()):
+        with self._session() as session:
+            return session.execute(sql, params).fetchall()
+
+    def _stream(self, sql, params, chunk_size):
+        """Yield rows through an unbuffered cursor, `chunk_size` at a time."""
+        with self._session() as session, self._bulk(session) as bulk:
+            bulk.execute(sql, params)
+            while True:
+                rows = bulk.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def _retryable(self, error):
+        """True if `error` is a deadlock or lock timeout worth retrying."""
+        return False
+
+    def _with_retry(self, operation):
+        """Run `operation`, retrying deadlocks with jittered exponential backoff."""
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                return operation()
+            except StorageError as e:
+                if attempt + 1 == RETRY_ATTEMPTS or not self._retryable(e.__cause__):
+                    raise
+            time.sleep(RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def login(self, name, email):
+        with self._transaction() as session:
+            # Check if student exists or create new
+            student = session.execute(
+                "SELECT student_id, name FROM students WHERE email = %s", (email,)
+            ).fetchone()
+            if not student:
+                session.execute(
+                    "INSERT INTO students (name, email) VALUES (%s, %s)",
+                    (name, email)
+                )
+                student_id = session.lastrowid
+            else:
+                student_id = student['student_id']
+        return {'id': student_id, 'name': name, 'email': email}
+
+    def available_books(self):
+        return self._fetchall("""
+            SELECT title, category, available_copies AS available, total_copies AS copies
+            FROM titles
+            WHERE available_copies > 0
+            ORDER BY title
+            """)
+
+    def all_titles(self):
+        rows = self._fetchall("SELECT title FROM books ORDER BY title")
+        return [row['title'] for row in rows]
+
+    def checkout(self, student_id, book_id):
+        due_date = datetime.now() + timedelta(days=LOAN_DAYS)
+        return self._with_retry(lambda: self._checkout(student_id, book_id, due_date))
+
+    def _checkout(self, student_id, book_id, due_date):
+        with self._transaction() as session:
+            # A free copy of a title students are waiting for goes to
+            # the first of them, as it would have on return
+            served = self._serve_holds(session, [book_id], due_date - timedelta(days=LOAN_DAYS))
+            if served:
+                return served[book_id] == student_id
+            # The status check and the update are one statement, so two
+            # desks can never both issue the same copy.
+            session.execute(
+                "UPDATE books SET status = 'issued' WHERE book_id = %s AND status = 'available'",
+                (book_id,)
+            )
+            if session.rowcount != 1:
+                return False
+            session.execute(
+                """INSERT INTO transactions
+                   (book_id, student_id, due_date)
+                   VALUES (%s, %s, %s)""",
+                (book_id, student_id, due_date)
+            )
+        return True
+
+    def checkin(self, student_id, book_id):
+        return_date = datetime.now()
+        return self._with_retry(lambda: self._checkin(student_id, book_id, return_date))
+
+    def _checkin(self, student_id, book_id, return_date):
+        with self._transaction() as session:
+            loan = session.execute("""
+                SELECT transaction_id, due_date
+                FROM transactions
+                WHERE book_id = %s AND student_id = %s AND return_date IS NULL
+                """, (book_id, student_id)).fetchone()
+            if not loan:
+                return None
+
+            days_late = max(0, (return_date - loan['due_date']).days)
+            penalty = self.fine_policy.fine(days_late)
+            session.execute("""
+                UPDATE transactions
+                SET return_date = %s, penalty_amount = %s
+                WHERE transaction_id = %s AND return_date IS NULL
+                """, (return_date, penalty, loan['transaction_id']))
+            if session.rowcount != 1:
+                return None
+            session.execute(
+                "UPDATE books SET status = 'available' WHERE book_id = %s",
+                (book_id,)
+            )
+            self._serve_holds(session, [book_id], return_date)
+        return penalty
+
+    def _serve_holds(self, session, book_ids, served_at):
+        """Lend free copies to the students first in their titles' queues.
+
+        Returns {book_id: student_id} for the copies lent.
+        """
+        marks = ", ".join(["%s"] * len(book_ids))
+        copies = session.execute(f"""
+            SELECT b.book_id, ti.title_id
+            FROM books b
+            JOIN titles ti ON ti.title = b.title
+            WHERE b.book_id IN ({marks})
+            """, book_ids).fetchall()
+        if not copies:
+            return {}
+        title_ids = sorted({row['title_id'] for row in copies})
+        marks = ", ".join(["%s"] * len(title_ids))
+        waiting = {}
+        for hold in session.execute(f"""
+                SELECT hold_id, title_id, student_id FROM holds
+                WHERE title_id IN ({marks}) AND served_at IS NULL
+                ORDER BY hold_id""" + self._for_update, title_ids).fetchall():
+            waiting.setdefault(hold['title_id'], []).append(hold)
+        if not waiting:
+            return {}
+        due_date = served_at + timedelta(days=LOAN_DAYS)
+        served = {}
+        for copy in copies:
+            queued = waiting.get(copy['title_id'])
+            if not queued:
+                continue
+            hold = queued.pop(0)
+            session.execute(
+                "UPDATE books SET status = 'issued' WHERE book_id = %s AND status = 'available'",
+                (copy['book_id'],)
+            )
+            if session.rowcount != 1:
+                continue
+            session.execute(
+                "INSERT INTO transactions (book_id, student_id, due_date) VALUES (%s, %s, %s)",
+                (copy['book_id'], hold['student_id'], due_date)
+            )
+            session.execute(
+                "UPDATE holds SET served_at = %s, book_id = %s WHERE hold_id = %s",
+                (served_at, copy['book_id'], hold['hold_id'])
+            )
+            served[copy['book_id']] = hold['student_id']
+        return served
+
+    def place_hold(self, student_id, title):
+        with self._transaction() as session:
+            # Locked, so no copy can come back unnoticed before the hold
+            # is queued
+            found = session.execute(
+                "SELECT title_id, available_copies FROM titles WHERE title = %s AND total_copies > 0"
+                + self._for_update, (title,)
+            ).fetchone()
+            if not found:
+                return None
+            if found['available_copies'] > 0:
+                return 0
+            title_id = found['title_id']
+            hold = session.execute("""
+                SELECT hold_id FROM holds
+                WHERE student_id = %s AND served_at IS NULL AND title_id = %s
+                """, (student_id, title_id)).fetchone()
+            if hold:
+                hold_id = hold['hold_id']
+            else:
+                session.execute(
+                    "INSERT INTO holds (title_id, student_id, created_at) VALUES (%s, %s, %s)",
+                    (title_id, student_id, datetime.now().replace(microsecond=0))
+                )
+                hold_id = session.lastrowid
+            return session.execute("""
+                SELECT COUNT(*) AS position FROM holds
+                WHERE title_id = %s AND served_at IS NULL AND hold_id <= %s
+                """, (title_id, hold_id)).fetchone()['position']
+
+    def cancel_hold(self, student_id, hold_id):
+        with self._transaction() as session:
+            session.execute(
+                "DELETE FROM holds WHERE hold_id = %s AND student_id = %s AND served_at IS NULL",
+                (hold_id, student_id)
+            )
+            return session.rowcount == 1
+
+    def holds(self, student_id):
+        return self._fetchall("""
+            SELECT h.hold_id, ti.title, h.created_at,
+                   (SELECT COUNT(*) FROM holds q
+                    WHERE q.title_id = h.title_id AND q.served_at IS NULL
+                      AND q.hold_id <= h.hold_id) AS position
+            FROM holds h
+            JOIN titles ti ON ti.title_id = h.title_id
+            WHERE h.student_id = %s AND h.served_at IS NULL
+            ORDER BY h.hold_id
+            """, (student_id,))
+
+    def borrow(self, student_id, title):
+        rows = self._fetchall(
+            "SELECT book_id FROM books WHERE title = %s AND status = 'available'",
+            (title,)
+        )
+        # Another desk may take a copy between the lookup and the
+        # checkout; move on to the next one.
+        for row in rows:
+            if self.checkout(student_id, row['book_id']):
+                return row['book_id']
+        return None
+
+    def open_loans(self, student_id):
+        return self._fetchall("""
+            SELECT b.book_id, b.title, t.issued_date, t.due_date, COALESCE(f.fine, 0) AS fine
+            FROM transactions t
+            JOIN books b ON t.book_id = b.book_id
+            LEFT JOIN loan_fines f ON f.transaction_id = t.transaction_id
+            WHERE t.student_id = %s AND t.return_date IS NULL
+            ORDER BY t.due_date
+            """, (student_id,))
+
+    def overdue_loans(self, limit=100):
+        return self._fetchall("""
+            SELECT f.transaction_id, s.name, b.title, f.due_date, f.days_overdue, f.fine, f.as_of
+            FROM loan_fines f
+            JOIN books b ON f.book_id = b.book_id
+            LEFT JOIN students s ON f.student_id = s.student_id
+            WHERE f.days_overdue > 0
+            ORDER BY f.days_overdue DESC, f.transaction_id
+            LIMIT %s
+            """, (limit,))
+
+    def return_book(self, student_id, title):
+        rows = self._fetchall("""
+            SELECT t.book_id
+            FROM transactions t
+            JOIN books b ON t.book_id = b.book_id
+            WHERE b.title = %s AND t.student_id = %s AND t.return_date IS NULL
+            """, (title, student_id))
+        for row in rows:
+            penalty = self.checkin(student_id, row['book_id'])
+            if penalty is not None:
+                return row['book_id'], penalty
+        return None
+
+    def checkout_many(self, student_id, book_ids):
+        book_ids = list(dict.fromkeys(book_ids))
+        if not book_ids:
+            return []
+        due_date = datetime.now() + timedelta(days=LOAN_DAYS)
+        issued = self._with_retry(lambda: self._checkout_many(student_id, book_ids, due_date))
+        return [(book_id, book_id in issued) for book_id in book_ids]
+
+    def _checkout_many(self, student_id, book_ids, due_date):
+        marks = ", ".join(["%s"] * len(book_ids))
+        with self._transaction() as session:
+            rows = session.execute(
+                f"SELECT book_id FROM books WHERE book_id IN ({marks}) AND status = 'available'"
+                + self._for_update, book_ids
+            ).fetchall()
+            free = [row['book_id'] for row in rows]
+            if not free:
+                return set()
+            served = self._serve_holds(session, free, due_date - timedelta(days=LOAN_DAYS))
+            issued = [book_id for book_id in free if book_id not in served]
+            if issued:
+                marks = ", ".join(["%s"] * len(issued))
+                session.execute(
+                    f"UPDATE books SET status = 'issued' WHERE book_id IN ({marks})", issued
+                )
+                session.execute(
+                    "INSERT INTO transactions (book_id, student_id, due_date) VALUES "
+                    + ", ".join(["(%s, %s, %s)"] * len(issued)),
+                    [value for book_id in issued for value in (book_id, student_id, due_date)]
+                )
+        return set(issued) | {book_id for book_id, holder in served.items()
+                              if holder == student_id}
+
+    def _penalty(self, return_date):
+        """(sql, params) computing a loan's fine under `fine_policy`."""
+        policy = self.fine_policy
+        sql = self._penalty_sql
+        params = [return_date, policy.grace_days, policy.rate]
+        if policy.max_fine is not None:
+            sql = self._cap_sql.format(sql)
+            params.append(policy.max_fine)
+        return sql, params
+
+    def checkin_many(self, book_ids, student_id=None):
+        book_ids = list(dict.fromkeys(book_ids))
+        if not book_ids:
+            return []
+        return_date = datetime.now().replace(microsecond=0)
+        penalties = self._with_retry(lambda: self._checkin_many(book_ids, student_id, return_date))
+        return [(book_id, penalties.get(book_id)) for book_id in book_ids]
+
+    def _checkin_many(self, book_ids, student_id, return_date):
+        marks = ", ".join(["%s"] * len(book_ids))
+        params = list(book_ids)
+        sql = f"""SELECT transaction_id FROM transactions
+                  WHERE book_id IN ({marks}) AND return_date IS NULL"""
+        if student_id is not None:
+            sql += " AND student_id = %s"
+            params.append(student_id)
+        with self._transaction() as session:
+            loans = [row['transaction_id']
+                     for row in session.execute(sql + self._for_update, params).fetchall()]
+            if not loans:
+                return {}
+            marks = ", ".join(["%s"] * len(loans))
+            penalty, penalty_params = self._penalty(return_date)
+            # Every penalty is computed by the same UPDATE
+            session.execute(f"""
+                UPDATE transactions
+                SET return_date = %s, penalty_amount = {penalty}
+                WHERE transaction_id IN ({marks})
+                """, [return_date] + penalty_params + loans)
+            rows = session.execute(f"""
+                SELECT book_id, penalty_amount FROM transactions
+                WHERE transaction_id IN ({marks})
+                """, loans).fetchall()
+            returned = [row['book_id'] for row in rows]
+            marks = ", ".join(["%s"] * len(returned))
+            session.execute(
+                f"UPDATE books SET status = 'available' WHERE book_id IN ({marks})", returned
+            )
+            self._serve_holds(session, returned, return_date)
+        return {row['book_id']: float(row['penalty_amount']) for row in rows}
+
+    def transaction_history(self, student_id):
+        select = """
+            SELECT b.title, t.issued_date, t.due_date, t.return_date, t.penalty_amount
+            FROM {} t
+            JOIN books b ON t.book_id = b.book_id
+            WHERE t.student_id = %s"""
+        return self._fetchall(
+            select.format('transactions') + " UNION ALL " + select.format('transactions_archive')
+            + " ORDER BY issued_date DESC", (student_id, student_id))
+
+    def history_page(self, student_id, after=None, before=None, limit=HISTORY_PAGE_SIZE):
+        select = """
+            SELECT t.transaction_id, b.title, t.issued_date, t.due_date,
+                   t.return_date, t.penalty_amount
+            FROM {} t
+            JOIN books b ON t.book_id = b.book_id
+            WHERE t.student_id = %s"""
+        params = (student_id,)
+        direction = " DESC"
+        if before is not None:
+            # Walk backwards from the key and flip the page round
+            select += " AND (t.issued_date, t.transaction_id) > (%s, %s)"
+            params += tuple(before)
+            direction = ""
+        elif after is not None:
+            select += " AND (t.issued_date, t.transaction_id) < (%s, %s)"
+            params += tuple(after)
+        # Each table reads its own page by index and the two are merged
+        select += f" ORDER BY t.issued_date{direction}, t.transaction_id{direction} LIMIT %s"
+        rows = self._fetchall(
+            f"SELECT * FROM ({select.format('transactions')}) hot"
+            f" UNION ALL SELECT * FROM ({select.format('transactions_archive')}) cold"
+            f" ORDER BY issued_date{direction}, transaction_id{direction} LIMIT %s",
+            (params + (limit,)) * 2 + (limit,))
+        if before is not None:
+            rows.reverse()
+        return rows
+
+    def search(self, term, limit=SEARCH_PAGE_SIZE, offset=0):
+        tokens = search_tokens(term)
+        if not tokens:
+            return []
+        sql, params = self._search_sql(tokens)
+        rows = self._fetchall(sql + " LIMIT %s OFFSET %s", params + (limit, offset))
+        if rows or (offset and self._fetchall(sql + " LIMIT 1", params)):
+            return rows
+        # Nothing matches every word as typed: forgive typos the way
+        # the desks' catalog cache does
+        return self._typo_search().search(term, limit, offset)[1]
+
+    def _typo_search(self):
+        with self._typo_lock:
+            if self._typo_catalog is None:
+                from catalog_cache import CatalogCache
+                self._typo_catalog = CatalogCache(self)
+        return self._typo_catalog
+
+    def _search_sql(self, tokens):
+        """(sql, params) selecting title, category and status in rank order.
+
+        The base version is a prefix scan of idx_title and then of
+        idx_category, used when the backend has no full-text index to
+        offer.
+        """
+        prefix = " ".join(tokens) + "%"
+        return ("""
+            SELECT title, category, status FROM (
+                SELECT title, category, status, 0 AS by_category
+                FROM books
+                WHERE title LIKE %s
+                UNION ALL
+                SELECT title, category, status, 1
+                FROM books
+                WHERE category LIKE %s AND title NOT LIKE %s
+            ) matches
+            ORDER BY by_category, title
+            """, (prefix, prefix, prefix))
+
+    def categories(self):
+        # From titles, like books_in_category, so the two lists agree
+        rows = self._fetchall(
+            "SELECT DISTINCT category FROM titles WHERE total_copies > 0 ORDER BY category")
+        return [row['category'] for row in rows]
+
+    def books_in_category(self, category):
+        return self._fetchall("""
+            SELECT title, available_copies AS available, total_copies AS copies
+            FROM titles
+            WHERE category = %s AND total_copies > 0
+            ORDER BY title
+            """, (category,))
+
+    def reviews_for(self, title):
+        return self._fetchall("""
+            SELECT r.review_text, r.rating, s.name, r.created_at
+            FROM reviews r
+            JOIN books b ON r.book_id = b.book_id
+            JOIN students s ON r.student_id = s.student_id
+            WHERE b.title = %s
+            ORDER BY r.created_at DESC
+            """, (title,))
+
+    def review_summary(self, title):
+        rows = self._fetchall("""
+            SELECT COALESCE(SUM(s.review_count), 0) AS review_count,
+                   COALESCE(SUM(s.rating_sum), 0) AS rating_sum,
+                   COALESCE(SUM(s.rating_1), 0) AS rating_1, COALESCE(SUM(s.rating_2), 0) AS rating_2,
+                   COALESCE(SUM(s.rating_3), 0) AS rating_3, COALESCE(SUM(s.rating_4), 0) AS rating_4,
+                   COALESCE(SUM(s.rating_5), 0) AS rating_5
+            FROM review_stats s
+            JOIN books b ON s.book_id = b.book_id
+            WHERE b.title = %s
+            """, (title,))
+        row = rows[0]
+        histogram = [int(row[f'rating_{i}']) for i in range(1, 6)]
+        rated = sum(histogram)
+        return {
+            'count': int(row['review_count']),
+            'average': float(row['rating_sum']) / rated if rated else None,
+            'histogram': histogram,
+        }
+
+    def review_page(self, title, after=None, limit=REVIEW_PAGE_SIZE):
+        select = """
+            SELECT r.review_id, r.review_text, r.rating, s.name, r.created_at
+            FROM reviews r
+            JOIN books b ON r.book_id = b.book_id
+            JOIN students s ON r.student_id = s.student_id
+            WHERE b.title = %s"""
+        if after is not None:
+            return self._fetchall(select + """
+                AND (r.created_at, r.review_id) < (%s, %s)
+                ORDER BY r.created_at DESC, r.review_id DESC
+                LIMIT %s""", (title,) + tuple(after) + (limit,))
+        return self._fetchall(select + """
+            ORDER BY r.created_at DESC, r.review_id DESC
+            LIMIT %s""", (title, limit))
+
+    def catalog_version(self):
+        rows = self._fetchall(
+            "SELECT COALESCE(MAX(change_id), 0) AS version FROM catalog_changes"
+        )
+        return rows[0]['version']
+
+    def catalog_books(self):
+        with self._session() as session:
+            # Read the version first: changes racing with the load are
+            # replayed by the next catalog_changes call.
+            version = session.execute(
+                "SELECT COALESCE(MAX(change_id), 0) AS version FROM catalog_changes"
+            ).fetchone()['version']
+            rows = session.execute(
+                "SELECT book_id, title, category, status FROM books"
+            ).fetchall()
+        return version, rows
+
+    def catalog_changes(self, since):
+        rows = self._fetchall("""
+            SELECT c.change_id, c.book_id, b.title, b.category, b.status
+            FROM catalog_changes c
+            LEFT JOIN books b ON c.book_id = b.book_id
+            WHERE c.change_id > %s
+            ORDER BY c.change_id
+            """, (since,))
+        version = rows[-1]['change_id'] if rows else since
+        return version, rows
+
+    def events_version(self):
+        rows = self._fetchall(
+            "SELECT COALESCE(MAX(event_id), 0) AS version FROM catalog_events"
+        )
+        return rows[0]['version']
+
+    def catalog_events(self, since, limit=EVENT_BATCH):
+        rows = self._fetchall("""
+            SELECT e.event_id, e.kind, e.book_id, e.student_id, e.transaction_id,
+                   b.title, b.category, b.status, t.issued_date, t.due_date, t.return_date
+            FROM catalog_events e
+            LEFT JOIN books b ON e.book_id = b.book_id
+            LEFT JOIN transactions t ON e.transaction_id = t.transaction_id
+            WHERE e.event_id > %s
+            ORDER BY e.event_id
+            LIMIT %s
+            """, (since, limit))
+        version = rows[-1]['event_id'] if rows else since
+        return version, rows
+
+    def bulk_insert(self, table, columns, rows, checkpoint=None):
+        check_columns(table, columns)
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+        with self._transaction() as session, self._bulk(session) as bulk:
+            bulk.executemany(sql, rows)
+            if checkpoint is not None:
+                source, rows_done = checkpoint
+                session.execute("DELETE FROM import_checkpoints WHERE source = %s", (source,))
+                session.execute(
+                    "INSERT INTO import_checkpoints (source, rows_done) VALUES (%s, %s)",
+                    (source, rows_done)
+                )
+
+    def import_checkpoint(self, source):
+        rows = self._fetchall(
+            "SELECT rows_done FROM import_checkpoints WHERE source = %s", (source,)
+        )
+        return rows[0]['rows_done'] if rows else 0
+
+    def clear_import_checkpoint(self, source):
+        with self._transaction() as session:
+            session.execute("DELETE FROM import_checkpoints WHERE source = %s", (source,))
+
+    def stream_table(self, table, chunk_size=STREAM_CHUNK, after=None):
+        columns = TABLE_COLUMNS.get(table)
+        if columns is None:
+            raise StorageError(f"Unknown table: {table}")
+        sql = "SELECT {} FROM {}".format(", ".join(columns), table)
+        params = ()
+        if after is not None:
+            sql += f" WHERE {columns[0]} > %s"
+            params = (after,)
+        sql += f" ORDER BY {columns[0]}"
+        yield from self._stream(sql, params, chunk_size)
+
+    def fines_state(self):
+        rows = self._fetchall("""
+            SELECT last_change, policy FROM fine_runs
+            WHERE run_id = (SELECT MAX(run_id) FROM fine_runs)
+            """)
+        return rows[0] if rows else None
+
+    def loan_version(self):
+        rows = self._fetchall(
+            "SELECT COALESCE(MAX(change_id), 0) AS version FROM loan_changes"
+        )
+        return rows[0]['version']
+
+    def loan_changes(self, since):
+        columns = ", ".join(f"t.{c}" for c in TABLE_COLUMNS['transactions'][1:])
+        rows = self._fetchall(f"""
+            SELECT c.change_id, c.transaction_id, {columns}
+            FROM loan_changes c
+            LEFT JOIN transactions t ON c.transaction_id = t.transaction_id
+            WHERE c.change_id > %s
+            ORDER BY c.change_id
+            """, (since,))
+        version = rows[-1]['change_id'] if rows else since
+        return version, rows
+
+    def fine_candidates(self, since=None, overdue_before=None, chunk_size=STREAM_CHUNK,
+                        after=None, limit=None):
+        columns = "transaction_id, student_id, book_id, due_date, return_date"
+        if since is None:
+            sql = f"SELECT {columns} FROM transactions WHERE return_date IS NULL"
+            params = []
+        else:
+            sql = f"""SELECT {columns} FROM transactions
+                      WHERE transaction_id IN (
+                          SELECT transaction_id FROM loan_changes WHERE change_id > %s
+                          UNION
+                          SELECT transaction_id FROM loan_fines
+                          WHERE accruing = 1 AND due_date < %s)"""
+            params = [since, overdue_before]
+        if after is not None:
+            sql += " AND transaction_id > %s"
+            params.append(after)
+        sql += " ORDER BY transaction_id"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        yield from self._stream(sql, params, chunk_size)
+
+    def circulation(self, since=None, until=None, chunk_size=STREAM_CHUNK):
+        select = """SELECT t.transaction_id, t.student_id, t.issued_date, t.due_date,
+                           t.return_date, t.penalty_amount, b.title, b.category
+                    FROM {} t
+                    LEFT JOIN books b ON t.book_id = b.book_id"""
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("t.issued_date >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("t.issued_date < %s")
+            params.append(until)
+        if conditions:
+            select += " WHERE " + " AND ".join(conditions)
+        sql = select.format('transactions') + " UNION ALL " + select.format('transactions_archive')
+        return self._stream(sql, params * 2, chunk_size)
+
+    def archive_loans(self, returned_before, limit=ARCHIVE_BATCH):
+        columns = ", ".join(TABLE_COLUMNS['transactions'])
+        with self._transaction() as session:
+            rows = session.execute(f"""
+                SELECT transaction_id FROM transactions
+                WHERE return_date < %s
+                ORDER BY return_date
+                LIMIT %s{self._for_update}""", (returned_before, limit)).fetchall()
+            if not rows:
+                return 0
+            ids = [row['transaction_id'] for row in rows]
+            marks = ", ".join(["%s"] * len(ids))
+            session.execute(f"""
+                INSERT INTO transactions_archive ({columns})
+                SELECT {columns} FROM transactions WHERE transaction_id IN ({marks})""", ids)
+            session.execute(f"DELETE FROM transactions WHERE transaction_id IN ({marks})", ids)
+            # Returned loans normally left the ledger on the next fines run
+            session.execute(f"DELETE FROM loan_fines WHERE transaction_id IN ({marks})", ids)
+        return len(ids)
+
+    def archive_status(self):
+        with self._session() as session:
+            status = session.execute("""
+                SELECT COUNT(*) AS loans, COUNT(*) - COUNT(return_date) AS open_loans,
+                       MIN(return_date) AS oldest_return
+                FROM transactions""").fetchone()
+            status['archived'] = session.execute(
+                "SELECT COUNT(*) AS archived FROM transactions_archive").fetchone()['archived']
+        if isinstance(status['oldest_return'], str):
+            # SQLite's MIN() drops the column type, so no converter ran
+            status['oldest_return'] = datetime.fromisoformat(status['oldest_return'])
+        return status
+
+    def review_activity(self, since=None, until=None, chunk_size=STREAM_CHUNK):
+        sql = """SELECT r.student_id, s.name, b.title, r.rating
+                 FROM reviews r
+                 LEFT JOIN students s ON r.student_id = s.student_id
+                 LEFT JOIN books b ON r.book_id = b.book_id"""
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("r.created_at >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("r.created_at < %s")
+            params.append(until)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self._stream(sql, params, chunk_size)
+
+    def clear_fines(self):
+        with self._transaction() as session:
+            session.execute("DELETE FROM loan_fines")
+
+    def write_fines(self, rows, closed=()):
+        ids = [row[0] for row in rows] + list(closed)
+        if not ids:
+            return
+        with self._transaction() as session, self._bulk(session) as bulk:
+            session.execute(
+                "DELETE FROM loan_fines WHERE transaction_id IN ({})".format(
+                    ", ".join(["%s"] * len(ids))), ids)
+            if rows:
+                bulk.executemany("""
+                    INSERT INTO loan_fines (transaction_id, student_id, book_id, due_date,
+                                            days_overdue, fine, accruing, as_of)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""", rows)
+
+    def finish_fines_run(self, last_change, policy, as_of, loans):
+        with self._transaction() as session:
+            session.execute(
+                "INSERT INTO fine_runs (last_change, policy, as_of, loans) VALUES (%s, %s, %s, %s)",
+                (last_change, policy, as_of, loans)
+            )
+
+    def add_review(self, student_id, title, text, rating, book_id=None):
+        with self._transaction() as session:
+            if book_id is not None:
+                book = session.execute(
+                    "SELECT book_id FROM books WHERE book_id = %s", (book_id,)
+                ).fetchone()
+            else:
+                book = session.execute(
+                    "SELECT book_id FROM books WHERE title = %s", (title,)
+                ).fetchone()
+            if not book:
+                return False
+            session.execute("""
+                INSERT INTO reviews (book_id, student_id, review_text, rating)
+                VALUES (%s, %s, %s, %s)
+                """, (book['book_id'], student_id, text, int(rating)))
+        return True
+
+
+class MySQLRepository(SQLRepository):
+    """Repository backed by a mysql.connector connection pool.
+
+    Connections run in autocommit mode so pooled reads never hold a stale
+    snapshot; writes open an explicit transaction. Cursors are prepared,
+    so each statement is parsed once per connection.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, pool_name="libmgmt", migrate=AUTO_MIGRATE, **config):
+        if not _import_driver():
+            raise StorageError("mysql-connector-python is not installed")
+        self._driver_errors = (mysql.connector.Error,)
+        params = dict(DB_CONFIG, **config)
+        try:
+            self._pool = pooling.MySQLConnectionPool(
+                pool_name=pool_name, pool_size=pool_size,
+                autocommit=True, **params
+            )
+        except mysql.connector.Error as e:
+            raise StorageError(str(e)) from e
+        # The pool raises instead of waiting when it runs dry, so callers
+        # queue on a semaphore sized to match.
+        self._slots = threading.BoundedSemaphore(pool_size)
+        if migrate:
+            self.migrate()
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            conn = self._pool.get_connection()
+            return conn, conn.cursor(prepared=True)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, cursor):
+        try:
+            cursor.close()
+            # An abandoned stream leaves rows unread on the connection
+            if conn.unread_result:
+                conn.consume_results()
+            conn.close()  # returns the connection to the pool
+        finally:
+            self._slots.release()
+
+    _for_update = " FOR UPDATE"
+    _penalty_sql = "GREATEST(0, TIMESTAMPDIFF(DAY, due_date, %s) - %s) * %s"
+    _cap_sql = "LEAST({}, %s)"
+
+    def _begin(self, conn):
+        conn.start_transaction()
+
+    def _log_slow(self, conn, slow):
+        # EXPLAIN cannot run while rows are still unread
+        if conn.unread_result:
+            conn.consume_results()
+        super()._log_slow(conn, slow)
+
+    @contextmanager
+    def _migration_lock(self, session):
+        # DDL commits implicitly, so a transaction cannot fence migrations
+        session.execute("SELECT GET_LOCK('libmgmt_migrate', 300) AS got").fetchone()
+        try:
+            yield
+        finally:
+            session.execute("SELECT RELEASE_LOCK('libmgmt_migrate') AS released").fetchone()
+
+    def _index_exists(self, session, table, name):
+        return session.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1""", (table, name)).fetchone() is not None
+
+    def _create_index(self, session, table, name, columns, unique):
+        if not self._index_exists(session, table, name):
+            with self._bulk(session) as bulk:
+                bulk.execute("CREATE {}INDEX {} ON {} ({})".format(
+                    "UNIQUE " if unique else "", name, table, ", ".join(columns)))
+
+    _events_ddl = MYSQL_EVENTS_DDL
+    _holdings_ddl = MYSQL_HOLDINGS_DDL
+    _archive_ddl = MYSQL_ARCHIVE_DDL
+    _changes_ddl = MYSQL_CHANGES_DDL
+    _imports_ddl = MYSQL_IMPORT_DDL
+    _fines_ddl = MYSQL_FINES_DDL
+    _review_stats_ddl = MYSQL_REVIEW_STATS_DDL
+
+    def _table_exists(self, session, table):
+        return session.execute("""
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+            LIMIT 1""", (table,)).fetchone() is not None
+
+    def _run_ddl(self, session, statements):
+        # Triggers are DDL, which the prepared cursor cannot run
+        with self._bulk(session) as bulk:
+            for statement in statements:
+                bulk.execute(statement)
+
+    def _create_fulltext(self, session):
+        if not self._index_exists(session, 'books', 'ft_title_category'):
+            with self._bulk(session) as bulk:
+                bulk.execute("CREATE FULLTEXT INDEX ft_title_category ON books (title, category)")
+
+    def _drop_index(self, session, table, name):
+        if self._index_exists(session, table, name):
+            with self._bulk(session) as bulk:
+                bulk.execute(f"DROP INDEX {name} ON {table}")
+
+    def _plain_cursor(self, conn):
+        # A plain cursor's executemany() folds rows into multi-row
+        # INSERTs; prepared cursors send them one by one.
+        return conn.cursor(buffered=False)
+
+    def _retryable(self, error):
+        return getattr(error, 'errno', None) in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT)
+
+    def _script(self, sql, params):
+        """Run a multi-statement script in one round trip.
+
+        Returns (rowcount, rows) for each statement. The script opens
+        its own transaction; it is rolled back if any statement fails.
+        """
+        label = statement_label(sql.split(";")[1])
+        with self._session() as session, self._bulk(session) as bulk:
+            results = []
+            start = time.perf_counter()
+            try:
+                for result in bulk.cursor.execute(sql, params, multi=True):
+                    rows = result.fetchall() if result.with_rows else None
+                    results.append((result.rowcount, rows))
+            except mysql.connector.Error:
+                INSTRUMENTS.query(label, time.perf_counter() - start, failed=True)
+                session.conn.rollback()
+                raise
+            seconds = time.perf_counter() - start
+            if INSTRUMENTS.query(label, seconds):
+                session.slow.append((sql, params, seconds, operation.get()))
+            return results
+
+    def _checkout(self, student_id, book_id, due_date):
+        issued_at = (due_date - timedelta(days=LOAN_DAYS)).replace(microsecond=0)
+        # The copy goes to the first student waiting for its title, if any
+        results = self._script("""
+            START TRANSACTION;
+            SET @hold := NULL, @holder := NULL;
+            UPDATE books SET status = 'issued' WHERE book_id = %s AND status = 'available';
+            SET @issued := ROW_COUNT();
+            SELECT h.hold_id, h.student_id INTO @hold, @holder
+            FROM books b
+            JOIN titles ti ON ti.title = b.title
+            JOIN holds h ON h.title_id = ti.title_id
+            WHERE b.book_id = %s AND @issued = 1 AND h.served_at IS NULL
+            ORDER BY h.hold_id LIMIT 1 FOR UPDATE;
+            INSERT INTO transactions (book_id, student_id, due_date)
+            SELECT %s, COALESCE(@holder, %s), %s FROM DUAL WHERE @issued = 1;
+            UPDATE holds SET served_at = %s, book_id = %s WHERE hold_id = @hold;
+            SELECT @issued = 1 AND COALESCE(@holder, %s) = %s AS mine;
+            COMMIT""", (book_id, book_id, book_id, student_id, due_date, issued_at, book_id,
+                        student_id, student_id))
+        rows = next(rows for _, rows in results if rows is not None)
+        return bool(rows[0][0])
+
+    def _checkin(self, student_id, book_id, return_date):
+        # TIMESTAMP columns hold whole seconds
+        return_date = return_date.replace(microsecond=0)
+        due_date = return_date + timedelta(days=LOAN_DAYS)
+        penalty, penalty_params = self._penalty(return_date)
+        # The copy goes straight to the first student waiting for its title
+        results = self._script(f"""
+            START TRANSACTION;
+            SET @loan := NULL, @hold := NULL, @holder := NULL;
+            SELECT transaction_id INTO @loan FROM transactions
+            WHERE book_id = %s AND student_id = %s AND return_date IS NULL
+            LIMIT 1 FOR UPDATE;
+            UPDATE transactions
+            SET return_date = %s,
+                penalty_amount = {penalty}
+            WHERE transaction_id = @loan AND return_date IS NULL;
+            SET @returned := ROW_COUNT();
+            UPDATE books SET status = 'available' WHERE book_id = %s AND @returned = 1;
+            SELECT h.hold_id, h.student_id INTO @hold, @holder
+            FROM books b
+            JOIN titles ti ON ti.title = b.title
+            JOIN holds h ON h.title_id = ti.title_id
+            WHERE b.book_id = %s AND @returned = 1 AND h.served_at IS NULL
+            ORDER BY h.hold_id LIMIT 1 FOR UPDATE;
+            UPDATE books SET status = 'issued' WHERE book_id = %s AND @hold IS NOT NULL;
+            INSERT INTO transactions (book_id, student_id, due_date)
+            SELECT %s, @holder, %s FROM DUAL WHERE @hold IS NOT NULL;
+            UPDATE holds SET served_at = %s, book_id = %s WHERE hold_id = @hold;
+            SELECT penalty_amount FROM transactions WHERE transaction_id = @loan AND @returned = 1;
+            COMMIT""", (book_id, student_id, return_date, *penalty_params, book_id,
+                        book_id, book_id, book_id, due_date, return_date, book_id))
+        rows = next(rows for _, rows in results if rows is not None)
+        return float(rows[0][0]) if rows else None
+
+    def load_data_file(self, table, columns, path):
+        """LOAD DATA LOCAL INFILE; needs allow_local_infile=True."""
+        check_columns(table, columns)
+        # Empty CSV fields are NULL, as in the CSV export
+        sql = """
+            LOAD DATA LOCAL INFILE %s INTO TABLE {}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+            LINES TERMINATED BY '\\n'
+            IGNORE 1 LINES
+            ({})
+            SET {}""".format(
+                table,
+                ", ".join(f"@{c}" for c in columns),
+                ", ".join(f"{c} = NULLIF(@{c}, '')" for c in columns))
+        with self._transaction() as session, self._bulk(session) as bulk:
+            bulk.execute(sql, (path,))
+            return bulk.rowcount
+
+    def _search_sql(self, tokens):
+        # Words shorter than the FULLTEXT minimum are not indexed.
+        words = [t for t in tokens if len(t) >= FULLTEXT_MIN_TOKEN]
+        if not words:
+            return super()._search_sql(tokens)
+        query = " ".join(f"+{word}*" for word in words)
+        return ("""
+            SELECT title, category, status
+            FROM books
+            WHERE MATCH (title, category) AGAINST (%s IN BOOLEAN MODE)
+            ORDER BY MATCH (title, category) AGAINST (%s IN BOOLEAN MODE) DESC, book_id
+            """, (query, query))
+
+    def close(self):
+        # Pooled connections are closed when they are garbage collected;
+        # nothing is checked out once the GUI shuts down.
+        self._pool = None
+
+
+class SQLiteRepository(SQLRepository):
+    """Repository backed by a SQLite file with the MySQL schema."""
+
+    _driver_errors = (sqlite3.Error,)
+    _qmark = True
+    # BEGIN IMMEDIATE already holds the write lock, so no FOR UPDATE
+    _penalty_sql = "MAX(0, CAST(julianday(%s) - julianday(due_date) AS INTEGER) - %s) * %s"
+    _cap_sql = "MIN({}, %s)"
+    _explain_sql = "EXPLAIN QUERY PLAN "
+    _events_ddl = SQLITE_EVENTS_DDL
+    _holdings_ddl = SQLITE_HOLDINGS_DDL
+    _archive_ddl = SQLITE_ARCHIVE_DDL
+
+    def __init__(self, path=SQLITE_PATH, pool_size=POOL_SIZE, migrate=AUTO_MIGRATE):
+        self.path = path
+        # Every in-memory connection is its own database, so share one.
+        if path == ":memory:":
+            pool_size = 1
+        self._pool = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._all = []
+        self._lock = threading.Lock()
+        with self._session() as session:
+            session.conn.executescript(SQLITE_SCHEMA)
+            self._fts = self._create_fts(session.conn)
+            self._create_review_stats(session.conn)
+        if migrate:
+            self.migrate()
+
+    @staticmethod
+    def _create_review_stats(conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'review_stats'"
+        ).fetchone()
+        if not exists:
+            conn.executescript("BEGIN;" + SQLITE_REVIEW_STATS_SCHEMA + "COMMIT;")
+
+    @staticmethod
+    def _create_fts(conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            conn.executescript("BEGIN;" + SQLITE_FTS_SCHEMA + "COMMIT;")
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: fall back to prefix scans.
+            conn.rollback()
+            return False
+        return True
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES
+        )
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            return conn, conn.cursor()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, cursor):
+        cursor.close()
+        self._pool.put(conn)
+        self._slots.release()
+
+    def _begin(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+
+    def full_scans(self, plan):
+        # EXPLAIN QUERY PLAN rows end in a detail such as "SCAN books" or
+        # "SEARCH t USING INDEX idx_open_loans (student_id=?)". Subqueries
+        # run as co-routines are scanned too, but they are not tables.
+        subqueries = {match.group(1) for match in (
+            re.match(r"(?:CO-ROUTINE|MATERIALIZE) (\w+)", row[-1]) for row in plan) if match}
+        scans = []
+        for row in plan:
+            match = re.match(r"SCAN (\w+)(.*)", row[-1])
+            if match and match.group(1) not in subqueries | {'CONSTANT'} and not re.search(
+                    r"USING .*INDEX|VIRTUAL TABLE", match.group(2)):
+                scans.append(match.group(1))
+        return scans
+
+    def _retryable(self, error):
+        return isinstance(error, sqlite3.OperationalError) and (
+            "locked" in str(error) or "busy" in str(error))
+
+    def _search_sql(self, tokens):
+        if not self._fts:
+            return super()._search_sql(tokens)
+        query = " ".join('"{}"*'.format(t.replace('"', '""')) for t in tokens)
+        return ("""
+            SELECT b.title, b.category, b.status
+            FROM books_fts f
+            JOIN books b ON b.book_id = f.rowid
+            WHERE books_fts MATCH %s
+            ORDER BY bm25(books_fts, 10.0, 1.0), b.book_id
+            """, (query,))
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+
+def create_repository(backend=None, **options):
+    """Build the repository named by `backend` or $LIBMGMT_BACKEND."""
+    backend = backend or os.environ.get("LIBMGMT_BACKEND", "mysql")
+    if backend == "mysql":
+        return MySQLRepository(**options)
+    if backend == "sqlite":
+        return SQLiteRepository(**options)
+    if backend == "http":
+        from service import HTTPRepository
+        return HTTPRepository(**options)
+    if backend == "replica":
+        from replica import ReplicaRepository
+        return ReplicaRepository(**options)
+    raise StorageError(f"Unknown storage backend: {backend}")
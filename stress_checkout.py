@@ -0,0 +1,166 @@
+"""Hammer checkout and checkin from many threads and check the result.
+
+    python stress_checkout.py --sqlite-path stress.db
+    python stress_checkout.py --backend mysql --threads 32 --books 5 --seconds 20
+
+A handful of books is shared by many threads, so most checkouts race
+for the same rows. Every thread loops: check out a random book, and
+check it back in if it got it. The run fails if a book is ever issued
+to two students at once, or if the tables disagree afterwards (a book
+with more than one open loan, or an open loan on an available book).
+
+The test books and students are written into the database for real, so
+it only runs against a scratch database with no books in it: a fresh
+SQLite file by default, or an empty MySQL database with --backend mysql.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from storage import StorageError, create_repository
+
+
+class Holders:
+    """Who holds each book, as seen by the threads themselves.
+
+    A holder stays recorded until its checkin has returned. While the
+    checkin is running the book may already be back on the shelf, so a
+    checkout that lands then is not counted as a double issue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}
+        self._returning = set()
+        self.double_issues = 0
+
+    def take(self, book_id, student_id):
+        with self._lock:
+            if book_id in self._held and book_id not in self._returning:
+                self.double_issues += 1
+            self._returning.discard(book_id)
+            self._held[book_id] = student_id
+
+    def returning(self, book_id, student_id):
+        with self._lock:
+            if self._held.get(book_id) == student_id:
+                self._returning.add(book_id)
+
+    def give_back(self, book_id, student_id):
+        with self._lock:
+            if self._held.get(book_id) == student_id:
+                del self._held[book_id]
+                self._returning.discard(book_id)
+
+
+def seed(repo, books, students):
+    if repo.catalog_books()[1]:
+        raise StorageError("The database already has books; stress test a scratch one")
+    marker = f"stress {os.getpid()} {time.time():.0f}"
+    repo.bulk_insert('books', ('title', 'category'),
+                     [(f"{marker} #{i}", 'Stress') for i in range(books)])
+    _, rows = repo.catalog_books()
+    book_ids = [r['book_id'] for r in rows if r['title'].startswith(marker)]
+    student_ids = [repo.login(f"Stress {i}", f"stress{i}@{os.getpid()}.test")['id']
+                   for i in range(students)]
+    return book_ids, student_ids
+
+
+def worker(repo, book_ids, student_id, holders, stop, counts):
+    rng = random.Random()
+    while not stop.is_set():
+        book_id = rng.choice(book_ids)
+        try:
+            if not repo.checkout(student_id, book_id):
+                counts['conflicts'] += 1
+                continue
+            holders.take(book_id, student_id)
+            counts['checkouts'] += 1
+            holders.returning(book_id, student_id)
+            try:
+                returned = repo.checkin(student_id, book_id)
+            finally:
+                holders.give_back(book_id, student_id)
+            if returned is None:
+                counts['lost_loans'] += 1
+            else:
+                counts['checkins'] += 1
+        except StorageError:
+            counts['errors'] += 1
+
+
+def verify(repo, book_ids):
+    """Return a list of inconsistencies between books and transactions."""
+    wanted = set(book_ids)
+    status = {r['book_id']: r['status'] for r in repo.stream_table('books') if r['book_id'] in wanted}
+    open_loans = Counter(r['book_id'] for r in repo.stream_table('transactions')
+                         if r['book_id'] in wanted and r['return_date'] is None)
+    problems = []
+    for book_id in book_ids:
+        loans = open_loans[book_id]
+        if loans > 1:
+            problems.append(f"book {book_id} has {loans} open loans")
+        if (loans == 1) != (status[book_id] == 'issued'):
+            problems.append(f"book {book_id} is {status[book_id]} with {loans} open loans")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent checkout/checkin stress test")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite', 'http'), default='sqlite')
+    parser.add_argument('--sqlite-path', default='stress.db',
+                        help="scratch SQLite database file (default stress.db)")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--books', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    backend = args.backend
+    options = {}
+    if backend == 'sqlite':
+        options['path'] = args.sqlite_path
+    if backend in ('mysql', 'sqlite'):
+        options['pool_size'] = args.threads
+    try:
+        repo = create_repository(backend, **options)
+        try:
+            book_ids, student_ids = seed(repo, args.books, args.threads)
+            holders = Holders()
+            stop = threading.Event()
+            counts = [Counter() for _ in student_ids]
+            threads = [threading.Thread(target=worker,
+                                        args=(repo, book_ids, student_id, holders, stop, count))
+                       for student_id, count in zip(student_ids, counts)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            problems = verify(repo, book_ids)
+        finally:
+            repo.close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    total = sum(counts, Counter())
+    print(f"{args.threads} threads, {args.books} books, {elapsed:.1f}s")
+    print(f"checkouts {total['checkouts']} ({total['checkouts'] / elapsed:,.0f}/s), "
+          f"checkins {total['checkins']}, conflicts {total['conflicts']}, "
+          f"errors {total['errors']}, lost loans {total['lost_loans']}")
+    if holders.double_issues:
+        problems.append(f"{holders.double_issues} books were issued twice")
+    for problem in problems:
+        print(f"FAIL: {problem}", file=sys.stderr)
+    return 1 if problems or total['lost_loans'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""CatalogCache must answer every catalog view the way the database does.
+
+    python -m pytest test_catalog_cache.py
+"""
+import pytest
+
+from catalog_cache import CatalogCache
+from storage import SQLiteRepository
+
+
+def _execute(repo, sql, params=()):
+    with repo._session() as session:
+        session.execute(sql, params)
+
+
+def _assert_agrees(repo, cache):
+    cache.refresh(force=True)
+    assert cache.categories() == repo.categories()
+    for category in repo.categories():
+        assert cache.books_in_category(category) == repo.books_in_category(category)
+    assert cache.available_books() == repo.available_books()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = SQLiteRepository(str(tmp_path / "catalog.db"), pool_size=2)
+    yield repo
+    repo.close()
+
+
+def test_multi_category_title_matches_sql(repo):
+    # X's copies sit in two categories; its oldest copy decides
+    repo.bulk_insert('books', ('title', 'category'),
+                     [("X", "B"), ("X", "A"), ("Y", "A"), ("X", "C")])
+    cache = CatalogCache(repo)
+    _assert_agrees(repo, cache)
+    assert [row['title'] for row in cache.books_in_category("A")] == ["Y"]
+    assert cache.available_books()[0]['category'] == "B"
+
+    # Recategorising, deleting and renaming the oldest copy hands the
+    # title on to the next oldest
+    _execute(repo, "UPDATE books SET category = %s WHERE book_id = %s", ("D", 1))
+    _assert_agrees(repo, cache)
+    _execute(repo, "DELETE FROM books WHERE book_id = %s", (1,))
+    _assert_agrees(repo, cache)
+    assert [row['title'] for row in cache.books_in_category("A")] == ["X", "Y"]
+    _execute(repo, "UPDATE books SET title = %s WHERE book_id = %s", ("Y", 2))
+    _assert_agrees(repo, cache)
+    assert cache.books_in_category("C") == repo.books_in_category("C") != []
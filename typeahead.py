@@ -0,0 +1,147 @@
+"""Title suggestions under an Entry or Combobox as the user types.
+
+Suggestions come from `fetch(text, limit)`, normally the catalog's
+TitleIndex, as (title, book_ids) pairs. The list drops down under the
+entry; Up/Down move through it, Return or a click chooses, Escape
+closes it. Choosing a title fills the entry and remembers its book ids,
+so the caller can act on them without looking the title up again.
+"""
+import tkinter as tk
+
+DEBOUNCE_MS = 80
+ROWS = 8
+_KEYS = ('Up', 'Down', 'Return', 'KP_Enter', 'Escape', 'Tab')
+
+
+class Typeahead:
+    """Suggestion popup attached to `entry`.
+
+    `run(fn, on_done)` runs `fn` off the Tk thread and calls
+    `on_done(result)` back on it, as for PagedGrid. `on_select(title,
+    book_ids)` is called when the user chooses a suggestion.
+    """
+
+    def __init__(self, entry, fetch, run, on_select=None, limit=ROWS, delay=DEBOUNCE_MS):
+        self.entry = entry
+        self.fetch = fetch
+        self.run = run
+        self.on_select = on_select
+        self.limit = limit
+        self.delay = delay
+        # A sibling of the entry, so it is hidden along with its screen
+        self.listbox = tk.Listbox(entry.master, font=entry.cget('font'),
+                                  height=limit, takefocus=0, exportselection=False)
+        self._suggestions = []
+        self._chosen = None  # (title, book_ids)
+        self._pending = None
+        self._text = None
+
+        entry.bind('<KeyRelease>', self._on_type, add='+')
+        entry.bind('<Down>', lambda e: self._move(1))
+        entry.bind('<Up>', lambda e: self._move(-1))
+        entry.bind('<Return>', self._on_return)
+        entry.bind('<KP_Enter>', self._on_return)
+        entry.bind('<Escape>', lambda e: self.hide())
+        entry.bind('<FocusOut>', lambda e: entry.after(150, self._hide_unless_focused), add='+')
+        self.listbox.bind('<ButtonRelease-1>', self._on_click)
+
+    def book_ids(self):
+        """Book ids of the chosen title, or None if the text was typed."""
+        if self._chosen is not None and self._chosen[0] == self.entry.get():
+            return self._chosen[1]
+        return None
+
+    def set(self, title, book_ids=None):
+        """Fill the entry with `title` as if it had been chosen."""
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, title)
+        self._text = title
+        self._chosen = (title, book_ids) if book_ids is not None else None
+        self.hide()
+
+    def hide(self):
+        if self._pending is not None:
+            self.entry.after_cancel(self._pending)
+            self._pending = None
+        if self.listbox.winfo_exists():
+            self.listbox.place_forget()
+
+    @property
+    def shown(self):
+        return bool(self.listbox.winfo_exists() and self.listbox.winfo_manager())
+
+    def _on_type(self, event):
+        if event.keysym in _KEYS:
+            return
+        text = self.entry.get()
+        if text == self._text:
+            return
+        self._text = text
+        if self._pending is not None:
+            self.entry.after_cancel(self._pending)
+        self._pending = self.entry.after(self.delay, self._request)
+
+    def _request(self):
+        self._pending = None
+        text = self._text
+        if not text.strip():
+            self.hide()
+            return
+
+        def done(suggestions):
+            # Typing moved on while this was in flight
+            if text == self.entry.get():
+                self._show(suggestions)
+
+        self.run(lambda: self.fetch(text, self.limit), done)
+
+    def _show(self, suggestions):
+        self._suggestions = suggestions
+        self.listbox.delete(0, tk.END)
+        if not suggestions or self._focus() != str(self.entry):
+            self.hide()
+            return
+        for title, _ in suggestions:
+            self.listbox.insert(tk.END, title)
+        self.listbox.config(height=len(suggestions))
+        self.listbox.place(in_=self.entry, x=0, rely=1.0, relwidth=1.0)
+        self.listbox.lift()
+
+    def _move(self, step):
+        if not self.shown:
+            return None
+        selection = self.listbox.curselection()
+        index = selection[0] + step if selection else (0 if step > 0 else len(self._suggestions) - 1)
+        index = max(0, min(index, len(self._suggestions) - 1))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        return "break"
+
+    def _choose(self, index):
+        title, book_ids = self._suggestions[index]
+        self.set(title, book_ids)
+        if self.on_select:
+            self.on_select(title, book_ids)
+
+    def _on_return(self, event):
+        selection = self.listbox.curselection() if self.shown else ()
+        if not selection:
+            self.hide()
+            return None
+        self._choose(selection[0])
+        return "break"
+
+    def _on_click(self, event):
+        index = self.listbox.nearest(event.y)
+        if 0 <= index < len(self._suggestions):
+            self._choose(index)
+            self.entry.focus_set()
+
+    def _focus(self):
+        # focus_get() raises for a Combobox's own popdown list
+        return str(self.entry.tk.call('focus'))
+
+    def _hide_unless_focused(self):
+        if self.entry.winfo_exists() and self._focus() not in (str(self.entry), str(self.listbox)):
+            self.hide()